@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Measures end-to-end backend time for a small PDF job: counting, reserving
+quota, running the real backend and settling the reservation. The real backend
+is a stub shell script that drains its standard input and exits.
+
+Privileges are only switched when running as root.
+
+Usage: python benchmarks/backend_latency.py [jobs]
+"""
+
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mug import settings  # noqa: E402
+
+STUB_BACKEND = "#!/bin/sh\ncat > /dev/null\nexit 0\n"
+
+PDF = (
+    b"%PDF-1.4\n"
+    b"1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n"
+    b"2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n"
+    b"3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>\nendobj\n"
+)
+XREF = PDF.index(b"1 0 obj"), PDF.index(b"2 0 obj"), PDF.index(b"3 0 obj")
+PDF += (
+    b"xref\n0 4\n0000000000 65535 f \n"
+    + b"".join(b"%010d 00000 n \n" % offset for offset in XREF)
+    + b"trailer\n<< /Size 4 /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % len(PDF)
+)
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.config = {"sqlite": {"path": os.path.join(tmp, "bench.db")}}
+
+        from mug import connections
+        from mug.backend import CUPSBackend
+        from mug.models import Account
+
+        connections.init_db()
+        session = connections.get_db_session()
+        session.add(Account(username="bench", status="USING_PERSONAL_QUOTA", quota=10**9))
+        session.commit()
+
+        stub = os.path.join(tmp, "stub")
+        with open(stub, "w") as fh:
+            fh.write(STUB_BACKEND)
+        os.chmod(stub, 0o755)
+
+        if os.geteuid() != 0:
+            CUPSBackend.become_root = CUPSBackend.drop_root = staticmethod(lambda: None)
+
+        env = {"CONTENT_TYPE": "application/pdf"}
+        argv = [os.path.join(tmp, "mug"), "1", "bench", "bench", "1", ""]
+
+        times = []
+        for _ in range(jobs):
+            os.environ.update(DEVICE_URI="mug://stub:/", CUPS_FILETYPE="document")
+            start = time.perf_counter()
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+                    devnull
+                ), contextlib.redirect_stderr(devnull):
+                    CUPSBackend(argv, env, io.BytesIO(PDF)).dispatch()
+            except SystemExit as e:
+                if e.code:
+                    raise
+            times.append(time.perf_counter() - start)
+
+        print(
+            f"median {statistics.median(times) * 1000:.2f} ms"
+            f"  max {max(times) * 1000:.2f} ms  ({jobs} jobs)"
+        )
+
+
+if __name__ == "__main__":
+    main()
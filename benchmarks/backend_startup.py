@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+"""
+Startup-time regression check for the CUPS backend entry point.
+
+CUPS starts the backend as a new interpreter for every job, so its import cost
+is paid per job. This runs the backend's usage path (no arguments) and a bare
+`import mug.backend` under `python -X importtime` several times, and fails
+with a non-zero exit status if
+
+  - the total import time (interpreter startup included) exceeds the budget, or
+  - any heavy module (SQLAlchemy, pdfrw, toml...) was imported on those paths.
+
+Usage: python benchmarks/backend_startup.py [budget-ms]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median total import time allowed, in milliseconds
+DEFAULT_BUDGET_MS = 40
+
+RUNS = 7
+
+# Modules that must only be loaded by the code paths that need them
+HEAVY_MODULES = ("sqlalchemy", "sqlalchemy_serializer", "pdfrw", "toml", "mug.models")
+
+PATHS = {
+    "import": ["-c", "import mug.backend"],
+    "usage": [os.path.join(ROOT, "mug", "backend.py")],
+}
+
+
+def importtime(args: list) -> tuple:
+    """
+    Returns the total import time (ms) of the run, interpreter startup included,
+    and the names of all imported modules
+    """
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + args,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+    total = 0.0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        # Nested imports are indented and already part of their parent's time
+        if not name[1:].startswith(" "):
+            total += int(cumulative_us) / 1000
+        modules.add(name.strip())
+
+    return total, modules
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_BUDGET_MS
+    failed = False
+
+    for path, args in PATHS.items():
+        times = []
+        modules = set()
+        for _ in range(RUNS):
+            elapsed, imported = importtime(args)
+            times.append(elapsed)
+            modules |= imported
+
+        median = statistics.median(times)
+        heavy = sorted(
+            m for m in modules if any(m == h or m.startswith(h + ".") for h in HEAVY_MODULES)
+        )
+
+        print(f"{path:>6}: median {median:.1f} ms (budget {budget:.0f} ms)")
+        if median > budget:
+            print(f"FAIL: {path} path is over the startup budget")
+            failed = True
+        if heavy:
+            print(f"FAIL: {path} path imported {', '.join(heavy)}")
+            failed = True
+
+    exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
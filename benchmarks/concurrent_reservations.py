@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+"""
+Runs many backend-like processes that reserve and settle pages against the same
+account at the same time, then checks that no update was lost and that the
+quota was never overspent. In group mode every process prints as a different
+member of one group, sharing the group's quota.
+
+Set MUG_DATABASE_URL (e.g. postgresql://mug@localhost/mug_bench) to run against
+a database server instead of a temporary SQLite file. Its Mug tables are
+dropped and created again first.
+
+Usage: python benchmarks/concurrent_reservations.py [processes] [jobs-per-process] [group]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mug import settings  # noqa: E402
+
+
+def get_config(db: str) -> dict:
+    config = {"sqlite": {"path": db}}
+    if os.environ.get("MUG_DATABASE_URL"):
+        config["database"] = {"url": os.environ["MUG_DATABASE_URL"]}
+    return config
+
+
+def worker(db: str, username: str, jobs: int, results):
+    settings.config = get_config(db)
+
+    from mug import connections, quota
+
+    conn = connections.get_raw_connection()
+    printed = rejected = 0
+    for i in range(jobs):
+        reservation = quota.reserve(conn, username, 1)
+        if reservation is None:
+            rejected += 1
+        elif i % 10 == 0:
+            reservation.release()  # every tenth job "fails" at the printer
+        else:
+            reservation.confirm()
+            printed += 1
+    results.put((printed, rejected))
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    group = len(sys.argv) > 3 and sys.argv[3] == "group"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        settings.config = get_config(db)
+
+        from mug import connections
+        from mug.models import Account, Base, Group, GroupUsage
+
+        quota_pages = processes * jobs // 2
+        if not connections.is_sqlite():
+            Base.metadata.drop_all(connections._get_db_engine())
+            connections.get_raw_connection().execute("DROP TABLE IF EXISTS schema_version")
+        connections.init_db()
+        session = connections.get_db_session()
+        if group:
+            usernames = [f"bench{i}" for i in range(processes)]
+            session.add(Group(gid=1, name="bench", page_count=quota_pages))
+            for username in usernames:
+                session.add(Account(username=username, gid=1, status="USING_GROUP_QUOTA", quota=0))
+        else:
+            usernames = ["bench"] * processes
+            session.add(Account(username="bench", status="USING_PERSONAL_QUOTA", quota=quota_pages))
+        session.commit()
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(target=worker, args=(db, username, jobs, results))
+            for username in usernames
+        ]
+        start = time.perf_counter()
+        for w in workers:
+            w.start()
+        outcomes = [results.get() for _ in workers]
+        for w in workers:
+            w.join()
+        elapsed = time.perf_counter() - start
+
+        printed = sum(p for p, _ in outcomes)
+        rejected = sum(r for _, r in outcomes)
+        if group:
+            stored = session.query(GroupUsage).filter(GroupUsage.gid == 1).one().pages_printed
+            members = sum(a.pages_printed for a in session.query(Account))
+        else:
+            stored = members = (
+                session.query(Account).filter(Account.username == "bench").one().pages_printed
+            )
+
+        total = processes * jobs
+        print(f"{total} jobs in {elapsed:.2f} s ({total / elapsed:.0f} jobs/s)")
+        print(f"printed {printed}, rejected {rejected}, pages_printed {stored}, quota {quota_pages}")
+        if stored != printed or members != printed or stored > quota_pages:
+            print("FAIL: lost updates or overspent quota")
+            exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
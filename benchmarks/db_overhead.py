@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Measures the database overhead of a single print job, the way the backend pays
+it: in a fresh process, looking up a user's remaining pages and then accounting
+for the job.
+
+  before: a new engine and sessionmaker, then the two queries through the ORM
+  after:  the cached raw sqlite3 connection with pragmas applied
+
+Usage: python benchmarks/db_overhead.py [jobs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+JOB = r"""
+import sys, time
+sys.path.insert(0, {root!r})
+from mug import settings
+settings.config = {{"sqlite": {{"path": {db!r}}}}}
+from mug import connections
+from mug.models import Account
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+start = time.perf_counter()
+if {mode!r} == "before":
+    session = sessionmaker(bind=create_engine("sqlite:///{db}"))()
+    account = session.query(Account).filter(Account.username == "bench").first()
+    allowed = account.quota - account.pages_printed
+    account = session.query(Account).filter(Account.username == "bench").first()
+    account.pages_printed += 1
+    session.commit()
+else:
+    db = connections.get_raw_connection()
+    db.execute(
+        "SELECT quota - COALESCE(pages_printed, 0) FROM account WHERE username = 'bench'"
+    ).fetchone()
+    db.execute(
+        "UPDATE account SET pages_printed = COALESCE(pages_printed, 0) + 1 WHERE username = 'bench'"
+    )
+print(time.perf_counter() - start)
+"""
+
+
+def run(mode: str, db: str, jobs: int) -> list:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = JOB.format(root=root, db=db, mode=mode)
+    return [
+        float(subprocess.check_output([sys.executable, "-c", code]))
+        for _ in range(jobs)
+    ]
+
+
+def main():
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    from mug import settings
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, "bench.db")
+        settings.config = {"sqlite": {"path": db}}
+
+        from mug import connections
+        from mug.models import Account
+
+        connections.init_db()
+        session = connections.get_db_session()
+        session.add(Account(username="bench", status="USING_PERSONAL_QUOTA", quota=10**9))
+        session.commit()
+
+        for mode in ("before", "after"):
+            times = run(mode, db, jobs)
+            print(
+                f"{mode:>6}: median {statistics.median(times) * 1000:.2f} ms"
+                f"  max {max(times) * 1000:.2f} ms  ({jobs} jobs)"
+            )
+
+
+if __name__ == "__main__":
+    main()
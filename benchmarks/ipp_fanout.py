@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Fans out IPP_GET_JOB_ATTRIBUTES requests to a stub IPP server (in its own
+process) which takes a few milliseconds to answer each of them, as cupsd does
+when it looks jobs up:
+
+  CUPS:      pkipplib.CUPS, one request after the other
+  AsyncCUPS: pkipp.aiocups.AsyncCUPS, all the requests gathered at once, with
+             its default limit of concurrent requests and a larger one
+
+Usage: python benchmarks/ipp_fanout.py [requests] [delay in ms]
+"""
+
+import asyncio
+import http.server
+import multiprocessing
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkipp import pkipplib  # noqa: E402
+from pkipp.aiocups import DEFAULT_LIMIT, AsyncCUPS  # noqa: E402
+
+
+def make_response(request_id: int, job_id: int) -> bytes:
+    response = pkipplib.IPPRequest(operation_id=pkipplib.IPP_OK, request_id=request_id)
+    response.operation["attributes-charset"] = ("charset", "utf-8")
+    response.operation["attributes-natural-language"] = ("naturalLanguage", "en-us")
+    response.job["job-id"] = ("integer", job_id)
+    response.job["job-uri"] = ("uri", f"ipp://localhost/jobs/{job_id}")
+    response.job["job-name"] = ("nameWithoutLanguage", f"handout-{job_id}.pdf")
+    response.job["job-originating-user-name"] = ("nameWithoutLanguage", "student")
+    response.job["job-state"] = ("enum", 5)
+    response.job["job-media-sheets-completed"] = ("integer", job_id % 20)
+    return response.dump()
+
+
+class StubIPPServer(http.server.ThreadingHTTPServer):
+    # Room for all the connections opened at once
+    request_queue_size = 128
+
+
+def serve(port, delay):
+    class StubIPPHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            request = pkipplib.IPPRequest(body)
+            request.parse()
+            job_id = int(request.operation["job-uri"][0][1].rsplit(b"/", 1)[1])
+            time.sleep(delay)
+            data = make_response(request.request_id, job_id)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/ipp")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    StubIPPServer(("127.0.0.1", port), StubIPPHandler).serve_forever()
+
+
+def job_ids(answers):
+    return [answer.job["job-id"][0][1] for answer in answers]
+
+
+def run_sync(url, jobs):
+    cups = pkipplib.CUPS(url=url)
+    start = time.perf_counter()
+    answers = [cups.getJobAttributes(job) for job in jobs]
+    elapsed = time.perf_counter() - start
+    cups.close()
+    return elapsed, job_ids(answers)
+
+
+async def run_async(url, jobs, limit):
+    cups = AsyncCUPS(url=url, limit=limit)
+    start = time.perf_counter()
+    answers = await asyncio.gather(*[cups.getJobAttributes(job) for job in jobs])
+    elapsed = time.perf_counter() - start
+    await cups.close()
+    assert None not in answers, cups.lastErrorMessage
+    return elapsed, job_ids(answers)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    delay = (float(sys.argv[2]) if len(sys.argv) > 2 else 5) / 1000
+    port = 16310 + os.getpid() % 1000
+    url = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=serve, args=(port, delay), daemon=True)
+    server.start()
+
+    try:
+        cups = pkipplib.CUPS(url=url)
+        for _ in range(100):
+            if cups.getJobAttributes(1) is not None:
+                break
+            time.sleep(0.05)
+        round_trip, _ = run_sync(url, [1] * 20)
+        print(f"{requests} requests, one round trip {round_trip / 20 * 1000:.1f} ms")
+
+        jobs = list(range(1, requests + 1))
+        elapsed, expected = run_sync(url, jobs)
+        print(f"  CUPS                {elapsed * 1000:8.1f} ms")
+        for limit in (DEFAULT_LIMIT, 64):
+            elapsed, answers = asyncio.run(run_async(url, jobs, limit))
+            assert answers == expected, "answers differ"
+            print(f"  AsyncCUPS limit {limit:<3} {elapsed * 1000:8.1f} ms")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
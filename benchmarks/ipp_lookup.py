@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""
+Measures attribute lookups on CUPS_GET_PPDS-like responses of a growing number
+of groups, checking that they give the same values:
+
+  scan:    looking through every group for each lookup, as FakeAttribute did
+  indexed: IPPRequest.parse, and lookups in the index of the groups
+  lazy:    IPPRequest.parse(lazy=True), which only decodes the values looked up
+
+"getPPDs" parses the response and looks up four attributes of every PPD, as
+CUPS.getPPDs does; "per queue" looks up an attribute of each group in turn,
+which was quadratic in the number of groups.
+
+Usage: python benchmarks/ipp_lookup.py [groups ...]
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkipp import pkipplib  # noqa: E402
+
+FIELDS = ("ppd-natural-language", "ppd-make", "ppd-make-and-model", "ppd-name")
+
+
+def scan_lookup(request, attrtype, key):
+    """FakeAttribute.__getitem__ before the index"""
+    answer = []
+    for attribute in getattr(request, "_%s_attributes" % attrtype):
+        for (attrname, attrvalue) in attribute:
+            if attrname == key:
+                answer.extend(attrvalue)
+    if answer:
+        return answer
+    raise KeyError(key)
+
+
+def indexed_lookup(request, attrtype, key):
+    return getattr(request, attrtype)[key]
+
+
+def ppds_response(count: int) -> bytes:
+    response = pkipplib.IPPRequest(operation_id=pkipplib.IPP_OK, request_id=1)
+    response._operation_attributes = [
+        [
+            ("attributes-charset", [("charset", "utf-8")]),
+            ("attributes-natural-language", [("naturalLanguage", "en-us")]),
+        ]
+    ]
+    response._printer_attributes = [
+        [
+            ("ppd-natural-language", [("naturalLanguage", "en")]),
+            ("ppd-make", [("textWithoutLanguage", f"Maker {i % 30}")]),
+            ("ppd-make-and-model", [("textWithoutLanguage", f"Maker {i % 30} Model {i} PS")]),
+            ("ppd-device-id", [("textWithoutLanguage", f"MFG:Maker {i % 30};MDL:Model {i};")]),
+            ("ppd-product", [("textWithoutLanguage", f"(Model {i})")]),
+            ("ppd-psversion", [("textWithoutLanguage", "(3010.000) 0")]),
+            ("ppd-type", [("keyword", "postscript")]),
+            ("ppd-model-number", [("integer", i)]),
+            ("ppd-name", [("nameWithoutLanguage", f"drv:///maker/model{i}.ppd")]),
+        ]
+        for i in range(count)
+    ]
+    return response.dump()
+
+
+def get_ppds(data, lookup, lazy):
+    answer = pkipplib.IPPRequest(data)
+    answer.parse(lazy)
+    return list(zip(*[[d[1] for d in lookup(answer, "printer", field)] for field in FIELDS]))
+
+
+def per_queue(data, lookup, lazy):
+    answer = pkipplib.IPPRequest(data)
+    answer.parse(lazy)
+    count = len(lookup(answer, "printer", "ppd-name"))
+    return [lookup(answer, "printer", "ppd-name")[i][1] for i in range(count)]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000]
+    methods = (("scan", scan_lookup, False), ("indexed", indexed_lookup, False), ("lazy", indexed_lookup, True))
+
+    print(f"{'groups':>7} {'workload':<9}" + "".join(f"{name:>12}" for name, _, _ in methods))
+    for count in counts:
+        data = ppds_response(count)
+        for label, workload in (("getPPDs", get_ppds), ("per queue", per_queue)):
+            results = [timed(workload, data, lookup, lazy) for _, lookup, lazy in methods]
+            assert all(result == results[0][0] for result, _ in results), f"{label}: lookups differ"
+            print(f"{count:>7} {label:<9}" + "".join(f"{elapsed * 1000:9.1f} ms" for _, elapsed in results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+"""
+Compares IPPRequest.parse with the parser it replaced (kept below as
+LegacyIPPRequest) on large responses, checking that they give the same
+attributes:
+
+  printers: a CUPS_GET_PRINTERS response, one group of attributes per printer
+  jobs:     an IPP_GET_JOBS response, one group of attributes per job
+
+Usage: python benchmarks/ipp_parse.py [printers] [jobs]
+"""
+
+import os
+import sys
+import time
+from struct import unpack
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkipp import pkipplib  # noqa: E402
+
+
+class LegacyIPPRequest(pkipplib.IPPRequest):
+    """IPPRequest with the previous parser: getattr dispatch, a slice and an
+    unpack per field and a debug message formatted for every attribute"""
+
+    def parse(self):
+        self._curname = None
+        self._curattributes = None
+
+        self.setVersion((self._data[0], self._data[1]))
+        self.setOperationId(unpack(">H", self._data[2:4])[0])
+        self.setRequestId(unpack(">I", self._data[4:8])[0])
+        self.position = 8
+        endofattributes = self.tagvalues["end-of-attributes-tag"]
+        maxdelimiter = self.tagvalues["event_notification-attributes-tag"]
+        nulloffset = lambda: 0  # noqa: E731
+        try:
+            tag = self._data[self.position]
+            while tag != endofattributes:
+                self.position += 1
+                name = self.tags[tag]
+                if name is not None:
+                    func = getattr(self, name.replace("-", "_"), nulloffset)
+                    self.position += func()
+                    if self._data[self.position] > maxdelimiter:
+                        self.position -= 1
+                        continue
+                oldtag = tag
+                tag = self._data[self.position]
+                if tag == oldtag:
+                    self._curattributes.append([])
+        except IndexError:
+            raise pkipplib.IPPError("Unexpected end of IPP message.")
+
+        self.data = self._data[self.position + 1 :]
+        self.parsed = True
+
+    def parseTag(self):
+        pos = self.position
+        tagtype = self.tags[self._data[pos]]
+        pos += 1
+        posend = pos2 = pos + 2
+        namelength = unpack(">H", self._data[pos:pos2])[0]
+        if not namelength:
+            name = self._curname
+        else:
+            posend += namelength
+            self._curname = name = self._data[pos2:posend].decode()
+        pos2 = posend + 2
+        valuelength = unpack(">H", self._data[posend:pos2])[0]
+        posend = pos2 + valuelength
+        value = self._data[pos2:posend]
+        if tagtype in ("integer", "enum"):
+            value = unpack(">I", value)[0]
+        elif tagtype == "boolean":
+            value = ord(value)
+        try:
+            (oldname, oldval) = self._curattributes[-1][-1]
+            if oldname == name:
+                oldval.append((tagtype, value))
+            else:
+                raise IndexError
+        except IndexError:
+            self._curattributes[-1].append((name, [(tagtype, value)]))
+        self.logDebug("%s(%s) : %s" % (name, tagtype, value))
+        return posend - self.position
+
+    def _group(self, attrtype):
+        self._curattributes = getattr(self, "_%s_attributes" % attrtype)
+        return self.parseTag()
+
+    def operation_attributes_tag(self):
+        return self._group("operation")
+
+    def job_attributes_tag(self):
+        return self._group("job")
+
+    def printer_attributes_tag(self):
+        return self._group("printer")
+
+    def unsupported_attributes_tag(self):
+        return self._group("unsupported")
+
+    def subscription_attributes_tag(self):
+        return self._group("subscription")
+
+    def event_notification_attributes_tag(self):
+        return self._group("event_notification")
+
+
+def new_response():
+    response = pkipplib.IPPRequest(operation_id=pkipplib.IPP_OK, request_id=1)
+    response._operation_attributes = [
+        [
+            ("attributes-charset", [("charset", "utf-8")]),
+            ("attributes-natural-language", [("naturalLanguage", "en-us")]),
+        ]
+    ]
+    return response
+
+
+def printers_response(count: int) -> bytes:
+    response = new_response()
+    response._printer_attributes = [
+        [
+            ("printer-name", [("nameWithoutLanguage", f"lab-{i:04d}")]),
+            ("printer-uri-supported", [("uri", f"ipp://localhost/printers/lab-{i:04d}")]),
+            ("printer-info", [("textWithoutLanguage", f"Laser printer {i} in room {i % 40}")]),
+            ("printer-location", [("textWithoutLanguage", f"Building {i % 7}")]),
+            ("printer-make-and-model", [("textWithoutLanguage", "Generic PostScript Printer")]),
+            ("printer-state", [("enum", pkipplib.IPP_PRINTER_IDLE)]),
+            ("printer-state-reasons", [("keyword", "none")]),
+            ("printer-is-accepting-jobs", [("boolean", 1)]),
+            ("printer-type", [("enum", 0x801C)]),
+            ("queued-job-count", [("integer", i % 5)]),
+            (
+                "document-format-supported",
+                [
+                    ("mimeMediaType", "application/pdf"),
+                    ("mimeMediaType", "application/postscript"),
+                    ("mimeMediaType", "application/vnd.cups-raster"),
+                    ("mimeMediaType", "image/pwg-raster"),
+                ],
+            ),
+            (
+                "media-supported",
+                [("keyword", media) for media in ("iso_a4_210x297mm", "na_letter_8.5x11in", "iso_a3_297x420mm")],
+            ),
+            ("sides-supported", [("keyword", "one-sided"), ("keyword", "two-sided-long-edge")]),
+            ("color-supported", [("boolean", i % 2)]),
+            ("printer-up-time", [("integer", 1700000000 + i)]),
+        ]
+        for i in range(count)
+    ]
+    return response.dump()
+
+
+def jobs_response(count: int) -> bytes:
+    response = new_response()
+    response._job_attributes = [
+        [
+            ("job-id", [("integer", i)]),
+            ("job-uri", [("uri", f"ipp://localhost/jobs/{i}")]),
+            ("job-printer-uri", [("uri", f"ipp://localhost/printers/lab-{i % 100:04d}")]),
+            ("job-name", [("nameWithoutLanguage", f"handout-{i}.pdf")]),
+            ("job-originating-user-name", [("nameWithoutLanguage", f"user{i % 500:04d}")]),
+            ("job-state", [("enum", 9)]),
+            ("job-state-reasons", [("keyword", "job-completed-successfully")]),
+            ("job-k-octets", [("integer", i % 900 + 1)]),
+            ("job-media-sheets-completed", [("integer", i % 20)]),
+            ("time-at-creation", [("integer", 1700000000 + i)]),
+            ("time-at-completed", [("integer", 1700000060 + i)]),
+            ("document-format", [("mimeMediaType", "application/pdf")]),
+        ]
+        for i in range(count)
+    ]
+    return response.dump()
+
+
+def parse(cls, data):
+    request = cls(data)
+    request.parse()
+    return request
+
+
+def attributes(request):
+    return (
+        request.version,
+        request.operation_id,
+        request.request_id,
+        request.data,
+        [getattr(request, "_%s_attributes" % attrtype) for attrtype in request.attributes_types],
+    )
+
+
+def best_of(repeat, cls, data):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(cls, data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(label, data, repeat=5):
+    legacy = parse(LegacyIPPRequest, data)
+    request = parse(pkipplib.IPPRequest, data)
+    assert attributes(request) == attributes(legacy), f"{label}: parsers disagree"
+    values = sum(
+        len(values)
+        for attrtype in request.attributes_types
+        for group in getattr(request, "_%s_attributes" % attrtype)
+        for _, values in group
+    )
+    # Large results left alive slow down the garbage collector for both
+    del legacy, request
+
+    legacy_time = best_of(repeat, LegacyIPPRequest, data)
+    fast_time = best_of(repeat, pkipplib.IPPRequest, data)
+    print(f"{label}: {len(data) / 1024:.0f} KiB, {values} values")
+    for name, elapsed in (("legacy", legacy_time), ("parse", fast_time)):
+        print(f"  {name:<8} {elapsed * 1000:8.1f} ms  {values / elapsed / 1e6:6.2f}M values/s")
+    print(f"  speed-up {legacy_time / fast_time:8.2f}x")
+
+
+def main():
+    printers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    compare("CUPS_GET_PRINTERS", printers_response(printers))
+    compare("IPP_GET_JOBS", jobs_response(jobs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Measures IPP requests per second through pkipp's CUPS client, against a stub
+IPP server (in its own process) that answers every request with a small
+printer attributes response:
+
+  fresh:  a new connection for every request, as when doRequest created a new
+          PoolManager each time
+  pooled: the client's keep-alive connection pool, over TCP
+  socket: the same, over a Unix domain socket (like /run/cups/cups.sock)
+
+Usage: python benchmarks/ipp_requests.py [requests]
+"""
+
+import http.server
+import multiprocessing
+import os
+import socketserver
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkipp import pkipplib  # noqa: E402
+
+
+def make_response(request_id: int) -> bytes:
+    response = pkipplib.IPPRequest(operation_id=pkipplib.IPP_OK, request_id=request_id)
+    response.operation["attributes-charset"] = ("charset", "utf-8")
+    response.operation["attributes-natural-language"] = ("naturalLanguage", "en-us")
+    response.printer["printer-name"] = ("nameWithoutLanguage", "bench")
+    response.printer["printer-uri-supported"] = ("uri", "ipp://localhost/printers/bench")
+    response.printer["printer-state"] = ("enum", pkipplib.IPP_PRINTER_IDLE)
+    return response.dump()
+
+
+class StubIPPHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would
+    # delay on a kept-alive connection (as cupsd, it sets TCP_NODELAY)
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        data = make_response(int.from_bytes(body[4:8], "big"))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ipp")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class UnixStubIPPHandler(StubIPPHandler):
+    # Not a TCP socket
+    disable_nagle_algorithm = False
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address):
+    if isinstance(address, str):
+        server = UnixHTTPServer(address, UnixStubIPPHandler)
+    else:
+        server = http.server.ThreadingHTTPServer(address, StubIPPHandler)
+    server.serve_forever()
+
+
+def wait_for(cups):
+    for _ in range(100):
+        if cups.getDefault() is not None:
+            return
+        time.sleep(0.05)
+    raise RuntimeError(f"stub server not answering: {cups.lastErrorMessage}")
+
+
+def run(label, cups, requests, fresh=False):
+    wait_for(cups)
+    start = time.perf_counter()
+    for _ in range(requests):
+        if fresh:
+            cups.close()
+        answer = cups.getDefault()
+        assert answer is not None and answer.printer["printer-name"], cups.lastErrorMessage
+    elapsed = time.perf_counter() - start
+    print(f"{label:<8} {requests / elapsed:8.0f} requests/s  ({elapsed / requests * 1e6:.0f} us each)")
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        socket_path = os.path.join(tmp, "cups.sock")
+        port = 16310 + os.getpid() % 1000
+        servers = [
+            multiprocessing.Process(target=serve, args=(("127.0.0.1", port),), daemon=True),
+            multiprocessing.Process(target=serve, args=(socket_path,), daemon=True),
+        ]
+        for server in servers:
+            server.start()
+
+        try:
+            url = f"http://127.0.0.1:{port}"
+            run("fresh", pkipplib.CUPS(url=url), requests, fresh=True)
+            run("pooled", pkipplib.CUPS(url=url), requests)
+            run("socket", pkipplib.CUPS(url=f"unix://{socket_path}"), requests)
+        finally:
+            for server in servers:
+                server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Compares a buffered and a streamed IPP_GET_JOBS request through pkipp's CUPS
+client, against a stub IPP server (in its own process) retaining many jobs:
+
+  buffered: CUPS.doRequest, which reads and parses the whole answer first
+  streamed: CUPS.iterJobs, which yields each job as its group is received
+
+Each job is turned into a dictionary and discarded. The time to the first job,
+the total time and the peak memory allocated by the client are reported.
+
+Usage: python benchmarks/ipp_stream.py [jobs]
+"""
+
+import http.server
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pkipp import pkipplib  # noqa: E402
+
+
+def jobs_response(count: int) -> bytes:
+    response = pkipplib.IPPRequest(operation_id=pkipplib.IPP_OK, request_id=1)
+    response._operation_attributes = [
+        [
+            ("attributes-charset", [("charset", "utf-8")]),
+            ("attributes-natural-language", [("naturalLanguage", "en-us")]),
+        ]
+    ]
+    response._job_attributes = [
+        [
+            ("job-id", [("integer", i)]),
+            ("job-uri", [("uri", f"ipp://localhost/jobs/{i}")]),
+            ("job-printer-uri", [("uri", f"ipp://localhost/printers/lab-{i % 100:04d}")]),
+            ("job-name", [("nameWithoutLanguage", f"handout-{i}.pdf")]),
+            ("job-originating-user-name", [("nameWithoutLanguage", f"user{i % 500:04d}")]),
+            ("job-state", [("enum", 9)]),
+            ("job-state-reasons", [("keyword", "job-completed-successfully")]),
+            ("job-k-octets", [("integer", i % 900 + 1)]),
+            ("job-media-sheets-completed", [("integer", i % 20)]),
+            ("time-at-creation", [("integer", 1700000000 + i)]),
+            ("time-at-completed", [("integer", 1700000060 + i)]),
+            ("document-format", [("mimeMediaType", "application/pdf")]),
+        ]
+        for i in range(count)
+    ]
+    return response.dump()
+
+
+def serve(port, count):
+    data = jobs_response(count)
+
+    class StubIPPHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "application/ipp")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            # As cupsd, which writes the answer out as it encodes it
+            for start in range(0, len(data), 16384):
+                self.wfile.write(data[start : start + 16384])
+
+        def log_message(self, *args):
+            pass
+
+    http.server.ThreadingHTTPServer(("127.0.0.1", port), StubIPPHandler).serve_forever()
+
+
+def buffered(cups):
+    req = cups.newRequest(pkipplib.IPP_GET_JOBS)
+    req.operation["printer-uri"] = ("uri", cups.serverURI())
+    req.operation["which-jobs"] = ("keyword", "all")
+    answer = cups.doRequest(req)
+    for attributes in answer._job_attributes:
+        yield dict(attributes)
+
+
+def streamed(cups):
+    return cups.iterJobs(which="all")
+
+
+def run(cups, jobs):
+    start = time.perf_counter()
+    first = None
+    count = 0
+    last = None
+    for job in jobs(cups):
+        if first is None:
+            first = time.perf_counter() - start
+        count += 1
+        last = job
+    return first, time.perf_counter() - start, count, last
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    port = 16310 + os.getpid() % 1000
+    server = multiprocessing.Process(target=serve, args=(port, count), daemon=True)
+    server.start()
+
+    try:
+        cups = pkipplib.CUPS(url=f"http://127.0.0.1:{port}")
+        for _ in range(200):
+            if cups.getDefault() is not None:
+                break
+            time.sleep(0.05)
+
+        results = {}
+        for label, jobs in (("buffered", buffered), ("streamed", streamed)):
+            first, total, received, last = run(cups, jobs)
+            tracemalloc.start()
+            run(cups, jobs)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[label] = (received, last)
+            print(
+                f"{label:<9} {received} jobs  first after {first * 1000:7.1f} ms"
+                f"  all after {total * 1000:7.1f} ms  peak {peak / 2 ** 20:6.1f} MiB"
+            )
+        assert results["buffered"] == results["streamed"], "jobs differ"
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+Compares the PDF page counting engines (see mug.pagecount) over a generated corpus:
+
+  small        a few pages, classic xref table
+  huge         a few pages padded with a large content stream
+  many-pages   a large page tree
+  incremental  an incremental update that removes pages (stale page objects
+               are left behind in the file)
+  objstm       objects in a compressed object stream, with an xref stream
+  linearized   a linearized (fast web view) file
+
+Every engine is run on every file in a fresh process, which reports the page
+count, the time spent counting and its peak RSS. The report shows throughput
+(MB/s of file counted), peak RSS and whether the engine agreed with the
+expected page count ("-" when it declined the file).
+
+Usage: python benchmarks/pagecount_engines.py [huge-size-MB] [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_HUGE_MB = 256
+DEFAULT_RUNS = 3
+
+COUNT = r"""
+import re, sys, time
+sys.path.insert(0, {root!r})
+from mug import pagecount
+
+start = time.perf_counter()
+try:
+    pages = pagecount.count_pages({path!r}, [{engine!r}])
+except pagecount.PageCountError:
+    pages = None
+elapsed = time.perf_counter() - start
+# Peak RSS of this process; unlike ru_maxrss it doesn't carry over the parent's
+with open("/proc/self/status") as fh:
+    rss = re.search(r"VmHWM:\s*(\d+)", fh.read()).group(1)
+print(pages, elapsed, rss)
+"""
+
+
+#
+#  Corpus
+#
+
+
+def page_tree(pages: int, first: int = 1) -> dict:
+    """Catalog, page tree and page objects, numbered from `first`"""
+
+    catalog, root = first, first + 1
+    kids = [root + 1 + i for i in range(pages)]
+    objs = {
+        catalog: b"<< /Type /Catalog /Pages %d 0 R >>" % root,
+        root: b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % k for k in kids), pages),
+    }
+    for k in kids:
+        objs[k] = b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] >>" % root
+    return objs
+
+
+def classic(objs: dict, root: int, header: bytes = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n") -> tuple:
+    """A file with a classic xref table; returns it and its objects' offsets"""
+
+    out = bytearray(header)
+    offsets = {}
+    for num in sorted(objs):
+        offsets[num] = len(out)
+        out += b"%d 0 obj\n" % num + objs[num] + b"\nendobj\n"
+
+    xref = len(out)
+    size = max(objs) + 1
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % size
+    for num in range(1, size):
+        if num in offsets:
+            out += b"%010d 00000 n \n" % offsets[num]
+        else:
+            out += b"0000000000 00000 f \n"
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (size, root, xref)
+    return out, offsets, xref
+
+
+def make_small() -> tuple:
+    return bytes(classic(page_tree(5), 1)[0]), 5
+
+
+def make_huge(size_mb: int) -> tuple:
+    objs = page_tree(3)
+    content = max(objs) + 1
+    data = b"0 0 m 612 792 l S\n" * (size_mb * 1024 * 1024 // 18)
+    objs[content] = b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+    return bytes(classic(objs, 1)[0]), 3
+
+
+def make_many_pages() -> tuple:
+    return bytes(classic(page_tree(5000), 1)[0]), 5000
+
+
+def make_incremental() -> tuple:
+    out, _, xref = classic(page_tree(20), 1)
+    update = len(out)
+    kids = b" ".join(b"%d 0 R" % (3 + i) for i in range(8))
+    out += b"2 0 obj\n<< /Type /Pages /Kids [%s] /Count 8 >>\nendobj\n" % kids
+    xref2 = len(out)
+    out += (
+        b"xref\n0 1\n0000000000 65535 f \n2 1\n%010d 00000 n \n"
+        b"trailer\n<< /Size 23 /Root 1 0 R /Prev %d >>\nstartxref\n%d\n%%%%EOF\n"
+        % (update, xref, xref2)
+    )
+    return bytes(out), 8
+
+
+def make_objstm() -> tuple:
+    objs = page_tree(40)
+    nums = sorted(objs)
+    stream, xref_num = max(objs) + 1, max(objs) + 2
+
+    header = b" ".join(b"%d %d" % (num, sum(len(objs[n]) + 1 for n in nums[:i])) for i, num in enumerate(nums)) + b"\n"
+    data = zlib.compress(header + b"".join(objs[n] + b"\n" for n in nums))
+
+    out = bytearray(b"%PDF-1.5\n")
+    stream_offset = len(out)
+    out += (
+        b"%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Length %d /Filter /FlateDecode >>\nstream\n"
+        % (stream, len(nums), len(header), len(data))
+        + data
+        + b"\nendstream\nendobj\n"
+    )
+
+    # Xref stream rows of widths [1 3 2], PNG Up predicted
+    xref_offset = len(out)
+    rows = bytearray()
+    previous = bytes(6)
+    for num in range(xref_num + 1):
+        if num == 0:
+            row = bytes([0, 0, 0, 0, 0xFF, 0xFF])
+        elif num in objs:
+            row = bytes([2]) + stream.to_bytes(3, "big") + nums.index(num).to_bytes(2, "big")
+        else:
+            offset = stream_offset if num == stream else xref_offset
+            row = bytes([1]) + offset.to_bytes(3, "big") + bytes(2)
+        rows += bytes([2]) + bytes((a - b) & 0xFF for a, b in zip(row, previous))
+        previous = row
+    data = zlib.compress(bytes(rows))
+    out += (
+        b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 3 2] /Root 1 0 R /Filter /FlateDecode "
+        b"/DecodeParms << /Predictor 12 /Columns 6 >> /Length %d >>\nstream\n"
+        % (xref_num, xref_num + 1, len(data))
+        + data
+        + b"\nendstream\nendobj\nstartxref\n%d\n%%%%EOF\n" % xref_offset
+    )
+    return bytes(out), 40
+
+
+def make_linearized() -> tuple:
+    pages = 30
+    objs = page_tree(pages, first=2)
+    # The lengths are zero padded so the dictionary's size doesn't depend on them
+    objs[1] = b"<< /Linearized 1 /L 0000000000 /N %d /O 4 /E 0 /T 0 /H [0 0] >>" % pages
+    out, _, _ = classic(objs, 2)
+    return bytes(out).replace(b"/L 0000000000", b"/L %010d" % len(out), 1), pages
+
+
+def make_corpus(directory: str, huge_mb: int) -> list:
+    corpus = [
+        ("small", make_small()),
+        ("huge", make_huge(huge_mb)),
+        ("many-pages", make_many_pages()),
+        ("incremental", make_incremental()),
+        ("objstm", make_objstm()),
+        ("linearized", make_linearized()),
+    ]
+
+    files = []
+    for name, (data, pages) in corpus:
+        path = os.path.join(directory, name + ".pdf")
+        with open(path, "wb") as fh:
+            fh.write(data)
+        files.append((name, path, pages))
+    return files
+
+
+#
+#  Benchmark
+#
+
+
+def count(path: str, engine: str) -> tuple:
+    """Counts the pages of `path` in a fresh process; returns (pages, seconds, RSS KiB)"""
+
+    result = subprocess.run(
+        [sys.executable, "-c", COUNT.format(root=ROOT, path=path, engine=engine)],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    pages, elapsed, rss = result.stdout.split()
+    return (None if pages == "None" else int(pages)), float(elapsed), int(rss)
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from mug.pagecount import PDF_ENGINES
+
+    huge_mb = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HUGE_MB
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RUNS
+
+    with tempfile.TemporaryDirectory() as directory:
+        files = make_corpus(directory, huge_mb)
+
+        print(f"{'file':<12} {'size':>9} {'engine':<11} {'pages':>6} {'agree':>5} {'MB/s':>10} {'ms':>9} {'RSS MiB':>8}")
+        agreed = {engine: 0 for engine in PDF_ENGINES}
+        for name, path, expected in files:
+            size = os.path.getsize(path)
+            for engine in PDF_ENGINES:
+                results = [count(path, engine) for _ in range(runs)]
+                pages = results[0][0]
+                elapsed = statistics.median(r[1] for r in results)
+                rss = max(r[2] for r in results)
+
+                if pages is None:
+                    agree = "-"
+                else:
+                    agree = "yes" if pages == expected else "NO"
+                    agreed[engine] += pages == expected
+
+                print(
+                    f"{name:<12} {size / 1024:>7.0f}KB {engine:<11} {str(pages):>6} {agree:>5} "
+                    f"{size / 1e6 / elapsed:>10.0f} {elapsed * 1000:>9.2f} {rss / 1024:>8.1f}"
+                )
+
+        print()
+        for engine, n in agreed.items():
+            print(f"{engine:<11} counted {n}/{len(files)} files correctly")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Compares SerializerMixin.to_dict with the serializers in mug.serializers on
+accounts, checking that they give the same records:
+
+  to_dict:      instance.to_dict() on loaded Account instances
+  serialize:    the model's serializer on the same instances
+  from_row:     the serializer on row tuples, as a column query returns them
+  query+...:    the same, including fetching the rows from a database
+
+Usage: python benchmarks/serialization.py [rows]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mug import settings  # noqa: E402
+
+
+def timed(label, rows, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<20} {elapsed * 1000:8.1f} ms  {rows / elapsed / 1000:8.1f}k rows/s")
+    return result
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        settings.config = {"sqlite": {"path": os.path.join(tmp, "bench.db")}}
+
+        from mug import connections
+        from mug.models import Account
+        from mug.serializers import get_serializer
+
+        connections.init_db()
+        now = datetime(2026, 1, 1)
+        connections.get_raw_connection().executemany(
+            "INSERT INTO account (username, status, quota, gid, pages_printed, date_added, date_modified)"
+            " VALUES (?, 'USING_PERSONAL_QUOTA', 100, ?, ?, ?, ?)",
+            (
+                (f"user{i:07d}", i % 50 or None, i % 100, str(now), str(now + timedelta(i)) if i % 3 else None)
+                for i in range(rows)
+            ),
+        )
+
+        serializer = get_serializer(Account)
+        session = connections.get_db_session()
+        instances = session.query(Account).order_by(Account.username).all()
+        tuples = session.query(*serializer.columns).order_by(Account.username).all()
+
+        print(f"{rows} accounts")
+        expected = timed("to_dict", rows, lambda: [a.to_dict() for a in instances])
+        serialized = timed("serialize", rows, lambda: [serializer.serialize(a) for a in instances])
+        from_rows = timed("from_row", rows, lambda: list(serializer.from_rows(tuples)))
+        assert serialized == expected and from_rows == expected, "records differ from to_dict"
+
+        session.expunge_all()
+        timed(
+            "query+to_dict",
+            rows,
+            lambda: [a.to_dict() for a in session.query(Account).order_by(Account.username)],
+        )
+        timed(
+            "query+from_row",
+            rows,
+            lambda: list(
+                serializer.from_rows(
+                    session.query(*serializer.columns).order_by(Account.username).yield_per(1000)
+                )
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
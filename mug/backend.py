@@ -4,22 +4,66 @@
 Implemented according to https://www.cups.org/doc/api-filter.html
 """
 
+import io
 import os
-import signal
 import sys
 import pwd
-import time
 
-from pdfrw import PdfReader
 from typing import BinaryIO, List, Optional
-from mug import connections, utils, models
-from mug.models import Account
+from mug import pagecount, utils
+
+# Everything else (the database layer, pdfrw, tempfile...) is imported by the
+# code paths that need it: CUPS starts this module for every job, and usage
+# errors or rejected jobs shouldn't pay for loading them
+
+# Size of the chunks used when spooling job data from standard input
+SPOOL_CHUNK_SIZE = 1024 * 1024
 
 
 class BackendError(Exception):
     """Exceptions encountered during backend processing"""
 
 
+class JobPageCache:
+    """
+    The accounting layer's page count cache (see mug.pagecache), for documents
+    of one content type. The cache is an optimization: when it can't be used,
+    the pages are counted as if it missed
+    """
+
+    def __init__(self, accounting, content_type: str, backend: "CUPSBackend"):
+        self.accounting = accounting
+        self.content_type = content_type
+        self.backend = backend
+        self.enabled = True
+
+    def get(self, digest: str, size: int) -> Optional[int]:
+        if self.enabled:
+            try:
+                return self.accounting.get_cached_page_count(digest, size, self.content_type)
+            except Exception as e:
+                self.disable(e)
+        return None
+
+    def put(self, digest: str, size: int, pages: int):
+        if self.enabled:
+            try:
+                self.accounting.cache_page_count(digest, size, self.content_type, pages)
+            except Exception as e:
+                self.disable(e)
+
+    def flush(self):
+        if self.enabled:
+            try:
+                self.accounting.flush_page_cache()
+            except Exception as e:
+                self.disable(e)
+
+    def disable(self, error: Exception):
+        self.enabled = False
+        self.backend.print_info(f"page count cache is unavailable ({error})")
+
+
 class CUPSBackend:
     """
     The scheduler runs one or more [filters] to print any given job. The
@@ -32,10 +76,6 @@ class CUPSBackend:
         self, argv: List[str], cups_env: dict, print_data: Optional[BinaryIO] = None
     ):
 
-        # Mug initalization
-
-        self.db_session = connections.get_db_session()
-
         # Cups initalization
 
         self.argv = argv
@@ -58,38 +98,64 @@ class CUPSBackend:
         self.copies_count = self.argv[4]
         self.job_options = self.argv[5]
 
-        self.print_data = print_data if print_data else self.get_print_data_from_env()
+        # Only the first filter gets the file; the backend usually reads the
+        # output of the filter chain from standard input
+        self.from_file = len(argv) == 7
+
+        self.print_data = self.spool_print_data(
+            print_data if print_data else self.get_print_data_from_env()
+        )
         self.env = cups_env if cups_env else self.get_job_info_from_env()
 
     def dispatch(self):
-        if self.env["CONTENT_TYPE"] != "application/pdf":
-            raise BackendError(
-                "Filetype was not 'application/pdf'! (currently only PDF files can be accounted for)"
-            )
+        import signal
+
+        self.accounting = self.get_accounting()
 
         # Page counting
 
-        self.count_pages()
+        try:
+            self.count_pages()
+        except BackendError as e:
+            self.print_err(f"could not account for the job: {e}")
+            exit(0)  # TODO: Failure or success here??
         if self.page_count == 0:
             self.print_err("job data has no content that can be printed")
             exit(0)  # TODO: Failure or success here??
 
         # Accounting work
 
-        pages_allowed = self.get_pages_allowed(self.job_user)
+        job = self.get_job_record()
+        self.billed_pages = self.accounting.cost(self.page_count, job)
+
+        # Installed before reserving, so a job cancelled from then on still
+        # gives its reservation back (and is recorded in the ledger)
+        self.got_sigterm = False
+        self.child_pid = None
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+        reservation = self.accounting.reserve(self.job_user, self.billed_pages, job)
 
-        if self.page_count > pages_allowed:
-            self.print_err(f"the job exceeds the users print quota ({self.job_user} has {pages_allowed} pages left and job was {self.page_count} pages)")
+        if reservation is None:
+            pages_allowed = self.get_pages_allowed(self.job_user)
+            self.print_err(f"the job exceeds the users print quota ({self.job_user} has {pages_allowed} pages left and job was {self.billed_pages} pages)")
+            self.flush_page_cache()
             exit(0)  # TODO: Failure or success here??
 
-        retcode = self.send_to_backend()
+        try:
+            retcode = self.send_to_backend()
+        except BaseException:
+            reservation.release()
+            raise
 
         if retcode == 0:
-            print(f"INFO: adding {self.page_count} pages to accounting for user {self.job_user}")
-            self.account_pages(self.job_user, self.page_count)
+            print(f"INFO: adding {self.billed_pages} pages to accounting for user {self.job_user}")
+            reservation.confirm()
         else:
             print(f"ERROR: backend returned code {retcode} unexpectedly")
+            reservation.release()
 
+        self.flush_page_cache()
         exit(retcode)
 
     """
@@ -97,52 +163,102 @@ class CUPSBackend:
     """
 
     def count_pages(self) -> int:
+        self.page_cache = None
         if self.print_data is None:
             raise BackendError(
                 "Cannot count number of pages because print data does not exist!"
             )
-        pdf = PdfReader(fdata=self.get_pdf_from_cups())
-        self.page_count = len(pdf.pages)
+        # Nothing to count, and nothing to map: reported as a job without content
+        self.print_data.seek(0, os.SEEK_END)
+        empty = self.print_data.tell() == 0
+        self.print_data.seek(0)
+        if empty:
+            self.page_count = 0
+            return self.page_count
+
+        config = self.accounting.get_pagecount_config()
+        content_type = self.get_content_type()
+        try:
+            engines = pagecount.get_engine_names(content_type, config)
+        except pagecount.PageCountError as e:
+            raise BackendError(f"{e} (PDF, PostScript and PCL jobs can be accounted for)")
+
+        if config.get("cache", {}).get("enabled", True):
+            self.page_cache = JobPageCache(self.accounting, content_type, self)
+
+        try:
+            self.page_count = pagecount.count_pages(self.print_data, engines, self.page_cache)
+        except pagecount.PageCountError as e:
+            raise BackendError(str(e))
         return self.page_count
 
-    def get_pages_allowed(self, username) -> int:
+    def get_content_type(self) -> Optional[str]:
         """
-        Returns a user's remaining number of pages allowed to be printed, taking into account
-        the user's status (whether to use their own personal quota or a group policy)
-        TODO: This needs to actually check if the user has a group quota policy set to be checked instead
+        The type of the job data: CONTENT_TYPE is the type of the submitted file
+        (argv[6]) and FINAL_CONTENT_TYPE the type the filter chain produces on
+        standard input (e.g. PostScript for a PDF job on a PostScript queue)
         """
 
-        account_obj = (
-            self.db_session.query(models.Account)
-            .filter(Account.username == self.job_user)
-            .first()
-        )
+        if self.from_file:
+            return self.env.get("CONTENT_TYPE")
+        return self.env.get("FINAL_CONTENT_TYPE") or self.env.get("CONTENT_TYPE")
 
-        if not account_obj:
-            self.print_err("user requesting job does not exist")
+    def flush_page_cache(self):
+        """
+        Writes the page count cache's counters once the job is settled, rather
+        than while it waits for a reservation
+        """
+        if self.page_cache is not None:
+            self.page_cache.flush()
+
+    def get_job_record(self) -> dict:
+        """Describes the job for the ledger"""
+        return {
+            "job_id": int(self.job_id),
+            "printer": self.env.get("PRINTER"),
+            "copies": int(self.copies_count),
+            "options": self.job_options,
+            # The filter chain already applied page-ranges and number-up
+            "filtered": not self.from_file,
+        }
+
+    def get_accounting(self):
+        """
+        Talks to the accounting daemon when it is running. Otherwise the database
+        is opened directly, which means loading the configuration and the
+        database layer in this process. The job's ledger record is only for
+        auditing: failing to write it is reported, and the job carries on
+        """
+
+        from mug import client
 
-        # HACK: account_obj.pages_printed has been changed to default 0
-        #       but might still be null in old implememtations
-        if account_obj.pages_printed is None:
-            account_obj.pages_printed = 0
+        try:
+            return client.DaemonClient()
+        except OSError:
+            pass
 
-        return account_obj.quota - account_obj.pages_printed
+        from mug import connections, quota, settings
 
-    def account_pages(self, username, page_count):
-        account_obj: Optional[models.Account] = (
-            self.db_session.query(models.Account)
-            .filter(Account.username == username)
-            .first()
+        return quota.Accounting(
+            connections.get_raw_connection(),
+            settings.config.get("billing"),
+            settings.config.get("pagecount"),
+            lambda error: self.print_err(f"could not record the job in the ledger ({error})"),
         )
 
-        if not account_obj:
-            raise BackendError("Tried to account for account that does not exist!")
+    def get_pages_allowed(self, username) -> int:
+        """
+        Returns a user's remaining number of pages allowed to be printed, taking into account
+        the user's status (whether to use their own personal quota or a group policy)
+        """
+
+        pages_allowed = self.accounting.pages_allowed(username)
 
-        # TODO: Don't assume personal quota is whats being used
-        account_obj.pages_printed += page_count
-        print(f"INFO: {self.job_user} has now printed {account_obj.pages_printed} of their {account_obj.quota} allowed", file=sys.stderr)
+        if pages_allowed is None:
+            self.print_err("user requesting job does not exist")
+            return 0
 
-        self.db_session.commit()
+        return pages_allowed
 
     def send_to_backend(self):
         """
@@ -150,6 +266,8 @@ class CUPSBackend:
         Derived from Pykota's CUPSBackend.runOriginalBackend
         """
 
+        import signal
+
         # socket://192.168.1.1:6000
         # mug://socket://192.168.1.1:6000
         # mug://cups-pdf:/
@@ -158,48 +276,62 @@ class CUPSBackend:
         original_uri = os.environ["DEVICE_URI"][6:]  # TODO: Assuming prefix is mug://
         os.environ["DEVICE_URI"] = original_uri
 
-        originalbackend = os.path.join(os.path.split(sys.argv[0])[0], backend_bin)
+        originalbackend = os.path.join(os.path.split(self.argv[0])[0], backend_bin)
         if not os.environ["CUPS_FILETYPE"] == "job-sheet":
-            arguments = [os.environ["DEVICE_URI"]] + sys.argv[1:]
+            arguments = [os.environ["DEVICE_URI"]] + self.argv[1:]
         else:
             # For banners, we absolutely WANT
             # to remove any filename from the command line!
-            arguments = [os.environ["DEVICE_URI"]] + sys.argv[1:6]
+            arguments = [os.environ["DEVICE_URI"]] + self.argv[1:6]
         arguments[2] = self.job_user  # in case it was overwritten by external script
         # TODO : do something about job-billing option, in case it was overwritten as well...
         # TODO : do something about the job title : if we are printing a banner and the backend
         # TODO : uses the job's title to name an output file (cups-pdf:// for example), we're stuck !
 
+        # The job data was already read once for counting; the child reads the
+        # same copy from the start
+        if self.print_data is not None:
+            self.print_data.seek(0)
+
+        if self.got_sigterm:
+            self.Reason = "job was cancelled before it was sent to the CUPS backend."
+            self.print_info(self.Reason)
+            return 1
+
         self.become_root()
 
         pid = os.fork()
 
         # In the child of the fork
         if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
             if self.print_data is not None:
-                # Redirecting file handle to real backend's stdin
+                # Redirecting the spooled job data to real backend's stdin
                 os.dup2(self.print_data.fileno(), 0)
                 pid = os.getpid()
 
-            os.execve(originalbackend, arguments, os.environ)
+            try:
+                os.execve(originalbackend, arguments, os.environ)
+            except Exception as e:
+                self.print_err(f"could not run CUPS backend {originalbackend}: {e}")
+            # Never fall back into the parent's code (and its accounting)
+            os._exit(127)
 
         # In the parent of the fork
 
+        self.child_pid = pid
+        if self.got_sigterm:
+            os.kill(pid, signal.SIGTERM)
+
         self.drop_root()
 
-        # Waiting for original backend to exit...
-        killed = 0
-        status = -1
-        while status == -1:
-            try:
-                status = os.waitpid(pid, 0)[1]
-                time.sleep(1)
-            except OSError as e:
-                # TODO: Once we have SIGTERM handling:
-                #       `and self.gotSigTerm``
-                if e.errno == 4:
-                    os.kill(pid, signal.SIGTERM)
-                    killed = 1
+        # Waiting for original backend to exit. waitpid blocks until the child
+        # is reaped and is transparently resumed after the SIGTERM handler runs
+        try:
+            status = os.waitpid(pid, 0)[1]
+        finally:
+            self.child_pid = None
 
         if os.WIFEXITED(status):
             status = os.WEXITSTATUS(status)
@@ -211,7 +343,7 @@ class CUPSBackend:
             else:
                 level = "info"
             return status
-        elif not killed:
+        elif not self.got_sigterm:
             self.Reason = f"CUPS backend {originalbackend} died abnormally."
             self.print_info(self.Reason)
             return -1
@@ -220,14 +352,22 @@ class CUPSBackend:
             self.print_info(self.Reason)
             return 1
 
+    def handle_sigterm(self, signum, frame):
+        """
+        CUPS sends SIGTERM to the backend when a job is cancelled; pass it on to
+        the real backend so it stops sending data to the device
+        """
+
+        import signal
+
+        self.got_sigterm = True
+        if self.child_pid:
+            os.kill(self.child_pid, signal.SIGTERM)
+
     """
     Environment initialization and preparation
     """
 
-    # TODO: replace with https://wiki.debian.org/CUPSFilter to process stdin
-    def get_pdf_from_cups(self) -> bytes:
-        return open(f"/var/spool/cups/d{str(self.job_id).zfill(5)}-001", "rb").read()
-
     def get_print_data_from_env(self) -> BinaryIO:
         """
         Determines whether to get job data from stdin or from the CUPS data directory
@@ -235,8 +375,8 @@ class CUPSBackend:
         """
 
         fs_file = None
-        if len(sys.argv) == 7:
-            fs_file = sys.argv[6]
+        if len(self.argv) == 7:
+            fs_file = self.argv[6]
 
         stdin_buffer = sys.stdin.buffer
 
@@ -251,11 +391,36 @@ class CUPSBackend:
                 "Could not find print data from standard input or ARGV[6]"
             )
 
+    @staticmethod
+    def spool_print_data(print_data: BinaryIO) -> BinaryIO:
+        """
+        Job data coming from standard input can only be read once, so it is copied
+        to a temporary file (in the TMPDIR set by CUPS) exactly once. That copy is
+        used both for counting pages and as the real backend's standard input.
+        In-memory data (mock jobs) is spooled too, as it has no file descriptor
+        to hand to the real backend
+        """
+
+        try:
+            if print_data.seekable() and print_data.fileno() >= 0:
+                return print_data
+        except io.UnsupportedOperation:
+            pass
+
+        import shutil
+        import tempfile
+
+        spool = tempfile.TemporaryFile(dir=os.environ.get("TMPDIR"))
+        shutil.copyfileobj(print_data, spool, SPOOL_CHUNK_SIZE)
+        spool.flush()
+        spool.seek(0)
+        return spool
+
     def get_print_data(self) -> bytes:
         if self.print_data is None:
             raise BackendError("Cannot read print data because none exists!")
         data = self.print_data.read()
-        # self.print_data.seek(0, 0)  # Doesnt work with stdin
+        self.print_data.seek(0)
         return data
 
     def get_job_info_from_env(self) -> dict:
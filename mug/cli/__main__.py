@@ -2,22 +2,27 @@
 
 import os
 import logging
+import sys
 from pathlib import Path
 from typing import Optional
-from .. import settings, connections
+from .. import settings, connections, migrations
 
 import toml
 import typer
 
-from . import account, group
+from . import account, cache, daemon, db, group
 
 app = typer.Typer()
 app.add_typer(account.app)
+app.add_typer(cache.app)
+app.add_typer(daemon.app)
+app.add_typer(db.app)
 app.add_typer(group.app)
 
 
 @app.callback()
 def main(
+    ctx: typer.Context,
     config: Optional[Path] = typer.Option(None, "-c", "--config"),
     database: Optional[Path] = typer.Option(None, "-d", "--database"),
     verbose: bool = typer.Option(False, "-v", "--verbose"),
@@ -31,16 +36,22 @@ def main(
         )
 
     if database:
-        sqlite_file = database
-        settings.config["sqlite"]["path"] = database
-    else:
-        sqlite_file = settings.config["sqlite"]["path"]
-
-    if not os.path.exists(sqlite_file):
-        Path(sqlite_file).touch()
-
-    if not os.path.getsize(sqlite_file):
-        connections.init_db()
+        settings.config.setdefault("sqlite", {})["path"] = database
+
+    if connections.is_sqlite():
+        sqlite_file = connections.get_db_path()
+        if not os.path.exists(sqlite_file):
+            Path(sqlite_file).touch()
+
+    # Creates the database on first use; existing ones are upgraded explicitly
+    if not connections.init_db() and ctx.invoked_subcommand != "db":
+        version = migrations.get_version(connections.get_raw_connection())
+        if version < migrations.LATEST_VERSION:
+            print(
+                f"Database schema is at version {version} of {migrations.LATEST_VERSION},"
+                " run `mug db migrate` to upgrade it.",
+                file=sys.stderr,
+            )
 
     # FIXME: basicConfig not valid for logger object
     if verbose:
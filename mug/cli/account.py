@@ -1,8 +1,16 @@
-import typer
+import csv
 import json
+import os
+import sys
+from datetime import datetime
+from typing import Iterator, Optional, Union
+
+import typer
 
-from ..connections import get_db_session
-from ..models import Account, Group
+from ..connections import get_db_session, get_raw_connection, is_sqlite
+from ..ledger import TIMESTAMP_FORMAT
+from ..models import ALLOWED_STATUS, Account, Group
+from ..serializers import get_serializer, to_dict
 from ..settings import logger
 
 app = typer.Typer(name="account", help="Various utilities for working with accounts")
@@ -41,6 +49,168 @@ ARG_TO_STATUS = {
     "group": "USING_GROUP_QUOTA",
 }
 
+# Columns of imported and exported accounts
+FIELDS = ["username", "status", "quota", "gid", "pages_printed", "date_added", "date_modified"]
+
+# Accounts per transaction when importing, and per fetch when exporting
+BATCH_SIZE = 1000
+
+# Fields left out of an imported record keep their current value; new accounts
+# get the defaults
+UPSERT_SQL = """
+INSERT INTO account (username, status, quota, gid, pages_printed, date_added, date_modified)
+VALUES (
+    :username,
+    COALESCE(:status, 'USING_PERSONAL_QUOTA'),
+    COALESCE(:quota, 0),
+    :gid,
+    COALESCE(:pages_printed, 0),
+    :now,
+    :now
+)
+ON CONFLICT (username) DO UPDATE SET
+    status = COALESCE(:status, account.status),
+    quota = COALESCE(:quota, account.quota),
+    gid = COALESCE(:gid, account.gid),
+    pages_printed = COALESCE(:pages_printed, account.pages_printed),
+    date_modified = :now
+"""
+
+INSERT_SQL = """
+INSERT INTO account (username, status, quota, gid, pages_printed, date_added, date_modified)
+VALUES (
+    :username,
+    COALESCE(:status, 'USING_PERSONAL_QUOTA'),
+    COALESCE(:quota, 0),
+    :gid,
+    COALESCE(:pages_printed, 0),
+    :now,
+    :now
+)
+ON CONFLICT (username) DO NOTHING
+"""
+
+# Set-based statements of reset and adjust; {where} is the accounts' filter
+ARCHIVE_SQL = """
+INSERT INTO usage_history (username, gid, quota, pages_printed, archived_at)
+SELECT username, gid, quota, pages_printed, :now FROM account WHERE {where}
+"""
+
+RESET_SQL = """
+UPDATE account SET pages_printed = 0, date_modified = :now WHERE {where}
+"""
+
+ARCHIVE_GROUPS_SQL = """
+INSERT INTO usage_history (username, gid, quota, pages_printed, archived_at)
+SELECT NULL, group_usage.gid, "group".page_count, group_usage.pages_printed, :now
+FROM group_usage LEFT JOIN "group" ON "group".gid = group_usage.gid WHERE {where}
+"""
+
+RESET_GROUPS_SQL = """
+UPDATE group_usage SET pages_printed = 0 WHERE {where}
+"""
+
+SET_QUOTA_SQL = """
+UPDATE account SET quota = :quota, date_modified = :now WHERE {where}
+"""
+
+ADD_QUOTA_SQL = """
+UPDATE account
+SET quota = CASE WHEN COALESCE(quota, 0) + :quota > 0 THEN COALESCE(quota, 0) + :quota ELSE 0 END,
+    date_modified = :now
+WHERE {where}
+"""
+
+# Sort keys of `account list`: the expression rows are ordered by (then by
+# username, which makes the order total) and the type of its values in --after
+LIST_SORT_KEYS = {
+    "username": ("username", str),
+    "pages": ("pages_printed", int),
+    "quota": ("COALESCE(quota, 0)", int),
+    "usage": ("COALESCE(pages_printed * 100.0 / NULLIF(quota, 0), 0)", float),
+    "modified": ("COALESCE(CAST(date_modified AS VARCHAR), '')", str),
+}
+
+# Columns of listed accounts, followed by the sort key in LIST_SQL
+LIST_FIELDS = ["username", "status", "gid", "quota", "pages_printed", "date_modified"]
+
+LIST_SQL = """
+SELECT username, status, gid, quota, pages_printed, date_modified, {key}
+FROM account WHERE {where}
+ORDER BY {key} {order}, username {order}
+"""
+
+STATUS_TO_ARG = {status: arg for arg, status in ARG_TO_STATUS.items()}
+
+LIST_HEADER = ("USERNAME", "STATUS", "GID", "QUOTA", "PRINTED", "USAGE", "MODIFIED")
+LIST_ROW_FORMAT = "{:<24} {:<8} {:>6} {:>7} {:>7} {:>6} {}"
+
+
+def _status_arg(status: str) -> str:
+    """Returns the status that a --status argument selects"""
+
+    if status not in ARG_TO_STATUS:
+        print(f"Unknown status {status}! Use one of {', '.join(ARG_TO_STATUS)}.")
+        exit(1)
+    return ARG_TO_STATUS[status]
+
+
+def _format_of(path: str, format: Optional[str]) -> str:
+    """Returns the file format, from --format or the file's extension"""
+
+    if format:
+        if format not in ("csv", "jsonl"):
+            print(f"Unknown format {format}! Use csv or jsonl.")
+            exit(1)
+        return format
+    return "jsonl" if os.path.splitext(path)[1] in (".jsonl", ".ndjson", ".json") else "csv"
+
+
+def _read_records(fh, format: str) -> Iterator[Union[dict, str]]:
+    """Yields CSV rows as dicts, and JSONL lines as they are (see _decode_record)"""
+
+    if format == "csv":
+        yield from csv.DictReader(fh)
+    else:
+        for line in fh:
+            if line.strip():
+                yield line
+
+
+def _decode_record(record: Union[dict, str]) -> dict:
+    """Decodes a JSONL line, so it fails on the record it belongs to"""
+    return json.loads(record) if isinstance(record, str) else record
+
+
+def _optional_int(value) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    return int(value)
+
+
+def _account_params(record: dict, now: str) -> dict:
+    """Validates an imported record, returning the upsert's parameters"""
+
+    username = (record.get("username") or "").strip()
+    if not username:
+        raise ValueError("username is missing")
+
+    status = record.get("status") or None
+    if status is not None:
+        if isinstance(status, str):
+            status = ARG_TO_STATUS.get(status, status)
+        if status not in ALLOWED_STATUS:
+            raise ValueError(f"invalid status {record['status']}")
+
+    return {
+        "username": username,
+        "status": status,
+        "quota": _optional_int(record.get("quota")),
+        "gid": _optional_int(record.get("gid")),
+        "pages_printed": _optional_int(record.get("pages_printed")),
+        "now": now,
+    }
+
 
 @app.command()
 def create(
@@ -87,7 +257,120 @@ def get(username: str):
     if not res:
         print(f"Account {username} not found!")
     else:
-        print(json.dumps(res.to_dict()))
+        print(json.dumps(to_dict(res)))
+
+
+def _list_query(status, gid, prefix, over, sort, descending, after):
+    """Builds the query of `account list`, and its parameters"""
+
+    if sort not in LIST_SORT_KEYS:
+        print(f"Unknown sort key {sort}! Use one of {', '.join(LIST_SORT_KEYS)}.")
+        exit(1)
+    key, key_type = LIST_SORT_KEYS[sort]
+
+    clauses = []
+    params = {}
+    if status is not None:
+        clauses.append("status = :status")
+        params["status"] = _status_arg(status)
+    if gid is not None:
+        clauses.append("gid = :gid")
+        params["gid"] = gid
+    if prefix:
+        # A range on the primary key, rather than a LIKE that can't use it
+        clauses.append("username >= :prefix AND username < :prefix_end")
+        params["prefix"] = prefix
+        params["prefix_end"] = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    if over is not None:
+        clauses.append("quota > 0 AND pages_printed * 100.0 >= :over * quota")
+        params["over"] = over
+    if after is not None:
+        # Keyset pagination: carry on from the last row of the previous page
+        if sort == "username":
+            value, username = after, after
+        else:
+            value, _, username = after.partition(",")
+        try:
+            params["after_key"] = key_type(value)
+        except ValueError:
+            print(f"Invalid --after {after}! Use the value printed with the previous page.")
+            exit(1)
+        params["after_username"] = username
+        comparison = "<" if descending else ">"
+        clauses.append(f"({key}, username) {comparison} (:after_key, :after_username)")
+
+    sql = LIST_SQL.format(
+        key=key, where=" AND ".join(clauses) or "1 = 1", order="DESC" if descending else "ASC"
+    )
+    return sql, params
+
+
+@app.command("list")
+def list_accounts(
+    status: str = typer.Option(None, "--status", help="Only accounts with this status"),
+    gid: int = typer.Option(None, "--gid", help="Only the members of a group"),
+    prefix: str = typer.Option(None, "--prefix", help="Only usernames starting with this"),
+    over: float = typer.Option(
+        None, "--over", help="Only accounts that used over this percent of their quota"
+    ),
+    sort: str = typer.Option("username", "--sort", help=f"One of {', '.join(LIST_SORT_KEYS)}"),
+    descending: bool = typer.Option(False, "--desc", help="Sort in descending order"),
+    limit: int = typer.Option(50, "--limit", help="Accounts per page (0 for all of them)"),
+    after: str = typer.Option(None, "--after", help="Continue from the end of the previous page"),
+    format: str = typer.Option("table", "--format", help="table or jsonl"),
+):
+    """
+    List accounts, a page at a time. Rows are streamed from the database, and the
+    command to get the next page is printed after the last one
+    """
+
+    if format not in ("table", "jsonl"):
+        print(f"Unknown format {format}! Use table or jsonl.")
+        exit(1)
+
+    sql, params = _list_query(status, gid, prefix, over, sort, descending, after)
+    if limit > 0:
+        # One more row than shown tells whether there is a next page
+        sql += " LIMIT :limit"
+        params["limit"] = limit + 1
+
+    if format == "table":
+        print(LIST_ROW_FORMAT.format(*LIST_HEADER))
+
+    serializer = get_serializer(Account, LIST_FIELDS)
+    cursor = get_raw_connection().execute(sql, params)
+    cursor.arraysize = BATCH_SIZE
+
+    listed = 0
+    last = None
+    for row in cursor:
+        if limit and listed == limit:
+            break
+        username, row_status, row_gid, quota, printed, modified, key = serializer.row_values(row)
+        if format == "table":
+            print(
+                LIST_ROW_FORMAT.format(
+                    username,
+                    STATUS_TO_ARG.get(row_status, row_status),
+                    "-" if row_gid is None else row_gid,
+                    "-" if quota is None else quota,
+                    printed,
+                    f"{printed * 100 / quota:.0f}%" if quota else "-",
+                    modified or "-",
+                )
+            )
+        else:
+            sys.stdout.write(json.dumps(serializer.from_row(row)) + "\n")
+        listed += 1
+        last = (username, key)
+    else:
+        last = None
+    cursor.close()
+
+    if last:
+        username, key = last
+        token = username if sort == "username" else f"{key},{username}"
+        print(f"More accounts follow: --after '{token}'", file=sys.stderr)
 
 
 @app.command()
@@ -102,8 +385,15 @@ def update(
 
     session = get_db_session()
 
-    existing = session.query(Account).filter(Account.username == username).first()
-    existing_dict = existing.to_dict()
+    # Only the columns that can change, rather than the whole (serialized) row
+    existing = (
+        session.query(Account.status, Account.quota, Account.gid, Account.pages_printed)
+        .filter(Account.username == username)
+        .first()
+    )
+    if not existing:
+        print(f"Account {username} not found!")
+        exit(1)
 
     changes = {}
 
@@ -116,7 +406,7 @@ def update(
     if gid is not None and existing.gid != gid:
         changes[Account.gid] = gid
 
-    if refresh :
+    if refresh and existing.pages_printed != 0:
         changes[Account.pages_printed] = 0
 
     if not changes:
@@ -136,7 +426,7 @@ def update(
         print(f"Account {username} updated successfully.")
         print("Details:")
         for k, v in changes.items():
-            print(f"  {k.name} changed from {existing_dict[k.name]} to {v}")
+            print(f"  {k.name} changed from {getattr(existing, k.name)} to {v}")
 
     else:
         print(f"Account {username} could not be updated! See logs for more details.")
@@ -155,4 +445,208 @@ def delete(username: str):
         print(f"Account {username} could not be updated! See logs for more details.")
         exit(1)
 
-# TODO: validate command
+
+def _glob_to_like(pattern: str) -> str:
+    """Translates a glob's * and ? into a LIKE pattern, for database servers"""
+
+    for char in "\\%_":
+        pattern = pattern.replace(char, "\\" + char)
+    return pattern.replace("*", "%").replace("?", "_")
+
+
+def _account_filter(everyone: bool, gid: Optional[int], status: Optional[str], pattern: Optional[str]):
+    """Builds the WHERE clause (and its parameters) selecting accounts"""
+
+    clauses = []
+    params = {}
+    if gid is not None:
+        clauses.append("gid = :gid")
+        params["gid"] = gid
+    if status is not None:
+        clauses.append("status = :status")
+        params["status"] = _status_arg(status)
+    if pattern is not None:
+        if is_sqlite():
+            clauses.append("username GLOB :pattern")
+            params["pattern"] = pattern
+        else:
+            clauses.append("username LIKE :pattern ESCAPE '\\'")
+            params["pattern"] = _glob_to_like(pattern)
+
+    if not clauses and not everyone:
+        print("No accounts selected! Use --all, --gid, --status or --pattern.")
+        exit(1)
+    return " AND ".join(clauses) or "1 = 1", params
+
+
+def _run_in_transaction(statements: list) -> int:
+    """Runs the statements in one transaction, returning the last one's row count"""
+
+    db = get_raw_connection()
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, params in statements:
+            rowcount = db.execute(sql, params).rowcount
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+    return rowcount
+
+
+@app.command()
+def reset(
+    everyone: bool = typer.Option(False, "--all", help="Select every account"),
+    gid: int = typer.Option(None, "--gid", help="Select the members of a group"),
+    status: str = typer.Option(None, "--status", help="Select accounts by status"),
+    pattern: str = typer.Option(None, "--pattern", help="Select usernames matching a glob, e.g. 's23*'"),
+    archive: bool = typer.Option(False, "--archive", help="Keep the previous usage in the usage history"),
+):
+    """
+    Reset the page usage of the selected accounts, e.g. at the end of a term.
+    Selecting every account, or only a group, also resets the groups' usage
+    """
+
+    where, params = _account_filter(everyone, gid, status, pattern)
+    params["now"] = datetime.now().strftime(TIMESTAMP_FORMAT)
+
+    # Group usage is shared, so it is only reset when whole groups are selected
+    group_where = None
+    if status is None and pattern is None:
+        group_where = "group_usage.gid = :gid" if gid is not None else "1 = 1"
+
+    statements = []
+    if archive:
+        statements.append((ARCHIVE_SQL.format(where=where), params))
+        if group_where:
+            statements.append((ARCHIVE_GROUPS_SQL.format(where=group_where), params))
+    if group_where:
+        statements.append((RESET_GROUPS_SQL.format(where=group_where), params))
+    statements.append((RESET_SQL.format(where=where), params))
+
+    res = _run_in_transaction(statements)
+    print(f"Reset the page usage of {res} accounts.")
+
+
+@app.command()
+def adjust(
+    quota: int = typer.Option(None, "--quota", help="Set the quota to this many pages"),
+    add: int = typer.Option(None, "--add", help="Add this many pages (or remove, when negative)"),
+    everyone: bool = typer.Option(False, "--all", help="Select every account"),
+    gid: int = typer.Option(None, "--gid", help="Select the members of a group"),
+    status: str = typer.Option(None, "--status", help="Select accounts by status"),
+    pattern: str = typer.Option(None, "--pattern", help="Select usernames matching a glob, e.g. 's23*'"),
+    archive: bool = typer.Option(False, "--archive", help="Keep the previous usage in the usage history"),
+):
+    """Set or change the quota of the selected accounts"""
+
+    if (quota is None) == (add is None):
+        print("Use exactly one of --quota and --add.")
+        exit(1)
+
+    where, params = _account_filter(everyone, gid, status, pattern)
+    params["now"] = datetime.now().strftime(TIMESTAMP_FORMAT)
+    params["quota"] = quota if add is None else add
+
+    statements = []
+    if archive:
+        statements.append((ARCHIVE_SQL.format(where=where), params))
+    sql = SET_QUOTA_SQL if add is None else ADD_QUOTA_SQL
+    statements.append((sql.format(where=where), params))
+
+    res = _run_in_transaction(statements)
+    print(f"Adjusted the quota of {res} accounts.")
+
+
+@app.command("import")
+def import_accounts(
+    path: str = typer.Argument("-", help="CSV or JSONL file of accounts (default: standard input)"),
+    format: str = typer.Option(None, "--format", help="csv or jsonl (default: from the extension)"),
+    update: bool = typer.Option(
+        True, "--update/--skip-existing", help="Update accounts that already exist"
+    ),
+    batch_size: int = typer.Option(BATCH_SIZE, "--batch-size"),
+):
+    """
+    Create or update accounts in bulk. Records have the fields username, status,
+    quota, gid and pages_printed; only username is required
+    """
+
+    format = _format_of(path, format)
+    fh = sys.stdin if path == "-" else open(path, newline="")
+    sql = UPSERT_SQL if update else INSERT_SQL
+    now = datetime.now().strftime(TIMESTAMP_FORMAT)
+
+    db = get_raw_connection()
+    imported = 0
+    batch = []
+
+    def flush():
+        db.execute("BEGIN")
+        try:
+            db.executemany(sql, batch)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        batch.clear()
+
+    try:
+        for number, record in enumerate(_read_records(fh, format), 1):
+            try:
+                batch.append(_account_params(_decode_record(record), now))
+            except (ValueError, TypeError, AttributeError) as e:
+                print(f"Could not import record {number}: {e}")
+                print(f"{imported} accounts were imported before it.")
+                exit(1)
+
+            if len(batch) >= batch_size:
+                flush()
+                imported += batch_size
+                print(f"Imported {imported} accounts...", file=sys.stderr)
+
+        if batch:
+            imported += len(batch)
+            flush()
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+    print(f"Successfully imported {imported} accounts.")
+
+
+@app.command("export")
+def export_accounts(
+    path: str = typer.Argument("-", help="File to write (default: standard output)"),
+    format: str = typer.Option(None, "--format", help="csv or jsonl (default: from the extension)"),
+):
+    """Write all accounts as CSV or JSONL, streaming them from the database"""
+
+    format = _format_of(path, format)
+    fh = sys.stdout if path == "-" else open(path, "w", newline="")
+
+    serializer = get_serializer(Account, FIELDS)
+    session = get_db_session()
+    rows = (
+        session.query(*serializer.columns)
+        .order_by(Account.username)
+        .yield_per(BATCH_SIZE)
+    )
+
+    if format == "csv":
+        writer = csv.writer(fh)
+        writer.writerow(FIELDS)
+        write = lambda row: writer.writerow(serializer.row_values(row))
+    else:
+        write = lambda row: fh.write(json.dumps(serializer.from_row(row)) + "\n")
+
+    exported = 0
+    try:
+        for row in rows:
+            write(row)
+            exported += 1
+    finally:
+        if fh is not sys.stdout:
+            fh.close()
+
+    print(f"Exported {exported} accounts.", file=sys.stderr)
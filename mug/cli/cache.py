@@ -0,0 +1,37 @@
+import typer
+
+from .. import settings
+from ..connections import get_raw_connection
+from ..pagecache import DEFAULT_MAX_ENTRIES, PageCountCache
+
+app = typer.Typer(name="cache", help="Inspect the page count cache")
+
+
+def get_cache() -> PageCountCache:
+    cache_config = settings.config.get("pagecount", {}).get("cache", {})
+    return PageCountCache(
+        get_raw_connection(), cache_config.get("max_entries", DEFAULT_MAX_ENTRIES)
+    )
+
+
+@app.command()
+def stats():
+    """Display the number of cached page counts, hits and misses"""
+
+    cache = get_cache()
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    ratio = stats["hits"] / lookups if lookups else 0
+
+    print(f"Entries: {stats['entries']} (at most {cache.max_entries})")
+    print(f"Hits:    {stats['hits']}")
+    print(f"Misses:  {stats['misses']}")
+    print(f"Hit ratio: {ratio:.1%}")
+
+
+@app.command()
+def clear():
+    """Remove all cached page counts and reset the counters"""
+
+    get_cache().clear()
+    print("Cleared the page count cache.")
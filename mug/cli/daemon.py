@@ -0,0 +1,43 @@
+import os
+import signal
+import sys
+from pathlib import Path
+from typing import Optional
+
+import typer
+
+from .. import settings
+from ..connections import get_raw_connection
+from ..daemon import AccountingDaemon, get_socket_settings
+
+app = typer.Typer(name="daemon", help="Run the accounting daemon used by the backend")
+
+
+@app.command()
+def run(socket: Optional[Path] = typer.Option(None, "--socket")):
+    """Serve quota requests from backends on a Unix socket until interrupted"""
+
+    path, mode = get_socket_settings(settings.config)
+    if socket:
+        path = str(socket)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    server = AccountingDaemon(
+        path,
+        get_raw_connection(),
+        mode,
+        settings.config.get("billing"),
+        settings.config.get("pagecount"),
+    )
+    print(f"Listening on {path}.")
+
+    # Shut down cleanly (removing the socket) when stopped by a service manager
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
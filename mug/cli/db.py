@@ -0,0 +1,38 @@
+import typer
+
+from .. import migrations
+from ..connections import get_raw_connection
+
+app = typer.Typer(name="db", help="Manage the database schema")
+
+
+@app.command()
+def status():
+    """Display the schema version and the migrations yet to be applied"""
+
+    db = get_raw_connection()
+    print(f"Schema version: {migrations.get_version(db)} (latest is {migrations.LATEST_VERSION})")
+    for migration in migrations.get_pending(db):
+        print(f"  pending: {migration.version} {migration.description}")
+
+
+@app.command()
+def migrate(
+    target: int = typer.Option(
+        migrations.LATEST_VERSION, "--target", help="Version to migrate up to"
+    ),
+):
+    """Upgrade the database schema in place, while printing carries on"""
+
+    db = get_raw_connection()
+
+    try:
+        applied = migrations.migrate(db, target)
+    except Exception as e:
+        print(f"Could not migrate the database from version {migrations.get_version(db)}!")
+        print(f"Details:\n{e}")
+        exit(1)
+
+    for migration in applied:
+        print(f"Applied {migration.version}: {migration.description}")
+    print(f"Schema version: {migrations.get_version(db)}")
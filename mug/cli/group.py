@@ -1,100 +1,184 @@
+import json
+import sys
+from typing import Optional
+
 import typer
+from sqlalchemy import case
 
-from ..connections import get_db_session
-from ..models import Group
+from ..connections import get_db_session, get_raw_connection
+from ..models import Account, Group, GroupUsage
+from ..serializers import to_dict
 
 app = typer.Typer(name="group", help="Various utilities for working with groups")
 
-
-# class ArgumentValidations:
-#     @staticmethod
-#     def is_valid_status(val):
-#         ivalue = int(value)
-#         if ivalue <= 0:
-#             raise TypeError(f"{value} is an invalid positive int value")
-#         return value
-
-#     @staticmethod
-#     def is_valid_quota(val):
-#         course = str(course)
-#         if len(course) > 8 or len(course) < 7:
-#             raise TypeError(f"{course} must be under 7 or 8 characters")
-#         if not course[0:3].isalpha():
-#             raise TypeError(f"First three characters of {course} must be letters")
-#         if not course[3:7].isnumeric():
-#             raise TypeError(f"Next four characters of {course} must be numbers")
-#         return course
-
-#     @staticmethod
-#     def is_valid_group(val):
-#         if course is None:
-#             return course
-#         if len(str(course)) > 3:
-#             raise TypeError(f"Extension must be three or less characters long")
-#         return course
+ADD_MEMBER_SQL = "UPDATE account SET gid = :gid WHERE username = :username"
+ADD_MEMBER_USING_QUOTA_SQL = (
+    "UPDATE account SET gid = :gid, status = 'USING_GROUP_QUOTA' WHERE username = :username"
+)
 
 
 @app.command()
 def create(
-    username: str,
-    status: str = typer.Option("personal", "--status"),
-    quota: int = typer.Option(0, "--quota"),
-    group: str = typer.Option("", "--group"),
+    gid: int,
+    name: str,
+    quota: int = typer.Option(0, "--quota", help="Pages shared by members using the group's quota"),
 ):
-    """Create a new account"""
+    """Create a new group"""
 
     session = get_db_session()
 
+    try:
+        session.add(Group(gid=gid, name=name, page_count=quota))
+        session.add(GroupUsage(gid=gid, pages_printed=0))
+        session.commit()
+        print(f"Successfully created group {gid} ({name}).")
+    except Exception as e:
+        print(f"Could not create group {gid}!")
+        print(f"Details:\n{e}")
+        exit(1)
+
 
 @app.command()
-def get(username: str):
-    """Display all account information"""
+def get(gid: int):
+    """Display all group information, with its usage and number of members"""
 
     session = get_db_session()
 
-    print(
-        session.query(Account)
-        .filter(
-            Account.username == username,
-        )
-        .first()
-    )
+    res = session.query(Group).filter(Group.gid == gid).first()
+
+    if not res:
+        print(f"Group {gid} not found!")
+        exit(1)
+
+    usage = session.query(GroupUsage).filter(GroupUsage.gid == gid).first()
+    details = to_dict(res)
+    details["pages_printed"] = usage.pages_printed if usage else 0
+    details["members"] = session.query(Account).filter(Account.gid == gid).count()
+    print(json.dumps(details))
 
 
 @app.command()
 def update(
-    username: str,
-    status: str = typer.Option("personal", "--status"),
-    quota: int = typer.Option(0, "--quota"),
-    group: str = typer.Option("", "--group"),
+    gid: int,
+    name: str = typer.Option(None, "--name"),
+    quota: int = typer.Option(None, "--quota"),
+    refresh: bool = typer.Option(False, "--refresh", help="Reset the group's page usage"),
 ):
-    """Update an account with relevant attributes"""
-    ARG_TO_STATUS = {
-        "disabled": "DISABLED",
-        "personal": "USING_PERSONAL_QUOTA",
-        "group": "USING_GROUP_QUOTA",
-    }
+    """Update a group with relevant attributes"""
 
     session = get_db_session()
 
-    existing = session.query(Account).filter(Account.username == username).first()
+    existing = session.query(Group).filter(Group.gid == gid).first()
+    if not existing:
+        print(f"Group {gid} not found!")
+        exit(1)
 
     changes = {}
 
-    if existing.status != status:
-        changes["status"] = ARG_TO_STATUS[status]
+    if name is not None and existing.name != name:
+        changes[Group.name] = name
+
+    if quota is not None and existing.page_count != quota:
+        changes[Group.page_count] = quota
 
-    if existing.quota != quota:
-        changes["quota"] = ARG_TO_STATUS[status]
+    if not changes and not refresh:
+        print("No changes to be made, so not attempting update.")
+        exit(0)
 
-    session.query(Account).filter(
-        Account.username == username,
-    ).update(**changes)
+    previous = {column.name: getattr(existing, column.name) for column in changes}
+    if changes:
+        session.query(Group).filter(Group.gid == gid).update(changes)
+    if refresh:
+        session.merge(GroupUsage(gid=gid, pages_printed=0))
+    session.commit()
+
+    print(f"Group {gid} updated successfully.")
+    print("Details:")
+    for k, v in changes.items():
+        print(f"  {k.name} changed from {previous[k.name]} to {v}")
+    if refresh:
+        print("  pages_printed reset to 0")
 
 
 @app.command()
-def delete(username: str):
-    """Remove an account and all associated data"""
+def delete(
+    gid: int,
+    force: bool = typer.Option(
+        False,
+        "--force",
+        help="Remove the group's members from it first, moving those using its quota to their own",
+    ),
+):
+    """Remove a group and its usage"""
+
+    session = get_db_session()
+
+    members = session.query(Account).filter(Account.gid == gid)
+    if members.count() and not force:
+        print(f"Group {gid} still has {members.count()} members! Use --force to remove them from it.")
+        exit(1)
+
+    # Members left on the quota of a group that no longer exists could not print
+    switched = members.filter(Account.status == "USING_GROUP_QUOTA").count()
+    members.update(
+        {
+            Account.gid: None,
+            Account.status: case(
+                (Account.status == "USING_GROUP_QUOTA", "USING_PERSONAL_QUOTA"),
+                else_=Account.status,
+            ),
+        },
+        synchronize_session=False,
+    )
+    session.query(GroupUsage).filter(GroupUsage.gid == gid).delete()
+    res = session.query(Group).filter(Group.gid == gid).delete()
+    session.commit()
+
+    if res:
+        print(f"Group {gid} deleted successfully.")
+        if switched:
+            print(f"{switched} members using its quota now use their personal quota.")
+    else:
+        print(f"Group {gid} not found!")
+        exit(1)
+
+
+@app.command("add-members")
+def add_members(
+    gid: int,
+    usernames: Optional[typer.FileText] = typer.Argument(
+        None, help="File with one username per line (default: standard input)"
+    ),
+    use_quota: bool = typer.Option(
+        False, "--use-quota", help="Also switch the members to the group's quota"
+    ),
+):
+    """Add existing accounts to a group, all at once"""
 
     session = get_db_session()
-    session.delete(Account(username=username))
+    if not session.query(Group).filter(Group.gid == gid).first():
+        print(f"Group {gid} not found!")
+        exit(1)
+
+    names = {line.strip() for line in (usernames or sys.stdin)}
+    names.discard("")
+
+    sql = ADD_MEMBER_USING_QUOTA_SQL if use_quota else ADD_MEMBER_SQL
+    db = get_raw_connection()
+    db.execute("BEGIN")
+    try:
+        # One statement per member, all in one transaction: after executemany,
+        # rowcount is -1 or driver-specific on some DBAPIs
+        added = sum(
+            db.execute(sql, {"gid": gid, "username": name}).rowcount for name in names
+        )
+    except Exception as e:
+        db.execute("ROLLBACK")
+        print(f"Could not add members to group {gid}!")
+        print(f"Details:\n{e}")
+        exit(1)
+    db.execute("COMMIT")
+
+    print(f"Added {added} accounts to group {gid}.")
+    if added < len(names):
+        print(f"{len(names) - added} usernames did not match an account.")
@@ -0,0 +1,103 @@
+"""
+Client for the accounting daemon (see mug.daemon)
+
+This is imported by the backend for every job, so it only depends on the
+standard library. Requests and responses are single lines of JSON.
+"""
+
+import json
+import os
+import socket
+from typing import Optional
+
+DEFAULT_SOCKET = "/run/mug/mug.sock"
+
+# Seconds to wait for the daemon to answer a request
+DEFAULT_TIMEOUT = 10
+
+
+class DaemonError(Exception):
+    """Exceptions reported by, or encountered while talking to, the daemon"""
+
+
+def get_socket_path() -> str:
+    """The backend learns the socket path from its environment (cupsd's SetEnv)"""
+    return os.environ.get("MUG_SOCKET", DEFAULT_SOCKET)
+
+
+class DaemonReservation:
+    """Pages reserved by the daemon for a single job, known to it by `id`"""
+
+    def __init__(self, client: "DaemonClient", id: int):
+        self.client = client
+        self.id = id
+
+    def confirm(self):
+        """Keeps the debit, the job was printed"""
+        self.client.request("commit", id=self.id)
+
+    def release(self):
+        """Gives the reserved pages back, the job was not printed"""
+        self.client.request("release", id=self.id)
+
+
+class DaemonClient:
+    """Quota operations through the accounting daemon, like mug.quota.Accounting"""
+
+    def __init__(self, path: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path or get_socket_path())
+        except OSError:
+            self.sock.close()
+            raise
+        self.stream = self.sock.makefile("rwb")
+
+    def request(self, op: str, **kwargs) -> dict:
+        kwargs["op"] = op
+        self.stream.write(json.dumps(kwargs).encode() + b"\n")
+        self.stream.flush()
+
+        line = self.stream.readline()
+        if not line:
+            raise DaemonError(f"daemon closed the connection during '{op}'")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response
+
+    def reserve(
+        self, username: str, pages: int, job: Optional[dict] = None
+    ) -> Optional[DaemonReservation]:
+        response = self.request("reserve", username=username, pages=pages, job=job)
+        if not response["reserved"]:
+            return None
+        return DaemonReservation(self, response["id"])
+
+    def pages_allowed(self, username: str) -> Optional[int]:
+        return self.request("check", username=username)["pages_allowed"]
+
+    def get_pagecount_config(self) -> dict:
+        return self.request("pagecount")["config"]
+
+    def get_cached_page_count(self, digest: str, size: int, content_type: str) -> Optional[int]:
+        return self.request(
+            "cache_get", digest=digest, size=size, content_type=content_type
+        )["pages"]
+
+    def cache_page_count(self, digest: str, size: int, content_type: str, pages: int):
+        self.request(
+            "cache_put", digest=digest, size=size, content_type=content_type, pages=pages
+        )
+
+    def flush_page_cache(self):
+        """The daemon writes the cache's counters itself"""
+
+    def cost(self, pages: int, job: dict) -> int:
+        return self.request("cost", pages=pages, job=job)["pages"]
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
@@ -1,21 +1,229 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import atexit
+import sqlite3
+from typing import Union
 
-from mug.settings import config
-from mug.models import Base
+from mug import settings
+
+# SQLAlchemy and the models are only imported by the functions that need them,
+# so get_raw_connection (the backend's path) stays cheap to import
+
+# The database is the SQLite file at [sqlite] path, unless [database] url points
+# to a database server (e.g. "postgresql://mug@db.example.org/mug") that several
+# print servers account against
+
+# Applied to every new SQLite connection, overridable from [sqlite.pragmas]
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -8000,
+    "mmap_size": 268435456,
+}
+
+# Connection pool of database servers, overridable from [database]
+DEFAULT_POOL = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_timeout": 30,
+    "pool_pre_ping": True,
+    "pool_recycle": 3600,
+}
+
+# Engines, session factories and raw connections are built once per process
+# and per database
+_engines = {}
+_sessionmakers = {}
+_raw_connections = {}
+
+
+def get_db_path() -> str:
+    url = settings.config.get("database", {}).get("url", "")
+    if url.startswith("sqlite:///"):
+        return url[len("sqlite:///") :]
+    return str(settings.config["sqlite"]["path"])
+
+
+def _get_db_url() -> str:
+    url = settings.config.get("database", {}).get("url")
+    return url or f"sqlite:///{get_db_path()}"
+
+
+def is_sqlite() -> bool:
+    """Whether the database is an SQLite file, rather than a database server"""
+    return _get_db_url().startswith("sqlite:")
+
+
+def _get_pool_settings() -> dict:
+    database = settings.config.get("database", {})
+    return {name: database.get(name, value) for name, value in DEFAULT_POOL.items()}
+
+
+def _get_pragmas() -> dict:
+    pragmas = dict(DEFAULT_PRAGMAS)
+    pragmas.update(settings.config.get("sqlite", {}).get("pragmas", {}))
+    return pragmas
+
+
+def _apply_pragmas(dbapi_connection, pragmas: dict):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
 
 
 def _get_db_engine():
-    dbconf = config["sqlite"]
-    dbdsn = f"sqlite:///{dbconf['path']}"
-    return create_engine(dbdsn)
+    url = _get_db_url()
+
+    if url not in _engines:
+        from sqlalchemy import create_engine, event
+
+        if is_sqlite():
+            engine = create_engine(url)
+            pragmas = _get_pragmas()
+            event.listen(
+                engine, "connect", lambda conn, _: _apply_pragmas(conn, pragmas)
+            )
+        else:
+            engine = create_engine(url, **_get_pool_settings())
+        _engines[url] = engine
 
+    return _engines[url]
 
-def init_db():
-    engine = _get_db_engine()
-    return Base.metadata.create_all(engine)
+
+def init_db() -> bool:
+    """
+    Creates the schema from the models in a new database, at the latest version
+    (see mug.migrations). Returns whether it did; existing databases are
+    upgraded with `mug db migrate` instead
+    """
+
+    from mug import migrations
+
+    db = get_raw_connection()
+    if migrations.is_initialized(db):
+        return False
+
+    from mug.models import Base
+
+    Base.metadata.create_all(_get_db_engine())
+    migrations.stamp(db)
+    return True
 
 
 def get_db_session():
-    Session = sessionmaker(bind=_get_db_engine())
-    return Session()
+    url = _get_db_url()
+
+    if url not in _sessionmakers:
+        from sqlalchemy.orm import sessionmaker
+
+        _sessionmakers[url] = sessionmaker(bind=_get_db_engine())
+
+    return _sessionmakers[url]()
+
+
+def get_raw_connection() -> Union[sqlite3.Connection, "ServerConnection"]:
+    """
+    Returns a plain sqlite3 connection in autocommit mode, for hot paths like the
+    backend that only run a couple of statements and don't need the ORM. It may
+    be shared between threads as long as they serialize their use of it (as the
+    accounting daemon does). For database servers, a ServerConnection stands in
+    for it
+    """
+
+    url = _get_db_url()
+
+    if url not in _raw_connections:
+        if is_sqlite():
+            connection = sqlite3.connect(
+                get_db_path(), isolation_level=None, check_same_thread=False
+            )
+            _apply_pragmas(connection, _get_pragmas())
+        else:
+            connection = ServerConnection(_get_db_engine())
+            atexit.register(connection.close)
+        _raw_connections[url] = connection
+
+    return _raw_connections[url]
+
+
+def table_exists(db: Union[sqlite3.Connection, "ServerConnection"], name: str) -> bool:
+    if isinstance(db, ServerConnection):
+        return db.has_table(name)
+    sql = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+    return db.execute(sql, {"name": name}).fetchone() is not None
+
+
+class ServerConnection:
+    """
+    The part of sqlite3.Connection that the raw SQL (mug.quota, mug.ledger...)
+    uses, over a pooled SQLAlchemy connection to a database server. Statements
+    keep SQLite's `:name` parameters, which text() takes as well, and are run
+    in autocommit mode with explicit transactions, as with sqlite3.
+
+    Servers lock the rows that an UPDATE touches until the transaction ends and
+    re-check its WHERE clause once they hold them, so the conditional UPDATEs
+    reserving quota stay atomic without SQLite's database-wide BEGIN IMMEDIATE.
+    """
+
+    # Transaction statements, as the raw SQL spells them for SQLite
+    TRANSACTION_STATEMENTS = {
+        "BEGIN": "BEGIN",
+        "BEGIN IMMEDIATE": "BEGIN",
+        "COMMIT": "COMMIT",
+        "ROLLBACK": "ROLLBACK",
+    }
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.connection = None
+        self.in_transaction = False
+        self._statements = {}
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = self.engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT"
+            )
+        return self.connection
+
+    def _statement(self, sql: str):
+        if sql not in self._statements:
+            from sqlalchemy import text
+
+            # Transactions are the statements' own, so SQLAlchemy doesn't commit
+            # after INSERT, UPDATE and DDL statements as it otherwise would
+            statement = text(self.TRANSACTION_STATEMENTS.get(sql.strip(), sql))
+            self._statements[sql] = statement.execution_options(autocommit=False)
+        return self._statements[sql]
+
+    def execute(self, sql: str, params=None):
+        from sqlalchemy.exc import DBAPIError
+
+        statement = self._statement(sql)
+        verb = sql.strip()
+        try:
+            result = self._connect().execute(statement, params or {})
+        except DBAPIError as e:
+            # A connection lost between transactions (the server restarted) is
+            # replaced once; within a transaction, the error is the caller's
+            if not e.connection_invalidated or self.in_transaction:
+                raise
+            self.connection = None
+            result = self._connect().execute(statement, params or {})
+
+        if verb in self.TRANSACTION_STATEMENTS:
+            self.in_transaction = verb.startswith("BEGIN")
+        return result
+
+    def executemany(self, sql: str, seq_of_params):
+        return self._connect().execute(self._statement(sql), list(seq_of_params))
+
+    def has_table(self, name: str) -> bool:
+        from sqlalchemy import inspect
+
+        return inspect(self._connect()).has_table(name)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
@@ -0,0 +1,159 @@
+"""
+Job cost
+
+What a job consumes on the device depends on more than its page count: the
+number of copies (argv[4]) and the options the job was submitted with (argv[5]),
+such as page-ranges, number-up and sides. The same handful of option strings
+repeat across thousands of jobs, so everything that only depends on the options
+string is parsed once and cached.
+
+page-ranges and number-up only apply to the document as it was submitted (the
+argv[6] file). Data on standard input went through the filter chain, which has
+already selected the ranges and imposed the pages (pdftopdf), so each of its
+pages is an impression.
+
+Jobs are billed per impression (printed side) by default, or per sheet, as set
+by the `unit` key of the [billing] table. The optional [billing.media] table
+weighs media, e.g. `a3 = 2` bills an A3 sheet as two.
+"""
+
+import math
+import re
+from collections import namedtuple
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+IMPRESSIONS = "impressions"
+SHEETS = "sheets"
+
+Cost = namedtuple("Cost", ["impressions", "sheets"])
+
+_OPTION_RE = re.compile(
+    r"""\s*([^\s=]+)(?:=("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|\{[^}]*\}|(?:[^\s\\]|\\.)*))?"""
+)
+_RANGE_RE = re.compile(r"\s*(\d*)\s*(?:(-)\s*(\d*))?\s*$")
+
+
+def parse_options(options: str) -> dict:
+    """
+    Parses a CUPS options string (name=value pairs separated by whitespace,
+    values optionally quoted), following cupsParseOptions: a bare `name` means
+    name=true and a bare `noname` means name=false
+    """
+
+    parsed = {}
+    pos = 0
+    while pos < len(options):
+        m = _OPTION_RE.match(options, pos)
+        if not m or m.end() == pos:
+            break
+        pos = m.end()
+
+        name, value = m.group(1), m.group(2)
+        if value is None:
+            if name.startswith("no") and len(name) > 2:
+                name, value = name[2:], "false"
+            else:
+                value = "true"
+        elif value[:1] in ("'", '"'):
+            value = re.sub(r"\\(.)", r"\1", value[1:-1])
+        else:
+            value = re.sub(r"\\(.)", r"\1", value)
+
+        parsed[name.lower()] = value
+    return parsed
+
+
+def parse_page_ranges(ranges: Optional[str]) -> Optional[List[Tuple[int, float]]]:
+    """
+    Parses page-ranges (e.g. "1-4,7,10-") into sorted, merged, inclusive ranges.
+    Returns None when every page is printed
+    """
+
+    if not ranges:
+        return None
+
+    parsed = []
+    for part in ranges.split(","):
+        m = _RANGE_RE.match(part)
+        if not m or not (m.group(1) or m.group(3)):
+            continue
+        first = int(m.group(1)) if m.group(1) else 1
+        if m.group(2):
+            last = int(m.group(3)) if m.group(3) else float("inf")
+        else:
+            last = first
+        if first <= last:
+            parsed.append((first, last))
+
+    merged = []
+    for first, last in sorted(parsed):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+class CostModel:
+    """Everything about a job's cost that depends only on its options string"""
+
+    def __init__(self, options: str):
+        parsed = parse_options(options)
+
+        self.ranges = parse_page_ranges(parsed.get("page-ranges"))
+        self.number_up = _positive_int(parsed.get("number-up"), 1)
+        self.duplex = parsed.get("sides", "one-sided").startswith("two-sided")
+        self.media = [m.strip().lower() for m in parsed.get("media", "").split(",") if m.strip()]
+
+    def selected_pages(self, pages: int) -> int:
+        if self.ranges is None:
+            return pages
+        return sum(
+            max(0, min(last, pages) - first + 1) for first, last in self.ranges
+        )
+
+    def cost(self, pages: int, copies: int, filtered: bool = False) -> Cost:
+        if filtered:
+            impressions = pages
+        else:
+            impressions = -(-self.selected_pages(pages) // self.number_up)
+        # Every copy starts on a new sheet
+        sheets = -(-impressions // 2) if self.duplex else impressions
+        return Cost(impressions * copies, sheets * copies)
+
+    def media_weight(self, weights: dict) -> float:
+        for media in self.media:
+            if media in weights:
+                return weights[media]
+        return 1
+
+
+def _positive_int(value: Optional[str], default: int) -> int:
+    try:
+        return max(1, int(value))
+    except (TypeError, ValueError):
+        return default
+
+
+@lru_cache(maxsize=256)
+def get_cost_model(options: str) -> CostModel:
+    return CostModel(options)
+
+
+def job_cost(
+    pages: int, copies: int, options: str, billing: Optional[dict] = None, filtered: bool = False
+) -> int:
+    """
+    Returns what a job is billed, given its page count, number of copies and
+    options string, in the unit set by the [billing] table. `filtered` is set
+    when the pages were counted in the output of the filter chain
+    """
+
+    billing = billing or {}
+    model = get_cost_model(options or "")
+    cost = model.cost(pages, max(1, copies), filtered)
+
+    units = cost.sheets if billing.get("unit", IMPRESSIONS) == SHEETS else cost.impressions
+    weights = {k.lower(): v for k, v in billing.get("media", {}).items()}
+    return math.ceil(units * model.media_weight(weights))
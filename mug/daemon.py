@@ -0,0 +1,173 @@
+"""
+Accounting daemon
+
+CUPS runs the backend as a new process for every job. Rather than have each of
+them load the configuration and open the database, a long-running daemon keeps
+both warm and answers quota requests from backends over a Unix socket (see
+mug.client for the other end). Every request goes through one database
+connection under one lock, so all writes are serialized in this process.
+Reservations are kept by the daemon until they are settled: backends commit or
+release a reservation by the id it was handed out with, and only once.
+Job ledger records and the page count cache's counters are batched and flushed
+at least every LEDGER_FLUSH_INTERVAL seconds.
+"""
+
+import itertools
+import json
+import os
+import socketserver
+import threading
+
+from mug import ledger, quota
+from mug.client import DEFAULT_SOCKET
+from mug.settings import logger
+
+# Permissions of the socket file; backends run as root or as the lp user
+DEFAULT_SOCKET_MODE = 0o660
+
+# Ledger records written per executemany, and the longest they stay buffered
+LEDGER_BATCH_SIZE = 100
+LEDGER_FLUSH_INTERVAL = 1.0
+
+
+class AccountingDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serves quota requests from backends"""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        path: str,
+        db,
+        mode: int = DEFAULT_SOCKET_MODE,
+        billing: dict = None,
+        pagecount: dict = None,
+    ):
+        # A socket left behind by a daemon that didn't shut down cleanly
+        if os.path.exists(path):
+            os.unlink(path)
+
+        super().__init__(path, _RequestHandler)
+        os.chmod(path, mode)
+
+        self.path = path
+        self.db = db
+        self.accounting = quota.Accounting(db, billing, pagecount)
+        self.lock = threading.Lock()
+        self.ledger = ledger.Ledger(db, LEDGER_BATCH_SIZE, self._ledger_error)
+        self.reservations = {}
+        self.reservation_ids = itertools.count(1)
+        self.flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self.stopped = threading.Event()
+        self.ops = {
+            "check": self.op_check,
+            "cost": self.op_cost,
+            "pagecount": self.op_pagecount,
+            "cache_get": self.op_cache_get,
+            "cache_put": self.op_cache_put,
+            "reserve": self.op_reserve,
+            "commit": self.op_commit,
+            "release": self.op_release,
+        }
+
+    def serve_forever(self, *args, **kwargs):
+        self.flusher.start()
+        super().serve_forever(*args, **kwargs)
+
+    def _flush_periodically(self):
+        while not self.stopped.wait(LEDGER_FLUSH_INTERVAL):
+            with self.lock:
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered ledger records and page count cache counters"""
+        self.ledger.flush()
+        try:
+            self.accounting.flush_page_cache()
+        except Exception as e:
+            logger.error("Could not write the page count cache counters: %s", e)
+
+    @staticmethod
+    def _ledger_error(error: Exception):
+        logger.error("Could not write job records to the ledger: %s", error)
+
+    def process(self, request: dict) -> dict:
+        op = self.ops.get(request.pop("op", None))
+        if op is None:
+            return {"error": "unknown operation"}
+
+        with self.lock:
+            return op(**request)
+
+    def op_check(self, username: str) -> dict:
+        return {"pages_allowed": quota.pages_allowed(self.db, username)}
+
+    def op_cost(self, pages: int, job: dict) -> dict:
+        return {"pages": self.accounting.cost(pages, job)}
+
+    def op_pagecount(self) -> dict:
+        return {"config": self.accounting.get_pagecount_config()}
+
+    def op_cache_get(self, digest: str, size: int, content_type: str) -> dict:
+        return {"pages": self.accounting.get_cached_page_count(digest, size, content_type)}
+
+    def op_cache_put(self, digest: str, size: int, content_type: str, pages: int) -> dict:
+        self.accounting.cache_page_count(digest, size, content_type, pages)
+        return {}
+
+    def op_reserve(self, username: str, pages: int, job: dict = None) -> dict:
+        reservation = quota.reserve(self.db, username, pages, job, self.ledger)
+        if reservation is None:
+            return {"reserved": False}
+        reservation_id = next(self.reservation_ids)
+        self.reservations[reservation_id] = reservation
+        return {"reserved": True, "id": reservation_id}
+
+    def op_commit(self, id: int) -> dict:
+        return self._settle(id, quota.Reservation.confirm)
+
+    def op_release(self, id: int) -> dict:
+        return self._settle(id, quota.Reservation.release)
+
+    def _settle(self, reservation_id: int, settle) -> dict:
+        reservation = self.reservations.pop(reservation_id, None)
+        if reservation is None:
+            return {"error": f"no outstanding reservation {reservation_id}"}
+        settle(reservation)
+        return {}
+
+    def server_close(self):
+        self.stopped.set()
+        with self.lock:
+            self.flush()
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Handles one backend connection, which may carry several requests"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.process(json.loads(line))
+            except Exception as e:
+                logger.exception("Failed to process request %r", line)
+                response = {"error": str(e)}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+def get_socket_settings(config: dict) -> tuple:
+    """Reads the socket path and permissions from the [daemon] table"""
+    daemon_config = config.get("daemon", {})
+    path = daemon_config.get("socket", DEFAULT_SOCKET)
+    mode = daemon_config.get("socket_mode")
+    if mode is None:
+        mode = DEFAULT_SOCKET_MODE
+    elif isinstance(mode, str):
+        # As chmod takes it, e.g. "660"
+        mode = int(mode, 8)
+    return path, mode
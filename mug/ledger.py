@@ -0,0 +1,85 @@
+"""
+Job ledger
+
+Every job that reaches accounting is recorded in the append-only `job` table
+(see mug.models.Job) with how it ended, so usage can be audited and reported on
+after the fact. Records are buffered and written with one executemany per
+batch; the backend, which only ever records one job, flushes right away.
+A record that can't be written (e.g. on a database that `mug db migrate` hasn't
+brought up to the ledger yet) doesn't undo the accounting it describes: it is
+handed to the ledger's `on_error` callback, when there is one, and dropped.
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Callable, Optional
+
+# Outcomes, as in mug.models.JOB_OUTCOMES
+PRINTED = "PRINTED"
+FAILED = "FAILED"
+REJECTED = "REJECTED"
+
+INSERT_SQL = """
+INSERT INTO job (job_id, username, printer, pages, copies, timestamp, outcome)
+VALUES (:job_id, :username, :printer, :pages, :copies, :timestamp, :outcome)
+"""
+
+# The format SQLAlchemy uses for DateTime columns on SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def make_record(username: str, pages: int, job: Optional[dict], outcome: str) -> dict:
+    """
+    Builds a ledger row. `job` describes the CUPS job (job_id, printer, copies)
+    and may be left out when nothing is known about it
+    """
+
+    job = job or {}
+    return {
+        "job_id": job.get("job_id", 0),
+        "username": username,
+        "printer": job.get("printer"),
+        "pages": pages,
+        "copies": job.get("copies", 1),
+        "timestamp": datetime.now().strftime(TIMESTAMP_FORMAT),
+        "outcome": outcome,
+    }
+
+
+class Ledger:
+    """Buffers job records and writes them in batches"""
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        batch_size: int = 1,
+        on_error: Optional[Callable[[Exception], None]] = None,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.pending = []
+
+    def add(self, record: dict):
+        self.pending.append(record)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        records, self.pending = self.pending, []
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(INSERT_SQL, records)
+        except Exception as e:
+            self.db.execute("ROLLBACK")
+            if self.on_error is None:
+                raise
+            self.on_error(e)
+            return
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
@@ -0,0 +1,222 @@
+"""
+Schema migrations
+
+The schema is versioned in the `schema_version` table, one row per applied
+migration. Version 0 is the original schema (`account` and `group`); each
+migration below brings a database up one version, and `mug db migrate` applies
+the ones it is missing. New databases are created from the models at the
+latest version instead (see mug.connections.init_db).
+
+Migrations are plain SQL, frozen at the time they were written, and each one
+runs in its own transaction. They only ever add tables and indexes, with
+`IF NOT EXISTS` so that they also apply to databases that already got some of
+them from the models. SQLite builds an index in a single pass over the table
+and readers carry on meanwhile (in WAL mode), so a production database is
+upgraded in place: backends only wait, within their busy timeout, while a
+migration commits.
+
+Databases on a server (see mug.connections.ServerConnection) are created at
+the latest version, but one whose creation was interrupted is brought up with
+`mug db migrate` like any other, so the DDL sticks to types that SQLite and
+PostgreSQL both accept (TIMESTAMP rather than DATETIME, which SQLite treats the
+same).
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import List, NamedTuple, Tuple
+
+from mug.connections import table_exists
+from mug.ledger import TIMESTAMP_FORMAT
+
+CREATE_VERSION_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER NOT NULL PRIMARY KEY,
+    description VARCHAR(128) NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+)
+"""
+
+CURRENT_VERSION_SQL = "SELECT COALESCE(MAX(version), 0) FROM schema_version"
+
+RECORD_VERSION_SQL = """
+INSERT INTO schema_version (version, description, applied_at)
+VALUES (:version, :description, :applied_at)
+"""
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS = [
+    Migration(
+        1,
+        "Job ledger",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS job (
+                id INTEGER NOT NULL,
+                job_id INTEGER NOT NULL,
+                username VARCHAR(64) NOT NULL,
+                printer VARCHAR(128),
+                pages INTEGER NOT NULL,
+                copies INTEGER NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                outcome VARCHAR(8) NOT NULL,
+                PRIMARY KEY (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_job_username_timestamp ON job (username, timestamp)",
+            "CREATE INDEX IF NOT EXISTS ix_job_printer_timestamp ON job (printer, timestamp)",
+        ),
+    ),
+    Migration(
+        2,
+        "Page count cache",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS pagecount_cache (
+                digest VARCHAR(32) NOT NULL,
+                size INTEGER NOT NULL,
+                content_type VARCHAR(128) NOT NULL,
+                pages INTEGER NOT NULL,
+                hits INTEGER NOT NULL,
+                last_used TIMESTAMP NOT NULL,
+                PRIMARY KEY (digest, size, content_type)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_pagecount_cache_last_used ON pagecount_cache (last_used)",
+            """
+            CREATE TABLE IF NOT EXISTS cache_counter (
+                name VARCHAR(32) NOT NULL,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL,
+                PRIMARY KEY (name)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        3,
+        "Group usage",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS group_usage (
+                gid INTEGER NOT NULL,
+                pages_printed INTEGER NOT NULL,
+                PRIMARY KEY (gid),
+                FOREIGN KEY(gid) REFERENCES "group" (gid) ON DELETE CASCADE
+            )
+            """,
+        ),
+    ),
+    Migration(
+        4,
+        "Usage history",
+        (
+            """
+            CREATE TABLE IF NOT EXISTS usage_history (
+                id INTEGER NOT NULL,
+                username VARCHAR(64),
+                gid INTEGER,
+                quota INTEGER,
+                pages_printed INTEGER NOT NULL,
+                archived_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (id)
+            )
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS ix_usage_history_username_archived_at
+            ON usage_history (username, archived_at)
+            """,
+        ),
+    ),
+    Migration(
+        5,
+        "Account indexes on gid, status and date_modified",
+        (
+            "CREATE INDEX IF NOT EXISTS ix_account_gid ON account (gid)",
+            "CREATE INDEX IF NOT EXISTS ix_account_status ON account (status)",
+            "CREATE INDEX IF NOT EXISTS ix_account_date_modified ON account (date_modified)",
+            # Lets the query planner pick the new indexes over a table scan
+            "ANALYZE account",
+        ),
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def is_initialized(db: sqlite3.Connection) -> bool:
+    """Whether the database has a schema at all, or is yet to be created"""
+    return table_exists(db, "account")
+
+
+def get_version(db: sqlite3.Connection) -> int:
+    if not table_exists(db, "schema_version"):
+        return 0
+    return db.execute(CURRENT_VERSION_SQL).fetchone()[0]
+
+
+def get_pending(db: sqlite3.Connection) -> List[Migration]:
+    version = get_version(db)
+    return [migration for migration in MIGRATIONS if migration.version > version]
+
+
+def stamp(db: sqlite3.Connection, version: int = LATEST_VERSION):
+    """Records a database created from the models as being at `version`"""
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute(CREATE_VERSION_TABLE_SQL)
+        current = get_version(db)
+        for migration in MIGRATIONS:
+            if current < migration.version <= version:
+                _record(db, migration)
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def migrate(db: sqlite3.Connection, target: int = LATEST_VERSION) -> List[Migration]:
+    """Applies the migrations up to `target`, each in its own transaction"""
+
+    db.execute(CREATE_VERSION_TABLE_SQL)
+
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version > target:
+            break
+
+        # The version is checked again once the write lock is held, in case
+        # another `mug db migrate` got there first
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if get_version(db) >= migration.version:
+                db.execute("ROLLBACK")
+                continue
+            for statement in migration.statements:
+                db.execute(statement)
+            _record(db, migration)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        applied.append(migration)
+
+    return applied
+
+
+def _record(db: sqlite3.Connection, migration: Migration):
+    db.execute(
+        RECORD_VERSION_SQL,
+        {
+            "version": migration.version,
+            "description": migration.description,
+            "applied_at": datetime.now().strftime(TIMESTAMP_FORMAT),
+        },
+    )
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Enum, Integer, String
+from sqlalchemy import Column, Enum, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.sqltypes import DateTime
 from sqlalchemy_serializer import SerializerMixin
@@ -11,6 +11,8 @@ from sqlalchemy_serializer import SerializerMixin
 
 ALLOWED_STATUS = ["DISABLED", "USING_PERSONAL_QUOTA", "USING_GROUP_QUOTA"]
 
+JOB_OUTCOMES = ["PRINTED", "FAILED", "REJECTED"]
+
 #
 #  Models
 #
@@ -19,22 +21,101 @@ Base = declarative_base()
 
 
 class Account(Base, SerializerMixin):
-    """Basic account with default quota, pages printed, and a group"""
+    """
+    Basic account with default quota, pages printed, and a group. pages_printed
+    is a running total kept up to date with each job; the jobs themselves are
+    recorded in the job ledger
+    """
 
     __tablename__ = "account"
     username = Column(String(64), nullable=False, primary_key=True)
-    gid = Column(Integer, nullable=True)
-    status = Column(Enum(*ALLOWED_STATUS, name="allowed_status"), nullable=False)
+    gid = Column(Integer, nullable=True, index=True)
+    status = Column(
+        Enum(*ALLOWED_STATUS, name="allowed_status", native_enum=False), nullable=False, index=True
+    )
     quota = Column(Integer)
     pages_printed = Column(Integer, default=0, nullable=False)
     date_added = Column(DateTime(), default=datetime.now())
-    date_modified = Column(DateTime())
+    date_modified = Column(DateTime(), index=True)
 
 
 class Group(Base, SerializerMixin):
-    """Basic quota group"""
+    """
+    Basic quota group. page_count is the quota shared by the members using the
+    group's quota; what they have printed is kept in GroupUsage
+    """
 
     __tablename__ = "group"
     gid = Column(Integer, nullable=False, primary_key=True)
     name = Column(String(64), nullable=False)
     page_count = Column(Integer)
+
+
+class GroupUsage(Base, SerializerMixin):
+    """
+    Running total of the pages printed on a group's quota, kept up to date with
+    each job (see mug.quota) so that it is never summed over the members
+    """
+
+    __tablename__ = "group_usage"
+    gid = Column(Integer, ForeignKey("group.gid", ondelete="CASCADE"), primary_key=True)
+    pages_printed = Column(Integer, default=0, nullable=False)
+
+
+class Job(Base, SerializerMixin):
+    """
+    Append-only ledger entry for a single print job and how it ended. pages is
+    what the job was billed (see mug.cost), so the ledger adds up to
+    Account.pages_printed
+    """
+
+    __tablename__ = "job"
+    __table_args__ = (
+        Index("ix_job_username_timestamp", "username", "timestamp"),
+        Index("ix_job_printer_timestamp", "printer", "timestamp"),
+    )
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, nullable=False)
+    username = Column(String(64), nullable=False)
+    printer = Column(String(128))
+    pages = Column(Integer, nullable=False)
+    copies = Column(Integer, default=1, nullable=False)
+    timestamp = Column(DateTime(), default=datetime.now, nullable=False)
+    outcome = Column(Enum(*JOB_OUTCOMES, name="job_outcome", native_enum=False), nullable=False)
+
+
+class PageCountCacheEntry(Base, SerializerMixin):
+    """Page count of a document, by digest, size and content type (see mug.pagecache)"""
+
+    __tablename__ = "pagecount_cache"
+    digest = Column(String(32), primary_key=True)
+    size = Column(Integer, primary_key=True)
+    content_type = Column(String(128), primary_key=True)
+    pages = Column(Integer, nullable=False)
+    hits = Column(Integer, default=0, nullable=False)
+    last_used = Column(DateTime(), nullable=False, index=True)
+
+
+class CacheCounter(Base, SerializerMixin):
+    """Hits and misses of a cache"""
+
+    __tablename__ = "cache_counter"
+    name = Column(String(32), primary_key=True)
+    hits = Column(Integer, default=0, nullable=False)
+    misses = Column(Integer, default=0, nullable=False)
+
+
+class UsageHistory(Base, SerializerMixin):
+    """
+    Usage archived by `mug account reset/adjust --archive`: an account's quota
+    and pages printed, or a group's (username is null) at the time
+    """
+
+    __tablename__ = "usage_history"
+    __table_args__ = (Index("ix_usage_history_username_archived_at", "username", "archived_at"),)
+    id = Column(Integer, primary_key=True)
+    username = Column(String(64))
+    gid = Column(Integer)
+    quota = Column(Integer)
+    pages_printed = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(), nullable=False)
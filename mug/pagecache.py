@@ -0,0 +1,154 @@
+"""
+Page count cache
+
+The same document is often printed more than once: failed jobs are resubmitted
+and handouts go to several queues. Page counts are cached by a digest of the
+job data (see mug.pagecount.digest), its size and its content type, in the
+`pagecount_cache` table (see mug.models.PageCountCacheEntry). The least recently
+used entries are evicted beyond `max_entries`, and hits and misses are counted
+in the `cache_counter` table.
+
+Looking a page count up only reads, so it doesn't wait on quota reservations
+for the database's write lock. Hits (and when entries were last used) and
+misses are counted in memory, and written along with the next entry that is
+put in the cache, or by flush().
+"""
+
+import sqlite3
+from datetime import datetime
+from typing import Optional
+
+from mug.ledger import TIMESTAMP_FORMAT
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# Name of this cache's row in cache_counter
+COUNTER = "pagecount"
+
+LOOKUP_SQL = """
+SELECT pages FROM pagecount_cache
+WHERE digest = :digest AND size = :size AND content_type = :content_type
+"""
+
+TOUCH_SQL = """
+UPDATE pagecount_cache SET hits = hits + :hits, last_used = :now
+WHERE digest = :digest AND size = :size AND content_type = :content_type
+"""
+
+INSERT_SQL = """
+INSERT INTO pagecount_cache (digest, size, content_type, pages, hits, last_used)
+VALUES (:digest, :size, :content_type, :pages, 0, :now)
+ON CONFLICT (digest, size, content_type) DO UPDATE
+SET pages = excluded.pages, hits = 0, last_used = excluded.last_used
+"""
+
+# Entries used no later than the one just past max_entries go (with the same
+# timestamp, a few more may go too)
+EVICT_SQL = """
+DELETE FROM pagecount_cache WHERE last_used <= (
+    SELECT last_used FROM pagecount_cache ORDER BY last_used DESC LIMIT 1 OFFSET :max_entries
+)
+"""
+
+COUNT_SQL = """
+INSERT INTO cache_counter (name, hits, misses) VALUES (:name, :hits, :misses)
+ON CONFLICT (name) DO UPDATE
+SET hits = cache_counter.hits + :hits, misses = cache_counter.misses + :misses
+"""
+
+STATS_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM pagecount_cache),
+    (SELECT hits FROM cache_counter WHERE name = :name),
+    (SELECT misses FROM cache_counter WHERE name = :name)
+"""
+
+
+class PageCountCache:
+    """Page counts by document digest, against a database connection"""
+
+    def __init__(self, db: sqlite3.Connection, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db = db
+        self.max_entries = max_entries
+        # Counted since the last write: hits by entry, and misses
+        self.hits = {}
+        self.misses = 0
+
+    def get(self, digest: str, size: int, content_type: str) -> Optional[int]:
+        key = (digest, size, content_type)
+        row = self.db.execute(
+            LOOKUP_SQL, {"digest": digest, "size": size, "content_type": content_type}
+        ).fetchone()
+
+        if row:
+            self.hits[key] = self.hits.get(key, 0) + 1
+            return row[0]
+        self.misses += 1
+        return None
+
+    def put(self, digest: str, size: int, content_type: str, pages: int):
+        entry = {
+            "digest": digest,
+            "size": size,
+            "content_type": content_type,
+            "pages": pages,
+            "now": _now(),
+        }
+
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute(INSERT_SQL, entry)
+            self.db.execute(EVICT_SQL, {"max_entries": self.max_entries})
+            self._write_counters()
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        self._reset_counters()
+
+    def flush(self):
+        """Writes the hits and misses counted since the last write"""
+
+        if not self.hits and not self.misses:
+            return
+
+        self.db.execute("BEGIN")
+        try:
+            self._write_counters()
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        self._reset_counters()
+
+    def _write_counters(self):
+        if not self.hits and not self.misses:
+            return
+
+        now = _now()
+        for (digest, size, content_type), hits in self.hits.items():
+            self.db.execute(
+                TOUCH_SQL,
+                {"digest": digest, "size": size, "content_type": content_type, "hits": hits, "now": now},
+            )
+        self.db.execute(
+            COUNT_SQL, {"name": COUNTER, "hits": sum(self.hits.values()), "misses": self.misses}
+        )
+
+    def _reset_counters(self):
+        self.hits = {}
+        self.misses = 0
+
+    def stats(self) -> dict:
+        entries, hits, misses = self.db.execute(STATS_SQL, {"name": COUNTER}).fetchone()
+        return {"entries": entries, "hits": hits or 0, "misses": misses or 0}
+
+    def clear(self):
+        self.db.execute("BEGIN")
+        self.db.execute("DELETE FROM pagecount_cache")
+        self.db.execute("DELETE FROM cache_counter WHERE name = :name", {"name": COUNTER})
+        self.db.execute("COMMIT")
+
+
+def _now() -> str:
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
@@ -0,0 +1,114 @@
+"""
+Page counting for print job data
+
+Pages are counted by a chain of engines (see PageCounter), tried in order until
+one of them succeeds. Each document type has its own chain. For PDF it is set by
+the `engines` key of the [pagecount] table; the default reads the page tree over
+the xref and falls back to a full parse with pdfrw for files it doesn't
+understand. benchmarks/pagecount_engines.py compares the PDF engines. The chains
+of other types can be set in [pagecount.types], by MIME type.
+"""
+
+from typing import Optional, Sequence
+
+from mug.pagecount.base import PageCounter, PageCountError, Source, digest, mapped
+from mug.pagecount.pdf import LinearizedCounter, PdfrwCounter, RegexCounter, XrefCounter
+from mug.pagecount.pjl import PclCounter, PostScriptCounter
+
+ENGINES = {
+    engine.name: engine
+    for engine in (
+        XrefCounter,
+        LinearizedCounter,
+        PdfrwCounter,
+        RegexCounter,
+        PostScriptCounter,
+        PclCounter,
+    )
+}
+
+PDF_ENGINES = ("xref", "linearized", "pdfrw", "regex")
+DEFAULT_ENGINES = ("xref", "pdfrw")
+
+PDF = "application/pdf"
+
+# Engine chains by the job's content type (as given by CUPS). Raw queues get
+# whatever the client sent, which is recognized by the PCL engine's PJL parser
+DEFAULT_TYPE_ENGINES = {
+    PDF: DEFAULT_ENGINES,
+    "application/vnd.cups-pdf": DEFAULT_ENGINES,
+    "application/postscript": ("postscript",),
+    "application/vnd.cups-postscript": ("postscript",),
+    "application/vnd.hp-pcl": ("pcl",),
+    "application/vnd.hp-pclxl": ("pcl",),
+    "application/vnd.cups-raw": ("pcl",),
+}
+
+
+def get_engine_names(content_type: str, config: Optional[dict] = None) -> Sequence[str]:
+    """
+    Returns the chain of engines for a content type, as configured by the
+    [pagecount] table
+    """
+
+    config = config or {}
+    content_type = content_type.lower()
+    types = {k.lower(): v for k, v in config.get("types", {}).items()}
+
+    if content_type in types:
+        return types[content_type]
+    if content_type == PDF and config.get("engines"):
+        return config["engines"]
+    if content_type in DEFAULT_TYPE_ENGINES:
+        return DEFAULT_TYPE_ENGINES[content_type]
+    raise PageCountError(f"pages of '{content_type}' documents can't be counted")
+
+
+def get_engines(names: Optional[Sequence[str]] = None) -> list:
+    """Builds the chain of engines with the given names"""
+
+    names = names or DEFAULT_ENGINES
+    unknown = [name for name in names if name not in ENGINES]
+    if unknown:
+        raise PageCountError(f"unknown page counting engine(s): {', '.join(unknown)}")
+    return [ENGINES[name]() for name in names]
+
+
+def count_pages(source: Source, engines: Optional[Sequence[str]] = None, cache=None) -> int:
+    """
+    Returns the number of pages in a document (a path, a file object or bytes),
+    using the first engine of the chain that can count it.
+
+    `cache` (with get(digest, size) and put(digest, size, pages) methods) is
+    looked up before the first engine that reads the whole document, and stores
+    what such an engine counts. Engines that only read a few parts of the
+    document are cheaper than hashing it, so they are tried first
+    """
+
+    chain = get_engines(engines)
+    errors = []
+    key = None
+    with mapped(source) as buf:
+        for engine in chain:
+            if cache is not None and engine.reads_document and key is None:
+                key = digest(buf)
+                pages = cache.get(*key)
+                if pages is not None:
+                    return pages
+
+            try:
+                pages = engine.count(buf)
+            except PageCountError as e:
+                errors.append(str(e))
+                continue
+
+            if key is not None:
+                cache.put(*key, pages)
+            return pages
+
+    raise PageCountError("could not count pages (" + "; ".join(errors) + ")")
+
+
+def count_pdf_pages(source: Source) -> int:
+    """Returns the number of pages in a PDF, using the default engines"""
+    return count_pages(source)
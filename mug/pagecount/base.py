@@ -0,0 +1,92 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Tuple, Union
+
+Source = Union[str, os.PathLike, BinaryIO, bytes]
+
+# Size of the chunks streaming engines work on; a multiple of the page size
+CHUNK_SIZE = 1024 * 1024
+
+
+class PageCountError(Exception):
+    """Exceptions encountered while counting pages"""
+
+
+class PageCounter:
+    """
+    A page counting engine. Engines work on a buffer (usually a memory map of the
+    job file) and raise PageCountError when they can't count a document, so the
+    next engine in the chain can be tried
+    """
+
+    name = None
+
+    # Whether counting takes time in proportion to the document's size, so that
+    # the page count is worth caching (see mug.pagecache)
+    reads_document = True
+
+    def count(self, buf) -> int:
+        raise NotImplementedError
+
+
+@contextmanager
+def mapped(source: Source):
+    """Exposes the source as a buffer, memory mapping it when it is a file"""
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield source
+        return
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as fh:
+            with mapped(fh) as buf:
+                yield buf
+        return
+
+    try:
+        fileno = source.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        # In-memory file objects (mock job data) have nothing to map
+        source.seek(0)
+        yield source.read()
+        source.seek(0)
+        return
+
+    try:
+        buf = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        raise PageCountError("job data is empty")
+
+    try:
+        yield buf
+    finally:
+        buf.close()
+
+
+def chunks(buf, size: int = CHUNK_SIZE):
+    """
+    Yields the buffer in chunks. The pages of a memory map are dropped once
+    their chunk has been processed, so reading through a large job doesn't
+    leave all of it resident
+    """
+
+    dontneed = isinstance(buf, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED")
+    for start in range(0, len(buf), size):
+        yield buf[start : start + size]
+        if dontneed:
+            buf.madvise(mmap.MADV_DONTNEED, start, min(size, len(buf) - start))
+
+
+def digest(buf) -> Tuple[str, int]:
+    """Returns a digest (BLAKE2b) of the buffer's content and its size"""
+
+    # Loading hashlib costs as much as the rest of the package: only jobs that
+    # use the cache pay for it
+    import hashlib
+
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in chunks(buf):
+        h.update(chunk)
+    return h.hexdigest(), len(buf)
@@ -0,0 +1,305 @@
+"""
+PCL page counting
+
+PCL 5 is text interleaved with escape sequences, some of which carry binary
+data (raster rows, downloaded fonts...) whose length is given by their value.
+A page is ejected by a form feed, `ESC&l#H`, a printer reset (`ESC E`) or the
+end of the job, and only if something was put on it, as printers don't print
+blank pages.
+
+PCL XL is a binary stream of typed attribute values and operators, each of
+which has a known size, so it can be walked token by token without decoding
+anything. Every EndPage operator prints a page.
+
+Both scanners work on the job in chunks, carrying incomplete escape sequences
+and tokens over to the next chunk and skipping binary data by its length.
+"""
+
+import re
+import struct
+from typing import Optional
+
+from mug.pagecount.base import PageCountError
+
+# Universal Exit Language, which ends the PCL part of a PJL job
+UEL = b"\x1b%-12345X"
+
+#
+#  PCL 5
+#
+
+_CONTROL_RE = re.compile(rb"[\x0c\x1b]")
+_MARKING_RE = re.compile(rb"[!-\xff]")
+# A value field and its parameter character, lowercase when more follow
+_PARAMETER_RE = re.compile(rb"([+-]?[0-9]*(?:\.[0-9]*)?)([@-~])")
+_VALUE_RE = re.compile(rb"[+-]?[0-9]*(?:\.[0-9]*)?")
+
+# Commands followed by binary data, by family and lowercase parameter character;
+# their value is the length of the data. Those marked True put it on the page
+_DATA_COMMANDS = {
+    (b"*b", ord("w")): True,  # raster row
+    (b"&p", ord("x")): True,  # transparent print data
+}
+_DATA_PARAMETER = ord("w")
+
+
+def _value(field: bytes) -> int:
+    try:
+        return int(float(field))
+    except ValueError:
+        return 0
+
+
+class Pcl5Scanner:
+    """Counts the pages of a PCL 5 job fed to it in chunks"""
+
+    def __init__(self):
+        self.carry = b""
+        # Bytes of binary data still to be skipped
+        self.skip = 0
+        self.marked = False
+        self.pages = 0
+
+    def eject(self):
+        if self.marked:
+            self.pages += 1
+            self.marked = False
+
+    def feed(self, data: bytes, final: bool = False) -> Optional[bytes]:
+        """
+        Scans the next chunk of the job. Returns the rest of the data, starting
+        at the UEL, if the PCL ends in this chunk
+        """
+
+        text = self.carry + data
+        self.carry = b""
+        pos, end = 0, len(text)
+
+        while pos < end:
+            if self.skip:
+                step = min(self.skip, end - pos)
+                pos += step
+                self.skip -= step
+                continue
+
+            m = _CONTROL_RE.search(text, pos)
+            control = m.start() if m else end
+            if not self.marked and _MARKING_RE.search(text, pos, control):
+                self.marked = True
+            pos = control
+            if not m:
+                break
+
+            if text[pos] == 0x0C:
+                self.eject()
+                pos += 1
+                continue
+
+            parsed = self._escape(text, pos)
+            if parsed is None:
+                if final:
+                    break
+                self.carry = text[pos:]
+                return None
+            if parsed < 0:
+                # The UEL ends the job, and any page still being composed
+                self.eject()
+                return text[pos:]
+            pos = parsed
+
+        if final:
+            self.eject()
+        return None
+
+    def close(self):
+        """Ejects the last page at the end of the data"""
+        return self.feed(b"", final=True)
+
+    def _escape(self, text: bytes, pos: int) -> Optional[int]:
+        """
+        Handles the escape sequence at `pos`. Returns where it ends, -1 for a UEL
+        or None when the sequence continues in the next chunk
+        """
+
+        end = len(text)
+        if end - pos < 2:
+            return None
+
+        c = text[pos + 1]
+        if 0x30 <= c <= 0x7E:
+            # Two character escape sequence, of which only reset matters
+            if c == ord("E"):
+                self.eject()
+            return pos + 2
+        if not 0x21 <= c <= 0x2F:
+            return pos + 1
+
+        # Parameterized: ESC, parameterized and (optional) group characters,
+        # then value fields each ending with a parameter character
+        j = pos + 2
+        if j < end and 0x60 <= text[j] <= 0x7E:
+            j += 1
+        family = text[pos + 1 : j]
+
+        while True:
+            m = _PARAMETER_RE.match(text, j)
+            if not m:
+                if j == end or _VALUE_RE.match(text, j).end() == end:
+                    return None
+                # Malformed, resume after it
+                return j
+
+            value, char = m.group(1), m.group(2)[0]
+            j = m.end()
+            final = char < 0x60
+            char |= 0x20
+
+            if family == b"%" and char == ord("x") and _value(value) == -12345:
+                return -1
+            if family == b"&l" and char == ord("h"):
+                self.eject()
+            elif char == _DATA_PARAMETER or (family, char) in _DATA_COMMANDS:
+                if _DATA_COMMANDS.get((family, char)):
+                    self.marked = True
+                self.skip = max(_value(value), 0)
+                # The data ends the sequence: combining after it isn't done
+                return j
+
+            if final:
+                return j
+
+
+#
+#  PCL XL
+#
+
+# Sizes of the data types ubyte, uint16, uint32, sint16, sint32 and real32
+_XL_TYPE_SIZES = (1, 2, 4, 2, 4, 4)
+_XL_WHITESPACE = frozenset(b"\x00\x09\x0a\x0b\x0c\x0d\x20")
+_XL_END_PAGE = 0x44
+_XL_ATTR_UBYTE, _XL_ATTR_UINT16 = 0xF8, 0xF9
+_XL_EMBEDDED_DATA, _XL_EMBEDDED_DATA_BYTE = 0xFA, 0xFB
+
+
+class PclXlScanner:
+    """Counts the pages of a PCL XL job fed to it in chunks"""
+
+    def __init__(self):
+        self.carry = b""
+        self.skip = 0
+        self.header = False
+        self.uint16 = struct.Struct("<H")
+        self.uint32 = struct.Struct("<I")
+        self.pages = 0
+
+    def feed(self, data: bytes, final: bool = False) -> Optional[bytes]:
+        """
+        Scans the next chunk of the job. Returns the rest of the data, starting
+        at the UEL, if the PCL XL stream ends in this chunk
+        """
+
+        text = self.carry + data
+        self.carry = b""
+        pos, end = 0, len(text)
+
+        if not self.header:
+            # The stream header, e.g. ") HP-PCL XL;2;0", gives the byte order
+            newline = text.find(b"\n")
+            if newline < 0:
+                if final:
+                    raise PageCountError("pclxl: no stream header")
+                self.carry = text
+                return None
+            if text[:1] == b"(":
+                self.uint16, self.uint32 = struct.Struct(">H"), struct.Struct(">I")
+            elif text[:1] != b")":
+                raise PageCountError("pclxl: invalid stream header")
+            self.header = True
+            pos = newline + 1
+
+        while pos < end:
+            if self.skip:
+                step = min(self.skip, end - pos)
+                pos += step
+                self.skip -= step
+                continue
+
+            size = self._token(text, pos)
+            if size is None:
+                if final:
+                    raise PageCountError("pclxl: stream ends inside a token")
+                self.carry = text[pos:]
+                return None
+            if size < 0:
+                return text[pos:]
+            pos += size
+
+        return None
+
+    def close(self):
+        return self.feed(b"", final=True)
+
+    def _token(self, text: bytes, pos: int) -> Optional[int]:
+        """
+        Returns the size of the token at `pos`, -1 for a UEL or None when the
+        token continues in the next chunk. Embedded data is left to `skip`
+        """
+
+        tag = text[pos]
+        available = len(text) - pos
+
+        if tag in _XL_WHITESPACE:
+            return 1
+        if tag == 0x1B:
+            if text.startswith(UEL, pos):
+                return -1
+            if UEL.startswith(text[pos:]):
+                return None
+            raise PageCountError("pclxl: unexpected escape")
+        if 0x41 <= tag <= 0xBF:
+            if tag == _XL_END_PAGE:
+                self.pages += 1
+            return 1
+
+        if 0xC0 <= tag <= 0xC5:
+            size = 1 + _XL_TYPE_SIZES[tag - 0xC0]
+        elif 0xD0 <= tag <= 0xD5:
+            size = 1 + 2 * _XL_TYPE_SIZES[tag - 0xD0]
+        elif 0xE0 <= tag <= 0xE5:
+            size = 1 + 4 * _XL_TYPE_SIZES[tag - 0xE0]
+        elif tag == _XL_ATTR_UBYTE:
+            size = 2
+        elif tag == _XL_ATTR_UINT16:
+            size = 3
+        elif 0xC8 <= tag <= 0xCD:
+            # Array: the element type, then its length as a ubyte or uint16
+            if available < 2:
+                return None
+            if text[pos + 1] == 0xC0:
+                if available < 3:
+                    return None
+                length, size = text[pos + 2], 3
+            elif text[pos + 1] == 0xC1:
+                if available < 4:
+                    return None
+                length, size = self.uint16.unpack_from(text, pos + 2)[0], 4
+            else:
+                raise PageCountError("pclxl: invalid array length")
+            self.skip = length * _XL_TYPE_SIZES[tag - 0xC8]
+        elif tag == _XL_EMBEDDED_DATA:
+            if available < 5:
+                return None
+            self.skip = self.uint32.unpack_from(text, pos + 1)[0]
+            size = 5
+        elif tag == _XL_EMBEDDED_DATA_BYTE:
+            if available < 2:
+                return None
+            self.skip = text[pos + 1]
+            size = 2
+        else:
+            raise PageCountError(f"pclxl: unexpected tag 0x{tag:02x}")
+
+        if available < size:
+            self.skip = 0
+            return None
+        return size
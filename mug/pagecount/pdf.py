@@ -0,0 +1,557 @@
+"""
+PDF page counting engines
+
+A full parse of a PDF (what pdfrw does) touches every object in the document
+just to find out how many pages it has. The page count is stored in one place,
+the /Count entry of the page tree root, which can be reached from the trailer
+through the cross-reference data and the document catalog. The xref engine
+follows that path over a memory map of the file, so only the few pages of the
+file that hold the trailer, the xref sections and the handful of objects on the
+way are ever read, no matter how large the document is.
+"""
+
+import re
+import zlib
+from collections import namedtuple
+
+from mug.pagecount.base import PageCountError, PageCounter, chunks
+
+# How far from the end of the file to look for the `startxref` keyword. The
+# spec says 1024 bytes but some producers append garbage after %%EOF
+STARTXREF_SEARCH_WINDOW = 4096
+
+# Limits how deep references are followed, protecting against reference cycles
+MAX_RESOLVE_DEPTH = 32
+
+# Limits how deeply arrays and dictionaries nest, well within the interpreter's
+# recursion limit (the PDF reference recommends 28 at most)
+MAX_NESTING_DEPTH = 64
+
+# The linearization dictionary must be the first object, within this many bytes
+LINEARIZED_SEARCH_WINDOW = 1024
+
+# Chunk size and overlap (longest match) of the regex engine's scan
+SCAN_CHUNK_SIZE = 1024 * 1024
+SCAN_OVERLAP = 64
+
+
+#
+#  Tokenizing
+#
+
+Ref = namedtuple("Ref", ["num", "gen"])
+
+
+class Name(str):
+    """A PDF name object (e.g. /Type), as opposed to a PDF string"""
+
+
+_WS_RE = re.compile(rb"(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*")
+_REF_RE = re.compile(rb"(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![A-Za-z])")
+_NUMBER_RE = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+_NAME_RE = re.compile(rb"/([^\x00\t\n\x0c\r ()<>\[\]{}/%]*)")
+_KEYWORD_RE = re.compile(rb"[A-Za-z]+")
+_HEX_RE = re.compile(rb"<([0-9A-Fa-f\x00\t\n\x0c\r ]*)>")
+_NAME_ESCAPE_RE = re.compile(r"#([0-9A-Fa-f]{2})")
+_OBJ_HEADER_RE = re.compile(rb"[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj")
+_STREAM_RE = re.compile(rb"[\x00\t\n\x0c\r ]*stream(?:\r\n|\n|\r)")
+_XREF_SUBSECTION_RE = re.compile(rb"(\d+)[ \t]+(\d+)[ \t]*(?:\r\n|\n|\r)")
+_XREF_ENTRY_RE = re.compile(rb"(\d{10}) (\d{5}) ([nf])(\r\n| \r| \n|\r|\n| )")
+_STARTXREF_RE = re.compile(rb"startxref[\x00\t\n\x0c\r ]+(\d+)")
+
+_KEYWORDS = {b"true": True, b"false": False, b"null": None}
+
+
+def _skip_ws(buf, pos: int) -> int:
+    return _WS_RE.match(buf, pos).end()
+
+
+def _parse_name(raw: bytes) -> Name:
+    name = raw.decode("latin-1")
+    if "#" in name:
+        name = _NAME_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), name)
+    return Name(name)
+
+
+def _parse_literal_string(buf, pos: int):
+    """Parses a (literal string) starting at its opening parenthesis"""
+    depth = 0
+    start = pos
+    while True:
+        c = buf[pos]
+        if c == 0x5C:  # backslash escapes the next byte
+            pos += 2
+            continue
+        if c == 0x28:
+            depth += 1
+        elif c == 0x29:
+            depth -= 1
+            if depth == 0:
+                return bytes(buf[start + 1 : pos]), pos + 1
+        pos += 1
+
+
+def _parse_object(buf, pos: int, depth: int = 0):
+    """
+    Parses the PDF object starting at (or after whitespace at) `pos` and
+    returns it along with the position following it
+    """
+
+    if depth > MAX_NESTING_DEPTH:
+        raise PageCountError(f"objects nested too deep at offset {pos}")
+
+    pos = _skip_ws(buf, pos)
+    c = buf[pos : pos + 1]
+
+    if c == b"<":
+        if buf[pos + 1 : pos + 2] == b"<":
+            return _parse_dict(buf, pos + 2, depth + 1)
+        m = _HEX_RE.match(buf, pos)
+        if not m:
+            raise PageCountError(f"malformed hex string at offset {pos}")
+        return bytes.fromhex(m.group(1).decode("latin-1")), m.end()
+
+    if c == b"[":
+        items = []
+        pos += 1
+        while True:
+            pos = _skip_ws(buf, pos)
+            if buf[pos : pos + 1] == b"]":
+                return items, pos + 1
+            item, pos = _parse_object(buf, pos, depth + 1)
+            items.append(item)
+
+    if c == b"(":
+        return _parse_literal_string(buf, pos)
+
+    if c == b"/":
+        m = _NAME_RE.match(buf, pos)
+        return _parse_name(m.group(1)), m.end()
+
+    m = _REF_RE.match(buf, pos)
+    if m:
+        return Ref(int(m.group(1)), int(m.group(2))), m.end()
+
+    m = _NUMBER_RE.match(buf, pos)
+    if m:
+        token = m.group(0)
+        if b"." in token:
+            return float(token), m.end()
+        return int(token), m.end()
+
+    m = _KEYWORD_RE.match(buf, pos)
+    if m and m.group(0) in _KEYWORDS:
+        return _KEYWORDS[m.group(0)], m.end()
+
+    raise PageCountError(f"unexpected token {bytes(buf[pos:pos + 16])!r} at offset {pos}")
+
+
+def _parse_dict(buf, pos: int, depth: int = 0):
+    """Parses the body of a dictionary, `pos` being just after the opening <<"""
+    result = {}
+    while True:
+        pos = _skip_ws(buf, pos)
+        if buf[pos : pos + 2] == b">>":
+            return result, pos + 2
+        key, pos = _parse_object(buf, pos, depth)
+        if not isinstance(key, Name):
+            raise PageCountError(f"dictionary key is not a name at offset {pos}")
+        result[key], pos = _parse_object(buf, pos, depth)
+
+
+#
+#  Stream decoding
+#
+
+
+def _png_unpredict(data: bytes, columns: int) -> bytes:
+    """Reverses the PNG predictors used by xref and object streams"""
+    rowlen = columns + 1
+    if len(data) % rowlen:
+        raise PageCountError("predicted stream is not a whole number of rows")
+
+    out = bytearray()
+    prev = bytearray(columns)
+    for start in range(0, len(data), rowlen):
+        ftype = data[start]
+        row = bytearray(data[start + 1 : start + rowlen])
+        if ftype == 1:  # Sub
+            for i in range(1, columns):
+                row[i] = (row[i] + row[i - 1]) & 0xFF
+        elif ftype == 2:  # Up
+            for i in range(columns):
+                row[i] = (row[i] + prev[i]) & 0xFF
+        elif ftype == 3:  # Average
+            for i in range(columns):
+                left = row[i - 1] if i else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        elif ftype == 4:  # Paeth
+            for i in range(columns):
+                a = row[i - 1] if i else 0
+                b = prev[i]
+                c = prev[i - 1] if i else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                if pa <= pb and pa <= pc:
+                    pred = a
+                elif pb <= pc:
+                    pred = b
+                else:
+                    pred = c
+                row[i] = (row[i] + pred) & 0xFF
+        elif ftype != 0:
+            raise PageCountError(f"unknown PNG predictor {ftype}")
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def _decode_stream(doc: "_PdfDocument", stream_dict: dict, raw: bytes) -> bytes:
+    filters = doc.resolve(stream_dict.get("Filter"))
+    parms = doc.resolve(stream_dict.get("DecodeParms"))
+    if filters is None:
+        return raw
+    if isinstance(filters, list):
+        if len(filters) != 1:
+            raise PageCountError("chained stream filters are not supported")
+        filters = doc.resolve(filters[0])
+        if isinstance(parms, list):
+            parms = doc.resolve(parms[0]) if parms else None
+    if filters != "FlateDecode":
+        raise PageCountError(f"unsupported stream filter {filters}")
+    if parms is None:
+        parms = {}
+    elif not isinstance(parms, dict):
+        raise PageCountError(f"invalid stream decode parameters {parms!r}")
+
+    data = zlib.decompress(raw)
+
+    predictor = doc.resolve(parms.get("Predictor", 1))
+    if predictor >= 10:
+        data = _png_unpredict(data, doc.resolve(parms.get("Columns", 1)))
+    elif predictor != 1:
+        raise PageCountError(f"unsupported predictor {predictor}")
+    return data
+
+
+#
+#  Cross-reference sections
+#
+
+
+class _XrefTable:
+    """
+    A classic `xref` table. Entries are fixed width, so looking one up is a
+    matter of arithmetic on the subsection offsets rather than parsing them all
+    """
+
+    def __init__(self, doc: "_PdfDocument", pos: int):
+        buf = doc.buf
+        pos = _skip_ws(buf, pos + len(b"xref"))
+        self.subsections = []
+
+        while True:
+            m = _XREF_SUBSECTION_RE.match(buf, pos)
+            if not m:
+                break
+            first, count = int(m.group(1)), int(m.group(2))
+            entries = m.end()
+            entry = _XREF_ENTRY_RE.match(buf, entries)
+            if count and not entry:
+                raise PageCountError(f"malformed xref entry at offset {entries}")
+            width = entry.end() - entries if entry else 20
+            self.subsections.append((first, count, entries, width))
+            pos = _skip_ws(buf, entries + count * width)
+
+        if buf[pos : pos + 7] != b"trailer":
+            raise PageCountError(f"missing trailer at offset {pos}")
+        pos = _skip_ws(buf, pos + 7)
+        if buf[pos : pos + 2] != b"<<":
+            raise PageCountError(f"malformed trailer at offset {pos}")
+        self.trailer, _ = _parse_dict(buf, pos + 2)
+        self.buf = buf
+
+    def lookup(self, num: int):
+        for first, count, entries, width in self.subsections:
+            if first <= num < first + count:
+                m = _XREF_ENTRY_RE.match(self.buf, entries + (num - first) * width)
+                if not m:
+                    raise PageCountError(f"malformed xref entry for object {num}")
+                if m.group(3) == b"f":
+                    return (0,)
+                return (1, int(m.group(1)), int(m.group(2)))
+        return None
+
+
+class _XrefStream:
+    """A cross-reference stream (PDF 1.5+), whose dictionary is also the trailer"""
+
+    def __init__(self, doc: "_PdfDocument", pos: int):
+        num, obj, data = doc.read_object_at(pos)
+        if not isinstance(obj, dict) or obj.get("Type") != "XRef":
+            raise PageCountError(f"object {num} is not a cross-reference stream")
+
+        self.trailer = obj
+        self.widths = obj["W"]
+        self.rowlen = sum(self.widths)
+        index = obj.get("Index", [0, obj["Size"]])
+        self.subsections = list(zip(index[::2], index[1::2]))
+        self.data = data
+
+    def lookup(self, num: int):
+        row = 0
+        for first, count in self.subsections:
+            if first <= num < first + count:
+                row += num - first
+                break
+            row += count
+        else:
+            return None
+
+        start = row * self.rowlen
+        if start + self.rowlen > len(self.data):
+            raise PageCountError(f"xref stream too short for object {num}")
+
+        fields = []
+        for width in self.widths:
+            fields.append(int.from_bytes(self.data[start : start + width], "big"))
+            start += width
+        if not self.widths[0]:
+            fields[0] = 1  # type defaults to 1 when its field is absent
+        return tuple(fields)
+
+
+#
+#  Documents
+#
+
+
+class _PdfDocument:
+    """Resolves just enough of a PDF's object graph to read the page count"""
+
+    def __init__(self, buf):
+        self.buf = buf
+
+        # Offsets in the file are relative to the %PDF- header, which isn't
+        # necessarily at the very start
+        self.base = buf.find(b"%PDF-", 0, 1024)
+        if self.base < 0:
+            raise PageCountError("missing %PDF- header")
+
+        start = buf.rfind(b"startxref", max(0, len(buf) - STARTXREF_SEARCH_WINDOW))
+        m = _STARTXREF_RE.match(buf, start) if start >= 0 else None
+        if not m:
+            raise PageCountError("could not find startxref")
+
+        self.sections = []
+        self.pending = [int(m.group(1))]
+        self.seen = set()
+        self.object_streams = {}
+
+        self._load_next_section()
+        self.trailer = self.sections[0].trailer
+
+    def _load_next_section(self) -> bool:
+        """
+        Loads the next xref section in the /Prev chain. Sections are only
+        loaded when an object could not be found in the newer ones
+        """
+
+        while self.pending:
+            offset = self.pending.pop(0)
+            if offset in self.seen:
+                continue
+            self.seen.add(offset)
+
+            pos = self.base + offset
+            if self.buf[pos : pos + 4] == b"xref":
+                section = _XrefTable(self, pos)
+            else:
+                section = _XrefStream(self, pos)
+            self.sections.append(section)
+
+            # Hybrid files: the table is searched first, then the stream
+            # referenced by /XRefStm, then the previous revisions
+            nxt = []
+            if isinstance(section, _XrefTable) and "XRefStm" in section.trailer:
+                nxt.append(section.trailer["XRefStm"])
+            if "Prev" in section.trailer:
+                nxt.append(section.trailer["Prev"])
+            self.pending = nxt + self.pending
+            return True
+
+        return False
+
+    def lookup(self, num: int):
+        i = 0
+        while True:
+            while i < len(self.sections):
+                entry = self.sections[i].lookup(num)
+                if entry is not None:
+                    return entry
+                i += 1
+            if not self._load_next_section():
+                raise PageCountError(f"object {num} is not in any xref section")
+
+    def read_object_at(self, pos: int):
+        """Reads the indirect object at `pos`, returning (num, object, stream data)"""
+        m = _OBJ_HEADER_RE.match(self.buf, pos)
+        if not m:
+            raise PageCountError(f"no object at offset {pos}")
+        obj, pos = _parse_object(self.buf, m.end())
+
+        data = None
+        if isinstance(obj, dict):
+            s = _STREAM_RE.match(self.buf, pos)
+            if s:
+                length = self.resolve(obj["Length"])
+                raw = self.buf[s.end() : s.end() + length]
+                data = _decode_stream(self, obj, raw)
+        return int(m.group(1)), obj, data
+
+    def get_object(self, num: int):
+        entry = self.lookup(num)
+
+        if entry[0] == 1:
+            found, obj, _ = self.read_object_at(self.base + entry[1])
+            if found != num:
+                raise PageCountError(f"xref points object {num} at object {found}")
+            return obj
+
+        if entry[0] == 2:
+            return self._get_compressed_object(num, entry[1], entry[2])
+
+        raise PageCountError(f"object {num} is free")
+
+    def _get_compressed_object(self, num: int, stmnum: int, index: int):
+        if stmnum not in self.object_streams:
+            entry = self.lookup(stmnum)
+            if entry[0] != 1:
+                raise PageCountError(f"object stream {stmnum} is not a plain object")
+            _, stm, data = self.read_object_at(self.base + entry[1])
+            if data is None or stm.get("Type") != "ObjStm":
+                raise PageCountError(f"object {stmnum} is not an object stream")
+            self.object_streams[stmnum] = (stm, data)
+
+        stm, data = self.object_streams[stmnum]
+        pos = 0
+        header = []
+        for _ in range(stm["N"] * 2):
+            value, pos = _parse_object(data, pos)
+            header.append(value)
+        if header[index * 2] != num:
+            raise PageCountError(f"object stream {stmnum} does not hold object {num}")
+        obj, _ = _parse_object(data, stm["First"] + header[index * 2 + 1])
+        return obj
+
+    def resolve(self, value, depth: int = 0):
+        if isinstance(value, Ref):
+            if depth > MAX_RESOLVE_DEPTH:
+                raise PageCountError("reference chain too deep")
+            return self.resolve(self.get_object(value.num), depth + 1)
+        return value
+
+    def page_count(self) -> int:
+        root = self.resolve(self.trailer["Root"])
+        pages = self.resolve(root["Pages"])
+        count = self.resolve(pages["Count"])
+        if not isinstance(count, int) or count < 0:
+            raise PageCountError(f"invalid page count {count!r}")
+        return count
+
+
+#
+#  Engines
+#
+
+# Errors that mean the fast paths met something they can't handle, as opposed
+# to bugs
+_PARSE_ERRORS = (
+    PageCountError, AttributeError, KeyError, IndexError, TypeError, ValueError, zlib.error
+)
+
+_PAGE_OBJECT_RE = re.compile(rb"/Type[\x00\t\n\x0c\r ]*/Page(?![A-Za-z0-9_.#-])")
+
+
+class XrefCounter(PageCounter):
+    """Reads /Count from the page tree root, following the trailer and xref"""
+
+    name = "xref"
+    reads_document = False
+
+    def count(self, buf) -> int:
+        try:
+            return _PdfDocument(buf).page_count()
+        except _PARSE_ERRORS as e:
+            raise PageCountError(f"xref: {e}") from e
+
+
+class LinearizedCounter(PageCounter):
+    """
+    Linearized ("fast web view") PDFs start with a linearization dictionary that
+    anchors the hint tables and carries the page count (/N). It is only trusted
+    while its /L still matches the file length, i.e. the file hasn't been
+    incrementally updated since it was linearized
+    """
+
+    name = "linearized"
+    reads_document = False
+
+    def count(self, buf) -> int:
+        try:
+            base = buf.find(b"%PDF-", 0, LINEARIZED_SEARCH_WINDOW)
+            m = _OBJ_HEADER_RE.search(buf, max(base, 0), max(base, 0) + LINEARIZED_SEARCH_WINDOW)
+            if base < 0 or not m:
+                raise PageCountError("no object near the start of the file")
+            params, _ = _parse_object(buf, m.end())
+        except _PARSE_ERRORS as e:
+            raise PageCountError(f"linearized: {e}") from e
+
+        if not isinstance(params, dict) or "Linearized" not in params:
+            raise PageCountError("linearized: file is not linearized")
+        if params.get("L") != len(buf) - base:
+            raise PageCountError("linearized: file was updated after linearization")
+        if not isinstance(params.get("N"), int) or params["N"] < 0:
+            raise PageCountError("linearized: invalid page count")
+        return params["N"]
+
+
+class PdfrwCounter(PageCounter):
+    """Parses the whole document with pdfrw, which copes with some damage"""
+
+    name = "pdfrw"
+
+    def count(self, buf) -> int:
+        from pdfrw import PdfReader
+        from pdfrw.errors import PdfParseError
+
+        try:
+            return len(PdfReader(fdata=buf[:], verbose=False).pages)
+        # pdfrw's parser is recursive too, and gives up on deeply nested objects
+        except (PdfParseError, AttributeError, TypeError, ValueError, RecursionError) as e:
+            raise PageCountError(f"pdfrw: {e}") from e
+
+
+class RegexCounter(PageCounter):
+    """
+    Last resort: counts `/Type /Page` objects in the raw bytes, in chunks. Pages
+    inside compressed object streams are missed, and pages replaced by
+    incremental updates are counted twice
+    """
+
+    name = "regex"
+
+    def count(self, buf) -> int:
+        count = 0
+        tail = b""
+        for chunk in chunks(buf, SCAN_CHUNK_SIZE):
+            text = tail + chunk
+            # Matches starting in the last SCAN_OVERLAP bytes may not be whole
+            # yet: they are counted with the next chunk, which those bytes start
+            end = max(len(text) - SCAN_OVERLAP, 0)
+            count += sum(1 for m in _PAGE_OBJECT_RE.finditer(text) if m.start() < end)
+            tail = text[end:]
+        count += sum(1 for _ in _PAGE_OBJECT_RE.finditer(tail))
+        if not count:
+            raise PageCountError("regex: no page objects found")
+        return count
@@ -0,0 +1,131 @@
+"""
+Printer job counting
+
+Jobs for PostScript and PCL printers are usually wrapped in PJL: a Universal
+Exit Language sequence and `@PJL` command lines, then `@PJL ENTER LANGUAGE`
+and the document, up to the next UEL. A job may hold several documents, in
+different languages. Jobs without PJL are recognized by how they start.
+
+The engines here walk the job in chunks, handing each document to the scanner
+for its language (see mug.pagecount.postscript and mug.pagecount.pcl), and add
+up their pages.
+"""
+
+import re
+
+from mug.pagecount.base import PageCounter, PageCountError, chunks
+from mug.pagecount.pcl import Pcl5Scanner, PclXlScanner
+from mug.pagecount.postscript import DscScanner
+
+UEL = b"\x1b%-12345X"
+
+SCANNERS = {
+    "POSTSCRIPT": DscScanner,
+    "PCL": Pcl5Scanner,
+    "PCLXL": PclXlScanner,
+}
+
+_ENTER_RE = re.compile(rb"@PJL\s+ENTER\s+LANGUAGE\s*=\s*(\w+)", re.IGNORECASE)
+_BLANK = b"\x00\x04\t\n\r "
+
+# Bytes looked at to recognize a document's language
+SNIFF_SIZE = 16
+
+
+def sniff_language(data: bytes, default: str) -> str:
+    data = data.lstrip(_BLANK)
+    if data.startswith(b"%!"):
+        return "POSTSCRIPT"
+    if data[2:11] == b"HP-PCL XL" and data[:1] in (b"(", b")"):
+        return "PCLXL"
+    if data.startswith(b"\x1b"):
+        return "PCL"
+    if data.startswith(b"%PDF"):
+        raise PageCountError("job is a PDF document")
+    return default
+
+
+class JobScanner:
+    """Counts the pages of a (possibly PJL wrapped) job fed to it in chunks"""
+
+    def __init__(self, default_language: str):
+        self.default_language = default_language
+        self.scanner = None
+        self.carry = b""
+        self.pages = 0
+        self.documents = 0
+
+    def feed(self, data: bytes, final: bool = False):
+        text = self.carry + data
+        self.carry = b""
+
+        while text:
+            if self.scanner:
+                text = self.scanner.feed(text)
+                if text is None:
+                    return
+                self._end_document()
+                continue
+
+            text = text.lstrip(_BLANK)
+            if text.startswith(UEL):
+                text = text[len(UEL) :]
+            elif text.startswith(b"@PJL"):
+                newline = text.find(b"\n")
+                if newline < 0:
+                    break
+                m = _ENTER_RE.match(text, 0, newline)
+                if m:
+                    self._start_document(m.group(1).decode().upper())
+                text = text[newline + 1 :]
+            elif len(text) < SNIFF_SIZE and not final:
+                break
+            else:
+                self._start_document(sniff_language(text, self.default_language))
+
+        # A PJL command cut short at the end of the job is dropped
+        self.carry = b"" if final else text
+
+    def close(self) -> int:
+        self.feed(b"", final=True)
+        if self.scanner:
+            self.scanner.close()
+            self._end_document()
+        if not self.documents:
+            raise PageCountError("job holds no document")
+        return self.pages
+
+    def _start_document(self, language: str):
+        if language not in SCANNERS:
+            raise PageCountError(f"unsupported printer language {language}")
+        self.scanner = SCANNERS[language]()
+
+    def _end_document(self):
+        self.pages += self.scanner.pages
+        self.documents += 1
+        self.scanner = None
+
+
+def count_job(buf, default_language: str) -> int:
+    job = JobScanner(default_language)
+    for chunk in chunks(buf):
+        job.feed(chunk)
+    return job.close()
+
+
+class PostScriptCounter(PageCounter):
+    """PostScript jobs, by DSC comments or showpage operators"""
+
+    name = "postscript"
+
+    def count(self, buf) -> int:
+        return count_job(buf, "POSTSCRIPT")
+
+
+class PclCounter(PageCounter):
+    """PCL 5 and PCL XL jobs, by page ejects and EndPage operators"""
+
+    name = "pcl"
+
+    def count(self, buf) -> int:
+        return count_job(buf, "PCL")
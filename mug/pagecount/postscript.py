@@ -0,0 +1,113 @@
+"""
+PostScript page counting
+
+PostScript is a program, so the only way to know exactly how many pages it
+prints is to run it. Almost every producer (and CUPS' own filters) follows the
+Document Structuring Conventions though, which mark each page with a `%%Page:`
+comment and give the total in `%%Pages:`. When a document has neither, the
+`showpage` operators in it are counted instead, which is right for the simple
+documents that don't use DSC.
+
+The scanner works on the job in chunks, carrying a few bytes over from one to
+the next so that nothing straddling a chunk boundary is missed or counted twice.
+"""
+
+import re
+from typing import Optional
+
+# Universal Exit Language, which ends the PostScript part of a PJL job
+UEL = b"\x1b%-12345X"
+
+# Bytes carried over between chunks, more than the longest token
+KEEP = 16
+
+# Lines longer than this are scanned without waiting for their end (binary data)
+MAX_LINE = 64 * 1024
+
+# Every alternative starts with a literal (and checks what precedes it after),
+# which lets the regex engine skip ahead to candidates quickly
+_TOKEN_RE = re.compile(
+    # DSC comments, which start a line
+    rb"%%(?<=[\r\n]%%)(?:(Pages?):[ \t]*([^\r\n]*)|(BeginDocument|EndDocument)\b[^\r\n]*)(?=[\r\n])"
+    # showpage, as an executed name (not /showpage, a comment, part of a name or
+    # the start of a string)
+    rb"|showpage(?<![^\s{}\[\])<>]showpage)(?![^\s{}\[\]()<>/%])"
+    rb"|" + re.escape(UEL)
+)
+_INT_RE = re.compile(rb"\s*(\d+)")
+
+
+class DscScanner:
+    """Counts the pages of a PostScript document fed to it in chunks"""
+
+    def __init__(self):
+        # The carried over bytes, of which the first `scanned` were already scanned
+        self.carry = b"\n"
+        self.scanned = 1
+
+        # Depth of embedded documents (EPS figures), whose comments don't count
+        self.depth = 0
+        self.page_comments = 0
+        self.pages_comment = None
+        self.showpages = 0
+
+    @property
+    def pages(self) -> int:
+        if self.page_comments:
+            return self.page_comments
+        if self.pages_comment is not None:
+            return self.pages_comment
+        return self.showpages
+
+    def feed(self, data: bytes, final: bool = False) -> Optional[bytes]:
+        """
+        Scans the next chunk of the document. Returns the rest of the data,
+        starting at the UEL, if the document ends in this chunk
+        """
+
+        text = self.carry + data
+        if final:
+            cut = len(text)
+        else:
+            # Only scan complete lines, unless the line is too long to wait for
+            cut = max(text.rfind(b"\n"), text.rfind(b"\r")) + 1
+            if cut <= self.scanned:
+                if len(text) < MAX_LINE:
+                    self.carry = text
+                    return None
+                cut = len(text) - KEEP
+
+        for m in _TOKEN_RE.finditer(text, 1, cut):
+            if m.end() <= self.scanned:
+                continue
+            if m.group(0) == UEL:
+                return text[m.start() :]
+            self._handle(m)
+
+        keep = max(cut - KEEP, 0)
+        self.carry = text[keep:]
+        self.scanned = cut - keep
+        return None
+
+    def close(self):
+        """Scans what is left at the end of the data"""
+        return self.feed(b"\n", final=True)
+
+    def _handle(self, m):
+        comment, value, section = m.group(1), m.group(2), m.group(3)
+        if section == b"BeginDocument":
+            self.depth += 1
+        elif section == b"EndDocument":
+            self.depth = max(self.depth - 1, 0)
+        elif self.depth:
+            pass
+        elif comment == b"Page":
+            self.page_comments += 1
+        elif comment == b"Pages":
+            # `(atend)` defers the count to the trailer, which comes later
+            number = _INT_RE.match(value)
+            if number:
+                self.pages_comment = int(number.group(1))
+        else:
+            self.showpages += 1
+
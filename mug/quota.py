@@ -0,0 +1,253 @@
+"""
+Quota reservations
+
+A job's pages are debited from the account before the job is sent to the
+printer, with one conditional UPDATE that only succeeds while enough quota is
+left. Concurrent backends can therefore never spend the same remaining pages
+twice. Once the real backend has run, the reservation is confirmed (the debit
+stays) or released (the debit is undone). Either way, and for jobs that are
+rejected outright, the job is recorded in the ledger (see mug.ledger).
+
+Accounts using their group's quota are debited from the group's row in
+`group_usage` (see mug.models.GroupUsage) in the same transaction as their own
+running total, so a group's remaining pages are a lookup by gid rather than a
+sum over its members. Disabled accounts can't print.
+
+On a database server, the conditional UPDATEs lock the rows they debit until
+the transaction ends, so concurrent reservations only queue on the same account
+or group. Group rows are always locked before their members' accounts.
+"""
+
+import sqlite3
+from typing import Callable, Optional
+
+from mug import cost, ledger, pagecache
+
+# Account statuses, as in mug.models.ALLOWED_STATUS
+DISABLED = "DISABLED"
+USING_PERSONAL_QUOTA = "USING_PERSONAL_QUOTA"
+USING_GROUP_QUOTA = "USING_GROUP_QUOTA"
+
+RESERVE_SQL = """
+UPDATE account
+SET pages_printed = COALESCE(pages_printed, 0) + :pages
+WHERE username = :username AND status = 'USING_PERSONAL_QUOTA'
+    AND quota - COALESCE(pages_printed, 0) >= :pages
+"""
+
+ACCOUNT_SQL = """
+SELECT status, gid FROM account WHERE username = :username
+"""
+
+CREATE_GROUP_USAGE_SQL = """
+INSERT INTO group_usage (gid, pages_printed)
+SELECT gid, 0 FROM "group" WHERE gid = :gid
+ON CONFLICT DO NOTHING
+"""
+
+RESERVE_GROUP_SQL = """
+UPDATE group_usage
+SET pages_printed = pages_printed + :pages
+WHERE gid = :gid
+    AND (SELECT COALESCE(page_count, 0) FROM "group" WHERE gid = :gid) - pages_printed >= :pages
+"""
+
+DEBIT_GROUP_MEMBER_SQL = """
+UPDATE account
+SET pages_printed = COALESCE(pages_printed, 0) + :pages
+WHERE username = :username AND status = 'USING_GROUP_QUOTA' AND gid = :gid
+"""
+
+# Usage may have been reset or adjusted while the job held its reservation, so
+# releasing it never takes the usage below zero
+RELEASE_SQL = """
+UPDATE account
+SET pages_printed = CASE WHEN pages_printed > :pages THEN pages_printed - :pages ELSE 0 END
+WHERE username = :username
+"""
+
+RELEASE_GROUP_SQL = """
+UPDATE group_usage
+SET pages_printed = CASE WHEN pages_printed > :pages THEN pages_printed - :pages ELSE 0 END
+WHERE gid = :gid
+"""
+
+PAGES_ALLOWED_SQL = """
+SELECT CASE account.status
+    WHEN 'USING_GROUP_QUOTA'
+        THEN COALESCE("group".page_count, 0) - COALESCE(group_usage.pages_printed, 0)
+    WHEN 'DISABLED' THEN 0
+    ELSE account.quota - COALESCE(account.pages_printed, 0)
+END
+FROM account
+LEFT JOIN "group" ON "group".gid = account.gid
+LEFT JOIN group_usage ON group_usage.gid = account.gid
+WHERE account.username = :username
+"""
+
+
+class QuotaError(Exception):
+    """Exceptions encountered while reserving or settling quota"""
+
+
+class Reservation:
+    """
+    Pages tentatively debited from an account for a single job, and from its
+    group (`gid`) when it uses the group's quota
+    """
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        username: str,
+        pages: int,
+        job: Optional[dict] = None,
+        job_ledger: Optional[ledger.Ledger] = None,
+        gid: Optional[int] = None,
+    ):
+        self.db = db
+        self.username = username
+        self.pages = pages
+        self.job = job
+        self.gid = gid
+        self.ledger = job_ledger or ledger.Ledger(db)
+        self.settled = False
+
+    def confirm(self):
+        """Keeps the debit, the job was printed"""
+        self._settle(ledger.PRINTED)
+
+    def release(self):
+        """Gives the reserved pages back, the job was not printed"""
+        params = {"username": self.username, "gid": self.gid, "pages": self.pages}
+        if self.gid is None:
+            self.db.execute(RELEASE_SQL, params)
+        else:
+            _transaction(self.db, [(RELEASE_GROUP_SQL, params), (RELEASE_SQL, params)])
+        self._settle(ledger.FAILED)
+
+    def _settle(self, outcome: str):
+        if self.settled:
+            raise QuotaError(f"reservation for {self.username} was already settled")
+        self.settled = True
+        self.ledger.add(ledger.make_record(self.username, self.pages, self.job, outcome))
+
+
+def reserve(
+    db: sqlite3.Connection,
+    username: str,
+    pages: int,
+    job: Optional[dict] = None,
+    job_ledger: Optional[ledger.Ledger] = None,
+) -> Optional[Reservation]:
+    """
+    Atomically checks that `username` (or their group) has at least `pages`
+    pages left and debits them. Returns None, recording the job as rejected,
+    when the account doesn't exist, is disabled or lacks the quota
+    """
+
+    job_ledger = job_ledger or ledger.Ledger(db)
+    params = {"username": username, "pages": pages}
+
+    # Personal quotas, the common case, take a single statement
+    if db.execute(RESERVE_SQL, params).rowcount:
+        return Reservation(db, username, pages, job, job_ledger)
+
+    account = db.execute(ACCOUNT_SQL, params).fetchone()
+    if account and account[0] == USING_GROUP_QUOTA and account[1] is not None:
+        params["gid"] = account[1]
+        if _reserve_group(db, params):
+            return Reservation(db, username, pages, job, job_ledger, account[1])
+
+    job_ledger.add(ledger.make_record(username, pages, job, ledger.REJECTED))
+    return None
+
+
+def _reserve_group(db: sqlite3.Connection, params: dict) -> bool:
+    """Debits a group and its member in one transaction"""
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        db.execute(CREATE_GROUP_USAGE_SQL, params)
+        reserved = (
+            db.execute(RESERVE_GROUP_SQL, params).rowcount
+            # The account may have left the group since it was looked up
+            and db.execute(DEBIT_GROUP_MEMBER_SQL, params).rowcount
+        )
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT" if reserved else "ROLLBACK")
+    return bool(reserved)
+
+
+def _transaction(db: sqlite3.Connection, statements: list):
+    db.execute("BEGIN")
+    try:
+        for sql, params in statements:
+            db.execute(sql, params)
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    db.execute("COMMIT")
+
+
+def pages_allowed(db: sqlite3.Connection, username: str) -> Optional[int]:
+    """
+    Returns a user's remaining pages (their group's, when they use the group's
+    quota), or None if the account doesn't exist
+    """
+
+    row = db.execute(PAGES_ALLOWED_SQL, {"username": username}).fetchone()
+    return row[0] if row else None
+
+
+class Accounting:
+    """
+    Quota operations against a database connection. The accounting daemon's
+    client (mug.client.DaemonClient) offers the same interface
+    """
+
+    def __init__(
+        self,
+        db: sqlite3.Connection,
+        billing: Optional[dict] = None,
+        pagecount: Optional[dict] = None,
+        ledger_error: Optional[Callable[[Exception], None]] = None,
+    ):
+        self.db = db
+        self.billing = billing
+        self.pagecount = pagecount
+        self.ledger = ledger.Ledger(db, on_error=ledger_error)
+        self.page_cache = pagecache.PageCountCache(
+            db,
+            self.get_pagecount_config()
+            .get("cache", {})
+            .get("max_entries", pagecache.DEFAULT_MAX_ENTRIES),
+        )
+
+    def get_pagecount_config(self) -> dict:
+        """The [pagecount] table, which sets the page counting engines"""
+        return self.pagecount or {}
+
+    def get_cached_page_count(self, digest: str, size: int, content_type: str) -> Optional[int]:
+        return self.page_cache.get(digest, size, content_type)
+
+    def cache_page_count(self, digest: str, size: int, content_type: str, pages: int):
+        self.page_cache.put(digest, size, content_type, pages)
+
+    def flush_page_cache(self):
+        """Writes the page count cache's hit and miss counters"""
+        self.page_cache.flush()
+
+    def cost(self, pages: int, job: dict) -> int:
+        """Returns what a job of `pages` pages is billed (see mug.cost)"""
+        return cost.job_cost(
+            pages, job.get("copies", 1), job.get("options", ""), self.billing, job.get("filtered", False)
+        )
+
+    def reserve(self, username: str, pages: int, job: Optional[dict] = None) -> Optional[Reservation]:
+        return reserve(self.db, username, pages, job, self.ledger)
+
+    def pages_allowed(self, username: str) -> Optional[int]:
+        return pages_allowed(self.db, username)
@@ -0,0 +1,89 @@
+"""
+Model serialization
+
+SerializerMixin.to_dict walks a model reflectively on every call, which adds
+up quickly when thousands of rows are written out. The serializers here are
+built once per model from its columns instead: a tuple of column names and a
+tuple of converters, applied positionally. They give the same dicts as to_dict
+(dates formatted as DATE_FORMAT), from model instances or from the plain row
+tuples of a column query or a raw cursor, which are much cheaper to fetch.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy.sql.sqltypes import DateTime
+
+# The format of dates in serialized records, as with to_dict
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_datetime(value) -> Optional[str]:
+    """Formats a DateTime column's value, as loaded by SQLAlchemy or sqlite3"""
+
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        # The same as strftime(DATE_FORMAT), in a fraction of the time
+        return value.isoformat(" ", "seconds")
+    # sqlite3 returns the stored text, with microseconds
+    return value[:19]
+
+
+class ModelSerializer:
+    """Serializes the columns of a model, in table order"""
+
+    __slots__ = ("model", "fields", "columns", "_converters")
+
+    def __init__(self, model, fields: Optional[Iterable[str]] = None):
+        table_columns = model.__table__.columns
+        self.model = model
+        self.fields = tuple(fields or (column.name for column in table_columns))
+        # The model's attributes, to pass to session.query
+        self.columns = tuple(getattr(model, field) for field in self.fields)
+        self._converters = tuple(
+            (i, format_datetime)
+            for i, field in enumerate(self.fields)
+            if isinstance(table_columns[field].type, DateTime)
+        )
+
+    def row_values(self, row: Tuple) -> list:
+        """The row's values, converted, in the order of `fields`"""
+
+        values = list(row)
+        for i, convert in self._converters:
+            values[i] = convert(values[i])
+        return values
+
+    def from_row(self, row: Tuple) -> Dict[str, Any]:
+        """Serializes a row tuple, with a value for each of `fields` in order"""
+        return dict(zip(self.fields, self.row_values(row)))
+
+    def from_rows(self, rows: Iterable[Tuple]) -> Iterator[Dict[str, Any]]:
+        for row in rows:
+            yield self.from_row(row)
+
+    def serialize(self, instance) -> Dict[str, Any]:
+        """Serializes a model instance, like instance.to_dict()"""
+
+        values = [getattr(instance, field) for field in self.fields]
+        for i, convert in self._converters:
+            values[i] = convert(values[i])
+        return dict(zip(self.fields, values))
+
+
+_serializers: Dict[Tuple, ModelSerializer] = {}
+
+
+def get_serializer(model, fields: Optional[Iterable[str]] = None) -> ModelSerializer:
+    """Returns the (shared) serializer of a model's columns, or some of them"""
+
+    key = (model, tuple(fields) if fields else None)
+    if key not in _serializers:
+        _serializers[key] = ModelSerializer(model, fields)
+    return _serializers[key]
+
+
+def to_dict(instance) -> Dict[str, Any]:
+    return get_serializer(type(instance)).serialize(instance)
+
@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+#
+# aiocups : asyncio CUPS support for pkipplib
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+
+"""An asyncio CUPS client, alongside the blocking pkipplib.CUPS.
+
+AsyncCUPS has the methods of CUPS, as coroutines, and sends many requests at
+once over a pool of keep-alive connections:
+
+    cups = AsyncCUPS()
+    answers = await asyncio.gather(*[cups.getJobAttributes(j) for j in jobids])
+    await cups.close()
+
+Requests are encoded and answers parsed by IPPRequest, as with CUPS. The
+HTTP/1.1 transport only needs asyncio, over TCP or CUPS' domain socket.
+"""
+
+import asyncio
+import urllib3
+from urllib.parse import urlsplit
+
+from .pkipplib import (
+    CUPS,
+    CUPS_GET_DEVICES,
+    CUPS_GET_PPDS,
+    CUPS_PRINTER_CLASS,
+    DEFAULT_RETRIES,
+    STREAM_CHUNK_SIZE,
+    IPPRequest,
+    IPPStreamParser,
+)
+
+# How many requests are sent at once, by default
+DEFAULT_LIMIT = 16
+
+
+class AsyncResponse:
+    """An HTTP response, whose body is yet to be read.
+
+    The connection goes back to its pool once the body is read, or is
+    closed if the response is closed before.
+    """
+
+    def __init__(self, pool, connection, status, reason, headers, keepalive):
+        """Initializes the response, once its headers are read."""
+        self.pool = pool
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.timeout = None  # for each read, if any
+        self.deadline = None  # for the whole body, if any (in the loop's time)
+        self.data = None  # the body, once read by AsyncCUPS.postRequest
+        self._connection = connection
+        self._keepalive = keepalive
+        self._complete = False
+        self._chunked = "chunked" in headers.get("transfer-encoding", "").lower()
+        length = headers.get("content-length")
+        self._remaining = None if (self._chunked or length is None) else int(length)
+
+    async def _read(self, coroutine):
+        """Awaits a read from the connection, within the timeout and deadline."""
+        timeout = self.timeout
+        if self.deadline is not None:
+            remaining = self.deadline - asyncio.get_running_loop().time()
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        if timeout is None:
+            return await coroutine
+        return await asyncio.wait_for(coroutine, timeout)
+
+    async def stream(self, amt=STREAM_CHUNK_SIZE):
+        """Yields the body, in chunks of up to amt bytes."""
+        reader = self._connection[0]
+        try:
+            if self._chunked:
+                while True:
+                    line = await self._read(reader.readline())
+                    size = int(line.split(b";")[0], 16)
+                    if not size:
+                        # Trailers, up to an empty line
+                        while (await self._read(reader.readline())).strip():
+                            pass
+                        break
+                    while size:
+                        data = await self._read(reader.read(min(size, amt)))
+                        if not data:
+                            raise ConnectionResetError("Incomplete HTTP answer.")
+                        size -= len(data)
+                        yield data
+                    await self._read(reader.readexactly(2))
+            elif self._remaining is not None:
+                while self._remaining:
+                    data = await self._read(reader.read(min(self._remaining, amt)))
+                    if not data:
+                        raise ConnectionResetError("Incomplete HTTP answer.")
+                    self._remaining -= len(data)
+                    yield data
+            else:
+                # Up to the end of the connection
+                self._keepalive = False
+                while True:
+                    data = await self._read(reader.read(amt))
+                    if not data:
+                        break
+                    yield data
+            self._complete = True
+        except asyncio.IncompleteReadError:
+            raise ConnectionResetError("Incomplete HTTP answer.")
+        except ValueError:
+            raise ConnectionError("Invalid HTTP answer.")
+        finally:
+            self.release()
+
+    async def read(self):
+        """Returns the whole body."""
+        return b"".join([data async for data in self.stream()])
+
+    def release(self):
+        """Returns the connection to the pool, or closes it if the body is unread."""
+        if self._connection is None:
+            return
+        connection = self._connection
+        self._connection = None
+        self.pool.putConnection(connection, self._complete and self._keepalive)
+
+    close = release
+
+
+class AsyncConnectionPool:
+    """A pool of keep-alive HTTP/1.1 connections to one server.
+
+    At most limit requests are sent at once, the others wait for their
+    turn, and up to maxsize idle connections are kept for the next ones.
+    """
+
+    def __init__(
+        self,
+        scheme,
+        host,
+        port=None,
+        socket_path=None,
+        limit=DEFAULT_LIMIT,
+        maxsize=None,
+        connect_timeout=None,
+        retries=DEFAULT_RETRIES,
+    ):
+        """Initializes the pool, without connecting."""
+        self.scheme = scheme
+        self.host = host
+        self.port = port or (443 if scheme == "https" else 631)
+        self.socketPath = socket_path
+        self.maxsize = maxsize or limit
+        self.connectTimeout = connect_timeout
+        self.retries = retries
+        self.limit = limit
+        self.idle = []
+        # Created by the first request : before Python 3.10, a semaphore is
+        # bound to the event loop current when it is created.
+        self.semaphore = None
+        if socket_path is not None:
+            self.hostHeader = "localhost"
+        else:
+            self.hostHeader = "%s:%s" % (host, self.port)
+
+    async def connect(self):
+        """Opens a new connection, retrying as set by retries."""
+        attempt = 0
+        while True:
+            try:
+                if self.socketPath is not None:
+                    connection = asyncio.open_unix_connection(self.socketPath)
+                else:
+                    connection = asyncio.open_connection(
+                        self.host, self.port, ssl=(self.scheme == "https")
+                    )
+                return await asyncio.wait_for(connection, self.connectTimeout)
+            except (OSError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+
+    def putConnection(self, connection, reusable):
+        """Takes back a connection, keeping it for another request if possible."""
+        if reusable and len(self.idle) < self.maxsize:
+            self.idle.append(connection)
+        else:
+            connection[1].close()
+        self.semaphore.release()
+
+    async def request(self, path, headers, body, timeout=None):
+        """Posts body to path, and returns the AsyncResponse once its headers
+        are read. The body must be read, or the response closed.
+
+        timeout : the seconds allowed for the request and its answer (the
+        response's deadline), from when it is sent rather than queued.
+        """
+        message = ["POST %s HTTP/1.1" % path, "Host: %s" % self.hostHeader]
+        message.extend("%s: %s" % header for header in headers.items())
+        message.append("Content-Length: %i" % len(body))
+        message = ("\r\n".join(message) + "\r\n\r\n").encode("latin-1") + body
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+        await self.semaphore.acquire()
+        try:
+            start = asyncio.get_running_loop().time()
+            response = await asyncio.wait_for(self.exchange(message), timeout)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        if timeout is not None:
+            response.deadline = start + timeout
+        return response
+
+    async def exchange(self, message):
+        """Sends a request over an idle or a new connection."""
+        while True:
+            reused = bool(self.idle)
+            connection = self.idle.pop() if reused else await self.connect()
+            try:
+                return await self.send(connection, message)
+            except BaseException as error:
+                connection[1].close()
+                # An idle connection the server has closed meanwhile
+                if not (reused and isinstance(error, ConnectionError)):
+                    raise
+
+    async def send(self, connection, message):
+        """Sends a request over a connection, and reads the answer's headers."""
+        (reader, writer) = connection
+        writer.write(message)
+        await writer.drain()
+        statusline = await reader.readline()
+        if not statusline:
+            raise ConnectionResetError("Connection closed by the server.")
+        try:
+            statusline = statusline.decode("latin-1").rstrip("\r\n") + " "
+            (version, status, reason) = statusline.split(" ", 2)
+            status = int(status)
+        except ValueError:
+            raise ConnectionError("Invalid HTTP answer : %r" % statusline)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            (name, _, value) = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        connectionheader = headers.get("connection", "").lower()
+        if version == "HTTP/1.0":
+            keepalive = connectionheader == "keep-alive"
+        else:
+            keepalive = connectionheader != "close"
+        return AsyncResponse(self, connection, status, reason.strip(), headers, keepalive)
+
+    async def close(self):
+        """Closes the idle connections."""
+        while self.idle:
+            writer = self.idle.pop()[1]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+class AsyncCUPS(CUPS):
+    """An asyncio client for a CUPS instance.
+
+    The methods which send a request are coroutines (or asynchronous
+    generators, for iterRequest, iterJobs and iterPrinters), and any number
+    of them can be awaited at once: up to limit requests are sent at a time,
+    each over its own connection, and the others wait for their turn.
+
+    timeout bounds each request and its answer from when it is sent, as a
+    number of seconds or an urllib3.Timeout (its total, else the sum of its
+    connect and read timeouts). Streamed answers only have the read timeout
+    between two reads. The instance is to be used within one event loop,
+    and with concurrent requests, lastError is that of the last one to fail.
+    """
+
+    def __init__(
+        self,
+        url=None,
+        username=None,
+        password=None,
+        charset="utf-8",
+        language="en-us",
+        debug=False,
+        timeout=None,
+        retries=DEFAULT_RETRIES,
+        maxsize=None,
+        limit=DEFAULT_LIMIT,
+    ):
+        """Initializes the CUPS instance.
+
+        limit : how many requests to send at once.
+        maxsize : how many idle connections to keep alive, limit by default.
+        """
+        self.limit = limit
+        self.urlPools = {}
+        CUPS.__init__(
+            self,
+            url=url,
+            username=username,
+            password=password,
+            charset=charset,
+            language=language,
+            debug=debug,
+            timeout=timeout,
+            retries=retries,
+            maxsize=maxsize or limit,
+        )
+        timeout = self.poolOptions["timeout"]
+        if isinstance(timeout, urllib3.Timeout):
+            if timeout.total is not None:
+                self.requestTimeout = timeout.total
+            elif None in (timeout.connect_timeout, timeout.read_timeout):
+                self.requestTimeout = None
+            else:
+                self.requestTimeout = timeout.connect_timeout + timeout.read_timeout
+            self.readTimeout = timeout.read_timeout
+        else:
+            self.requestTimeout = self.readTimeout = timeout
+
+    def newPool(self, url=None):
+        """Creates a connection pool to the CUPS server, or to url."""
+        timeout = self.poolOptions["timeout"]
+        if isinstance(timeout, urllib3.Timeout):
+            timeout = timeout.connect_timeout
+        retries = self.poolOptions["retries"]
+        if isinstance(retries, urllib3.Retry):
+            retries = retries.connect or 0
+        options = {
+            "limit": self.limit,
+            "maxsize": self.poolOptions["maxsize"],
+            "connect_timeout": timeout,
+            "retries": retries,
+        }
+        if url is None and self.socketPath is not None:
+            return AsyncConnectionPool("http", "localhost", socket_path=self.socketPath, **options)
+        parts = urlsplit(url or self.url)
+        return AsyncConnectionPool(parts.scheme, parts.hostname, parts.port, **options)
+
+    async def close(self):
+        """Closes the pooled connections."""
+        await self.http.close()
+        for pool in self.urlPools.values():
+            await pool.close()
+
+    async def postRequest(self, req, url=None, stream=False, timeout=None):
+        """Posts a request to the CUPS server.
+        returns the AsyncResponse, or None if the request failed (see lastError).
+        stream : leave the body to be read, within the read timeout.
+        timeout : the request's timeout, instead of the instance's.
+        """
+        self.lastError = None
+        self.lastErrorMessage = None
+
+        pool = self.http
+        path = "/"
+        if url is not None:
+            url = url.replace("ipp://", "http://")
+            parts = urlsplit(url)
+            key = (parts.scheme, parts.hostname, parts.port)
+            if key not in self.urlPools:
+                self.urlPools[key] = self.newPool(url)
+            pool = self.urlPools[key]
+            path = parts.path or "/"
+        if timeout is None:
+            timeout = self.requestTimeout
+
+        try:
+            response = await pool.request(path, self.headers, req.dump(), timeout)
+            if response.status != 200:
+                response.close()
+                self.lastError = response.status
+                self.lastErrorMessage = "HTTP error %s : %s" % (response.status, response.reason)
+                return None
+            if stream:
+                # Huge answers may take longer than a request, as long as they come
+                response.deadline = None
+                response.timeout = self.readTimeout
+            else:
+                response.data = await response.read()
+        except asyncio.TimeoutError as error:
+            self.lastError = error
+            self.lastErrorMessage = "Request timed out after %s seconds" % timeout
+            return None
+        except OSError as error:
+            self.lastError = error
+            self.lastErrorMessage = str(error)
+            return None
+        return response
+
+    async def doRequest(self, req, url=None, lazy=False, timeout=None):
+        """Sends a request to the CUPS server.
+        returns a new IPPRequest object, containing the parsed answer,
+        or None if the request failed (see lastError).
+        lazy : parse the answer lazily, for lookups of a few attributes.
+        timeout : the request's timeout, instead of the instance's.
+        """
+        response = await self.postRequest(req, url, timeout=timeout)
+        if response is None:
+            return None
+
+        ipp_response = IPPRequest(response.data)
+        ipp_response.parse(lazy)
+        return ipp_response
+
+    async def iterRequest(self, req, url=None):
+        """Sends a request to the CUPS server, and yields the groups of the
+        answer, as (attributes type, attributes) tuples, as they arrive.
+
+        Nothing is yielded if the request failed (see lastError). Left
+        before its end, the generator must be closed (see contextlib.aclosing)
+        to give its connection back.
+        """
+        response = await self.postRequest(req, url, stream=True)
+        if response is None:
+            return
+
+        parser = IPPStreamParser(debug=self.debug)
+        chunks = response.stream()
+        try:
+            async for chunk in chunks:
+                for group in parser.feed(chunk):
+                    yield group
+            parser.close()
+        except asyncio.TimeoutError as error:
+            self.lastError = error
+            self.lastErrorMessage = "Answer timed out after %s seconds" % response.timeout
+        except OSError as error:
+            self.lastError = error
+            self.lastErrorMessage = str(error)
+        finally:
+            await chunks.aclose()
+            response.close()
+
+    async def iterGroups(self, req, wanted):
+        """Yields the groups of a type of the answer, as dictionaries."""
+        groups = self.iterRequest(req)
+        try:
+            async for (attrtype, attributes) in groups:
+                if attrtype == wanted:
+                    yield dict(attributes)
+        finally:
+            await groups.aclose()
+
+    def iterJobs(self, queuename=None, which="not-completed", requested=("all",)):
+        """Yields the attributes of print jobs as they arrive (see CUPS.iterJobs)."""
+        return self.iterGroups(self.newJobsRequest(queuename, which, requested), "job")
+
+    def iterPrinters(self, requested=("all",)):
+        """Yields the attributes of print queues as they arrive (see CUPS.iterPrinters)."""
+        return self.iterGroups(self.newPrintersRequest(requested), "printer")
+
+    async def getPrinters(self):
+        """Returns the list of print queues names."""
+        req = self.newPrintersRequest(("printer-name",))
+        req.operation["printer-type"] = ("enum", 0)
+        req.operation["printer-type-mask"] = ("enum", CUPS_PRINTER_CLASS)
+        answer = await self.doRequest(req, lazy=True)
+        return [printer[1] for printer in answer.printer["printer-name"]]
+
+    async def getDevices(self):
+        """Returns a list of devices as (deviceclass, deviceinfo, devicemakeandmodel, deviceuri) tuples."""
+        answer = await self.doRequest(self.newRequest(CUPS_GET_DEVICES), lazy=True)
+        return zip(
+            [d[1] for d in answer.printer["device-class"]],
+            [d[1] for d in answer.printer["device-info"]],
+            [d[1] for d in answer.printer["device-make-and-model"]],
+            [d[1] for d in answer.printer["device-uri"]],
+        )
+
+    async def getPPDs(self):
+        """Returns a list of PPDs as (ppdnaturallanguage, ppdmake, ppdmakeandmodel, ppdname) tuples."""
+        answer = await self.doRequest(self.newRequest(CUPS_GET_PPDS), lazy=True)
+        return zip(
+            [d[1] for d in answer.printer["ppd-natural-language"]],
+            [d[1] for d in answer.printer["ppd-make"]],
+            [d[1] for d in answer.printer["ppd-make-and-model"]],
+            [d[1] for d in answer.printer["ppd-name"]],
+        )
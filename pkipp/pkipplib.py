@@ -26,14 +26,28 @@ from sqlite3 import connect
 import sys
 import os
 import urllib3  # TODO: Ensure urllib2->urllib3 conversion works
-from urllib3.exceptions import HTTPError
+from urllib3.connection import HTTPConnection
+from urllib3.exceptions import ConnectTimeoutError, HTTPError, NewConnectionError
 import socket
-from struct import pack, unpack
+from struct import Struct, pack
+from struct import error as struct_error
 
 IPP_VERSION = "1.1"  # default version number
 
 IPP_PORT = 631
 
+# CUPS' local domain socket, used by default when it exists
+CUPS_DOMAIN_SOCKET = "/run/cups/cups.sock"
+
+# Connection pool defaults : connect and read timeouts in seconds, and retries
+# (of connections only : IPP requests aren't safe to send twice)
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_RETRIES = 2
+DEFAULT_POOL_MAXSIZE = 4
+# How much of an answer is read at a time when it is streamed
+STREAM_CHUNK_SIZE = 64 * 1024
+
 IPP_MAX_NAME = 256
 IPP_MAX_VALUES = 8
 
@@ -291,6 +305,7 @@ class FakeAttribute:
     def __setitem__(self, key, value):
         """Appends the value to the real attribute."""
         attributeslist = getattr(self.request, "_%s_attributes" % self.name)
+        self.request._index.pop(self.name, None)
         for attribute in attributeslist:
             for subattr in attribute:
                 (attrname, attrvalue) = subattr
@@ -301,16 +316,12 @@ class FakeAttribute:
 
     def __getitem__(self, key):
         """Returns an attribute's value."""
-        answer = []
-        attributeslist = getattr(self.request, "_%s_attributes" % self.name)
-        for attribute in attributeslist:
-            for subattr in attribute:
-                (attrname, attrvalue) = subattr
-                if attrname == key:
-                    answer.extend(attrvalue)
-        if answer:
-            return answer
-        raise KeyError(key)
+        return self.request.getValues(self.name, key)
+
+
+# Precompiled unpackers for the parser
+USHORT = Struct(">H")
+UINT = Struct(">I")
 
 
 class IPPRequest:
@@ -324,6 +335,17 @@ class IPPRequest:
         "subscription",
         "event_notification",
     )
+    attributes_lists = tuple("_%s_attributes" % attrtype for attrtype in attributes_types)
+
+    # Delimiter tags which start a group, and the group's attributes type
+    group_tags = {
+        0x01: "operation",
+        0x02: "job",
+        0x04: "printer",
+        0x05: "unsupported",
+        0x06: "subscription",
+        0x07: "event_notification",
+    }
 
     def __init__(
         self,
@@ -344,6 +366,11 @@ class IPPRequest:
         self._data: bytes = data
         self.parsed: bool = False
 
+        # Values by attributes type and name, built on the first lookup
+        self._index = {}
+        # Offsets of the values, by attributes type and name, when parsed lazily
+        self._offsets = None
+
         # Initializes message
         self.setVersion(version)
         self.setOperationId(operation_id)
@@ -415,6 +442,12 @@ class IPPRequest:
         """Fakes attribute access."""
         if name in self.attributes_types:
             return FakeAttribute(self, name)
+        elif name in self.attributes_lists and self.__dict__.get("_offsets") is not None:
+            # The attributes of a lazily parsed message, parsed in full on first use
+            for attributes in self.attributes_lists:
+                setattr(self, attributes, [[]])
+            self.parse()
+            return getattr(self, name)
         else:
             raise AttributeError(name)
 
@@ -503,108 +536,344 @@ class IPPRequest:
         mybuffer.append(self.data.encode())
         return b"".join(mybuffer)
 
-    def parse(self):
+    def getValues(self, attrtype, name):
+        """Returns the values of an attribute, in all the groups of a type.
+
+        The values are looked up in an index of the groups by name, built
+        once rather than scanning the groups for every attribute. The list
+        returned is the index's own, to be copied before being changed.
+        """
+        index = self._index.get(attrtype)
+        if index is None:
+            index = self._index[attrtype] = self.buildIndex(attrtype)
+        values = index.get(name)
+        if values is None and self._offsets is not None:
+            offsets = self._offsets[attrtype].get(name.encode())
+            if offsets:
+                values = index[name] = [self.decodeValue(offset) for offset in offsets]
+        if not values:
+            raise KeyError(name)
+        return values
+
+    def buildIndex(self, attrtype):
+        """Indexes the values of a type of attributes by name."""
+        index = {}
+        if self._offsets is not None:
+            # Filled in as values are decoded
+            return index
+        for attribute in getattr(self, "_%s_attributes" % attrtype):
+            for (name, values) in attribute:
+                if name in index:
+                    index[name].extend(values)
+                else:
+                    index[name] = list(values)
+        return index
+
+    def decodeValue(self, position):
+        """Decodes the value whose tag is at position, when parsed lazily."""
+        data = self._data
+        tagtype = self.tags[data[position]]
+        position += 3 + USHORT.unpack_from(data, position + 1)[0]
+        valuelength = USHORT.unpack_from(data, position)[0]
+        position += 2
+        if tagtype in ("integer", "enum"):
+            if valuelength != 4:
+                raise IPPError("Invalid %s value in IPP message." % tagtype)
+            return (tagtype, UINT.unpack_from(data, position)[0])
+        value = data[position : position + valuelength]
+        if tagtype == "boolean":
+            value = ord(value)
+        return (tagtype, value)
+
+    def parseHeader(self):
+        """Parses the version, operation id and request id."""
+        data = self._data
+        self.setVersion((data[0], data[1]))
+        self.setOperationId(USHORT.unpack_from(data, 2)[0])
+        self.setRequestId(UINT.unpack_from(data, 4)[0])
+
+    def parse(self, lazy=False):
         """Parses an IPP Request.
 
         NB : Only a subset of RFC2910 is implemented.
+
+        lazy : only record where the values are, to decode them when looked
+        up (e.g. answer.printer["printer-name"]). The attributes lists are
+        parsed in full when first used.
         """
-        self._curname = None
-        self._curattributes = None
-
-        self.setVersion((self._data[0], self._data[1]))
-        # Unpack as big-endian short
-        # https://docs.python.org/3/library/struct.html
-        self.setOperationId(unpack(">H", self._data[2:4])[0])
-        self.setRequestId(unpack(">I", self._data[4:8])[0])
-        self.position = 8
+        if lazy:
+            return self.scan()
+
+        # Large answers (CUPS_GET_PRINTERS, IPP_GET_JOBS) hold thousands of
+        # attributes, so they are parsed in a single loop which reads lengths
+        # and integers in place, slicing out only names and values.
+        data = self._data
+        tags = self.tags
+        unpackShort = USHORT.unpack_from
+        unpackInt = UINT.unpack_from
+        debug = self.debug
         endofattributes = self.tagvalues["end-of-attributes-tag"]
         maxdelimiter = self.tagvalues["event_notification-attributes-tag"]
-        nulloffset = lambda: 0
+        groups = dict(
+            (tag, getattr(self, "_%s_attributes" % attrtype))
+            for (tag, attrtype) in self.group_tags.items()
+        )
+
+        self.parseHeader()
+        name = None
+        attributes = None
+        position = 8
         try:
-            tag = self._data[self.position]
+            tag = data[position]
             while tag != endofattributes:
-                self.position += 1
-                name = self.tags[tag]
-                if name is not None:
-                    func = getattr(self, name.replace("-", "_"), nulloffset)
-                    self.position += func()
-                    if self._data[self.position] > maxdelimiter:
-                        self.position -= 1
-                        continue
+                position += 1
+                group = groups.get(tag)
+                if group is not None:
+                    # Attributes of the group, up to the next delimiter tag
+                    attributes = group
+                    while True:
+                        tagtype = tags[data[position]]
+                        namelength = unpackShort(data, position + 1)[0]
+                        position += 3
+                        if namelength:
+                            # An empty name means another value of the same attribute
+                            name = data[position : position + namelength].decode()
+                            position += namelength
+                        valuelength = unpackShort(data, position)[0]
+                        position += 2
+                        if tagtype in ("integer", "enum"):
+                            if valuelength != 4:
+                                raise IPPError("Invalid %s value in IPP message." % tagtype)
+                            value = unpackInt(data, position)[0]
+                        else:
+                            value = data[position : position + valuelength]
+                            if tagtype == "boolean":
+                                value = ord(value)
+                        position += valuelength
+                        current = attributes[-1]
+                        if current and current[-1][0] == name:
+                            current[-1][1].append((tagtype, value))
+                        else:
+                            current.append((name, [(tagtype, value)]))
+                        if debug:
+                            self.logDebug("%s(%s) : %s" % (name, tagtype, value))
+                        if data[position] <= maxdelimiter:
+                            break
+                elif tags[tag] is not None and data[position] > maxdelimiter:
+                    # A value tag outside of any group
+                    raise IPPError("Unexpected tag 0x%02x in IPP message." % tag)
                 oldtag = tag
-                tag = self._data[self.position]
+                tag = data[position]
                 if tag == oldtag:
-                    self._curattributes.append([])
-        except IndexError:
+                    attributes.append([])
+        except (IndexError, struct_error):
             raise IPPError("Unexpected end of IPP message.")
 
-        self.data = self._data[self.position + 1 :]
+        self._index = {}
+        self._offsets = None
+        self.position = position
+        self.data = self._data[position + 1 :]
         self.parsed = True
 
-    def parseTag(self):
-        """Extracts information from an IPP tag."""
-        pos = self.position
-        tagtype = self.tags[self._data[pos]]
-        pos += 1
-        posend = pos2 = pos + 2
-        namelength = unpack(">H", self._data[pos:pos2])[0]
-        if not namelength:
-            name = self._curname
-        else:
-            posend += namelength
-            self._curname = name = self._data[pos2:posend].decode()
-        pos2 = posend + 2
-        valuelength = unpack(">H", self._data[posend:pos2])[0]
-        posend = pos2 + valuelength
-        value = self._data[pos2:posend]
-        if tagtype in ("integer", "enum"):
-            value = unpack(">I", value)[0]
-        elif tagtype == "boolean":
-            value = ord(value)
+    def scan(self):
+        """Records the offsets of the values, by attributes type and name."""
+        data = self._data
+        unpackShort = USHORT.unpack_from
+        endofattributes = self.tagvalues["end-of-attributes-tag"]
+        maxdelimiter = self.tagvalues["event_notification-attributes-tag"]
+        offsets = dict((attrtype, {}) for attrtype in self.attributes_types)
+        groups = dict(
+            (tag, offsets[attrtype]) for (tag, attrtype) in self.group_tags.items()
+        )
+
+        self.parseHeader()
+        name = None
+        position = 8
         try:
-            (oldname, oldval) = self._curattributes[-1][-1]
-            if oldname == name:
-                oldval.append((tagtype, value))
+            tag = data[position]
+            while tag != endofattributes:
+                position += 1
+                group = groups.get(tag)
+                if group is not None:
+                    while True:
+                        namelength = unpackShort(data, position + 1)[0]
+                        if namelength:
+                            # Names are kept encoded, as looked up by getValues
+                            name = data[position + 3 : position + 3 + namelength]
+                        group.setdefault(name, []).append(position)
+                        position += 3 + namelength
+                        position += 2 + unpackShort(data, position)[0]
+                        if data[position] <= maxdelimiter:
+                            break
+                elif self.tags[tag] is not None and data[position] > maxdelimiter:
+                    # A value tag outside of any group
+                    raise IPPError("Unexpected tag 0x%02x in IPP message." % tag)
+                tag = data[position]
+        except (IndexError, struct_error):
+            raise IPPError("Unexpected end of IPP message.")
+
+        for attributes in self.attributes_lists:
+            self.__dict__.pop(attributes, None)
+        self._index = {}
+        self._offsets = offsets
+        self.position = position
+        self.data = self._data[position + 1 :]
+        self.parsed = True
+
+
+class IPPStreamParser:
+    """Parses an IPP message as it arrives, one group of attributes at a time.
+
+    feed() returns the groups completed by each chunk of the message, as
+    (attributes type, attributes) tuples, the attributes being a list of
+    (name, [(tagtype, value), ...]) like a group of an IPPRequest. Only the
+    current group and an incomplete attribute are kept, so huge answers are
+    parsed in constant memory. The header and any data following the
+    attributes go to self.request, an IPPRequest without attributes.
+    """
+
+    def __init__(self, debug=False):
+        """Initializes the parser."""
+        self.request = IPPRequest(debug=debug)
+        self.request.data = b""
+        self.done = False
+        self._buffer = bytearray()
+        self._header = False
+        self._attrtype = None
+        self._attributes = None
+        self._name = None
+
+    def feed(self, chunk):
+        """Parses a chunk of the message, returns the groups it completed."""
+        request = self.request
+        if self.done:
+            request.data += bytes(chunk)
+            return []
+
+        buffer = self._buffer
+        buffer += chunk
+        end = len(buffer)
+        groups = []
+        position = 0
+        if not self._header:
+            if end < 8:
+                return groups
+            request.setVersion((buffer[0], buffer[1]))
+            request.setOperationId(USHORT.unpack_from(buffer, 2)[0])
+            request.setRequestId(UINT.unpack_from(buffer, 4)[0])
+            self._header = True
+            position = 8
+
+        tags = request.tags
+        unpackShort = USHORT.unpack_from
+        endofattributes = request.tagvalues["end-of-attributes-tag"]
+        maxdelimiter = request.tagvalues["event_notification-attributes-tag"]
+        while position < end:
+            tag = buffer[position]
+            if tag <= maxdelimiter:
+                # The end of the current group
+                if self._attributes:
+                    groups.append((self._attrtype, self._attributes))
+                self._attributes = None
+                position += 1
+                if tag == endofattributes:
+                    self.done = True
+                    request.parsed = True
+                    request.data = bytes(buffer[position:])
+                    position = end
+                    break
+                self._attrtype = request.group_tags.get(tag)
+                if self._attrtype is None:
+                    raise IPPError("Unexpected tag 0x%02x in IPP message." % tag)
+                self._attributes = []
+                continue
+
+            if self._attributes is None:
+                # A value tag outside of any group
+                raise IPPError("Unexpected tag 0x%02x in IPP message." % tag)
+            # Waits for the whole attribute
+            if position + 3 > end:
+                break
+            namelength = unpackShort(buffer, position + 1)[0]
+            valuestart = position + 5 + namelength
+            if valuestart > end:
+                break
+            valuelength = unpackShort(buffer, valuestart - 2)[0]
+            valueend = valuestart + valuelength
+            if valueend > end:
+                break
+
+            tagtype = tags[tag]
+            if namelength:
+                self._name = buffer[position + 3 : valuestart - 2].decode()
+            name = self._name
+            if tagtype in ("integer", "enum"):
+                if valuelength != 4:
+                    raise IPPError("Invalid %s value in IPP message." % tagtype)
+                value = UINT.unpack_from(buffer, valuestart)[0]
             else:
-                raise IndexError
-        except IndexError:
-            self._curattributes[-1].append((name, [(tagtype, value)]))
-        self.logDebug("%s(%s) : %s" % (name, tagtype, value))
-        return posend - self.position
-
-    def operation_attributes_tag(self):
-        """Indicates that the parser enters into an operation-attributes-tag group."""
-        self._curattributes = self._operation_attributes
-        return self.parseTag()
-
-    def job_attributes_tag(self):
-        """Indicates that the parser enters into a job-attributes-tag group."""
-        self._curattributes = self._job_attributes
-        return self.parseTag()
-
-    def printer_attributes_tag(self):
-        """Indicates that the parser enters into a printer-attributes-tag group."""
-        self._curattributes = self._printer_attributes
-        return self.parseTag()
-
-    def unsupported_attributes_tag(self):
-        """Indicates that the parser enters into an unsupported-attributes-tag group."""
-        self._curattributes = self._unsupported_attributes
-        return self.parseTag()
-
-    def subscription_attributes_tag(self):
-        """Indicates that the parser enters into a subscription-attributes-tag group."""
-        self._curattributes = self._subscription_attributes
-        return self.parseTag()
-
-    def event_notification_attributes_tag(self):
-        """Indicates that the parser enters into an event-notification-attributes-tag group."""
-        self._curattributes = self._event_notification_attributes
-        return self.parseTag()
+                value = bytes(buffer[valuestart:valueend])
+                if tagtype == "boolean":
+                    value = ord(value)
+            attributes = self._attributes
+            if attributes and attributes[-1][0] == name:
+                attributes[-1][1].append((tagtype, value))
+            else:
+                attributes.append((name, [(tagtype, value)]))
+            if request.debug:
+                request.logDebug("%s(%s) : %s" % (name, tagtype, value))
+            position = valueend
+
+        del buffer[:position]
+        return groups
+
+    def close(self):
+        """Checks that the whole message was parsed."""
+        if not self.done:
+            raise IPPError("Unexpected end of IPP message.")
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """An HTTP connection over a Unix domain socket, like CUPS' local one."""
+
+    def __init__(self, *args, **kwargs):
+        """Initializes the connection to the socket at socket_path."""
+        self.socket_path = kwargs.pop("socket_path")
+        HTTPConnection.__init__(self, *args, **kwargs)
+
+    def _new_conn(self):
+        """Connects to the socket."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except socket.timeout:
+            sock.close()
+            raise ConnectTimeoutError(
+                self, "Connection to %s timed out." % self.socket_path
+            )
+        except OSError as error:
+            sock.close()
+            raise NewConnectionError(
+                self, "Failed to connect to %s : %s" % (self.socket_path, error)
+            )
+        return sock
+
+
+class UnixHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    """A pool of keep-alive connections to a Unix domain socket."""
+
+    ConnectionCls = UnixHTTPConnection
 
 
 class CUPS:
-    """A class for a CUPS instance."""
+    """A class for a CUPS instance.
+
+    Requests go through a pool of keep-alive connections, created with the
+    instance and reused by all its requests. The url may be an http:// or
+    ipp:// URL, or unix:// followed by the path of a domain socket.
+    """
 
     def __init__(
         self,
@@ -614,14 +883,26 @@ class CUPS:
         charset="utf-8",
         language="en-us",
         debug=False,
+        timeout=None,
+        retries=DEFAULT_RETRIES,
+        maxsize=DEFAULT_POOL_MAXSIZE,
     ):
-        """Initializes the CUPS instance."""
-        if url is not None:
-            self.url = url.replace("ipp://", "http://")
-            if self.url.endswith("/"):
-                self.url = self.url[:-1]
+        """Initializes the CUPS instance.
+
+        timeout : an urllib3.Timeout, or a number of seconds for both the
+                  connection and the answer.
+        retries : how many times to retry connecting, or an urllib3.Retry.
+        maxsize : how many connections to keep alive.
+        """
+        if url is None:
+            url = self.getDefaultURL()
+        self.url = url.replace("ipp://", "http://")
+        if self.url.endswith("/"):
+            self.url = self.url[:-1]
+        if self.url.startswith("unix://"):
+            self.socketPath = self.url[len("unix://") :]
         else:
-            self.url = self.getDefaultURL()
+            self.socketPath = None
         self.username = username
         self.password = password
         self.charset = charset
@@ -631,20 +912,64 @@ class CUPS:
         self.lastErrorMessage = None
         self.requestId = None
 
+        if timeout is None:
+            timeout = urllib3.Timeout(
+                connect=DEFAULT_CONNECT_TIMEOUT, read=DEFAULT_READ_TIMEOUT
+            )
+        if not isinstance(retries, urllib3.Retry):
+            retries = urllib3.Retry(
+                total=retries,
+                connect=retries,
+                read=0,
+                status=0,
+                redirect=0,
+                backoff_factor=0.1,
+            )
+        self.headers = {"Content-Type": "application/ipp"}
+        if self.username:
+            self.headers.update(
+                urllib3.make_headers(basic_auth=f"{self.username}:{self.password}")
+            )
+        self.poolOptions = {"timeout": timeout, "retries": retries, "maxsize": maxsize}
+        self.http = self.newPool()
+        self.urlPool = None
+
+    def newPool(self):
+        """Creates the connection pool to the CUPS server."""
+        if self.socketPath is not None:
+            return UnixHTTPConnectionPool(
+                "localhost", socket_path=self.socketPath, **self.poolOptions
+            )
+        return urllib3.PoolManager(**self.poolOptions)
+
+    def close(self):
+        """Closes the pooled connections."""
+        if self.socketPath is not None:
+            self.http.close()
+        else:
+            self.http.clear()
+        if self.urlPool is not None:
+            self.urlPool.clear()
+
     def getDefaultURL(self):
         """Builds a default URL."""
         # TODO : encryption methods.
-        server = os.environ.get("CUPS_SERVER") or "localhost"
-        port = os.environ.get("IPP_PORT") or 631
+        server = os.environ.get("CUPS_SERVER")
+        port = os.environ.get("IPP_PORT") or IPP_PORT
+        if server is None and os.path.exists(CUPS_DOMAIN_SOCKET):
+            server = CUPS_DOMAIN_SOCKET
+        server = server or "localhost"
         if server.startswith("/"):
-            # it seems it's a unix domain socket.
-            # we can't handle this right now, so we use the default instead.
-            return "http://localhost:%s" % port
+            # a unix domain socket
+            return "unix://%s" % server
         else:
             return "http://%s:%s" % (server, port)
 
     def identifierToURI(self, service, ident):
         """Transforms an identifier into a particular URI depending on requested service."""
+        if self.socketPath is not None:
+            # CUPS knows itself as localhost on its domain socket
+            return "ipp://localhost/%s/%s" % (service, ident)
         return "%s/%s/%s" % (self.url.replace("http://", "ipp://"), service, ident)
 
     def nextRequestId(self):
@@ -670,31 +995,137 @@ class CUPS:
             )
             return req
 
-    def doRequest(self, req, url=None):
+    def doRequest(self, req, url=None, lazy=False):
         """Sends a request to the CUPS server.
-        returns a new IPPRequest object, containing the parsed answer.
+        returns a new IPPRequest object, containing the parsed answer,
+        or None if the request failed (see lastError).
+        lazy : parse the answer lazily, for lookups of a few attributes.
         """
-        # TODO: move this pool out of the function to be reused?
-        http = urllib3.PoolManager()
+        response = self.postRequest(req, url)
+        if response is None:
+            return None
 
-        url = url or self.url
-        headers = {"Content-Type": "application/ipp"}
-        if self.username:
-            headers.update(urllib3.make_headers(basic_auth=f"{self.username}:{self.password}"))
+        ipp_response = IPPRequest(response.data)
+        ipp_response.parse(lazy)
+        return ipp_response
+
+    def iterRequest(self, req, url=None):
+        """Sends a request to the CUPS server, and yields the groups of the
+        answer, as (attributes type, attributes) tuples, as they arrive.
 
+        Nothing is yielded if the request failed (see lastError).
+        """
+        response = self.postRequest(req, url, stream=True)
+        if response is None:
+            return
+
+        parser = IPPStreamParser(debug=self.debug)
+        complete = False
+        try:
+            for chunk in response.stream(STREAM_CHUNK_SIZE):
+                for group in parser.feed(chunk):
+                    yield group
+            parser.close()
+            complete = True
+        except (HTTPError, socket.error) as error:
+            self.lastError = error
+            self.lastErrorMessage = str(error)
+        finally:
+            if not complete:
+                # Unread, the rest of the answer would be taken for the next one
+                response.close()
+            response.release_conn()
+
+    def postRequest(self, req, url=None, stream=False):
+        """Posts a request to the CUPS server.
+        returns the HTTP response, or None if the request failed (see lastError).
+        stream : leave the answer to be read from the response.
+        """
         self.lastError = None
         self.lastErrorMessage = None
 
+        http = self.http
+        if url is None:
+            # A path on the domain socket, or the server's URL
+            url = "/" if self.socketPath is not None else self.url
+        elif self.socketPath is not None:
+            # Another server, while self.http is the domain socket's pool
+            if self.urlPool is None:
+                self.urlPool = urllib3.PoolManager(**self.poolOptions)
+            http = self.urlPool
+
         try:
-            response = http.request(method="POST", url=url, headers=headers, body=req.dump())
+            response = http.request(
+                method="POST",
+                url=url,
+                headers=self.headers,
+                body=req.dump(),
+                preload_content=not stream,
+            )
         except (HTTPError, socket.error) as error:
             self.lastError = error
             self.lastErrorMessage = str(error)
             return None
-        finally:
-            ipp_response = IPPRequest(response.data)
-            ipp_response.parse()
-            return ipp_response
+
+        if response.status != 200:
+            self.lastError = response.status
+            self.lastErrorMessage = "HTTP error %s : %s" % (response.status, response.reason)
+            if stream:
+                response.drain_conn()
+                response.release_conn()
+            return None
+
+        return response
+
+    def serverURI(self):
+        """Returns the server's URI, for requests about all its queues."""
+        if self.socketPath is not None:
+            return "ipp://localhost/"
+        return "%s/" % self.url.replace("http://", "ipp://")
+
+    def iterJobs(self, queuename=None, which="not-completed", requested=("all",)):
+        """Yields the attributes of print jobs as they arrive, as dictionaries
+        of lists of (tagtype, value) tuples.
+
+        queuename : the queue whose jobs to list, all of them by default.
+        which : "not-completed", "completed" or "all".
+        requested : the attributes to return, all of them by default.
+        """
+        req = self.newJobsRequest(queuename, which, requested)
+        for (attrtype, attributes) in self.iterRequest(req):
+            if attrtype == "job":
+                yield dict(attributes)
+
+    def iterPrinters(self, requested=("all",)):
+        """Yields the attributes of print queues as they arrive, as
+        dictionaries of lists of (tagtype, value) tuples.
+
+        requested : the attributes to return, all of them by default.
+        """
+        req = self.newPrintersRequest(requested)
+        for (attrtype, attributes) in self.iterRequest(req):
+            if attrtype == "printer":
+                yield dict(attributes)
+
+    def newJobsRequest(self, queuename=None, which="not-completed", requested=("all",)):
+        """Generates an IPP_GET_JOBS request (see iterJobs)."""
+        req = self.newRequest(IPP_GET_JOBS)
+        if queuename is not None:
+            uri = self.identifierToURI("printers", queuename)
+        else:
+            uri = self.serverURI()
+        req.operation["printer-uri"] = ("uri", uri)
+        req.operation["which-jobs"] = ("keyword", which)
+        for attrib in requested:
+            req.operation["requested-attributes"] = ("keyword", attrib)
+        return req
+
+    def newPrintersRequest(self, requested=("all",)):
+        """Generates a CUPS_GET_PRINTERS request (see iterPrinters)."""
+        req = self.newRequest(CUPS_GET_PRINTERS)
+        for attrib in requested:
+            req.operation["requested-attributes"] = ("keyword", attrib)
+        return req
 
     def getPPD(self, queuename):
         """Retrieves the PPD for a particular queuename."""
@@ -719,15 +1150,15 @@ class CUPS:
 
     def getPrinters(self):
         """Returns the list of print queues names."""
-        req = self.newRequest(CUPS_GET_PRINTERS)
-        req.operation["requested-attributes"] = ("keyword", "printer-name")
+        req = self.newPrintersRequest(("printer-name",))
         req.operation["printer-type"] = ("enum", 0)
         req.operation["printer-type-mask"] = ("enum", CUPS_PRINTER_CLASS)
-        return [printer[1] for printer in self.doRequest(req).printer["printer-name"]]
+        answer = self.doRequest(req, lazy=True)
+        return [printer[1] for printer in answer.printer["printer-name"]]
 
     def getDevices(self):
         """Returns a list of devices as (deviceclass, deviceinfo, devicemakeandmodel, deviceuri) tuples."""
-        answer = self.doRequest(self.newRequest(CUPS_GET_DEVICES))
+        answer = self.doRequest(self.newRequest(CUPS_GET_DEVICES), lazy=True)
         return zip(
             [d[1] for d in answer.printer["device-class"]],
             [d[1] for d in answer.printer["device-info"]],
@@ -737,7 +1168,7 @@ class CUPS:
 
     def getPPDs(self):
         """Returns a list of PPDs as (ppdnaturallanguage, ppdmake, ppdmakeandmodel, ppdname) tuples."""
-        answer = self.doRequest(self.newRequest(CUPS_GET_PPDS))
+        answer = self.doRequest(self.newRequest(CUPS_GET_PPDS), lazy=True)
         return zip(
             [d[1] for d in answer.printer["ppd-natural-language"]],
             [d[1] for d in answer.printer["ppd-make"]],